@@ -1,6 +1,6 @@
 {
     'name': 'Gestión de Capítulos Contratados',
-    'version': '18.0.1.1.0',
+    'version': '18.0.1.5.0',
     'category': 'Sales',
     'summary': 'Gestión de capítulos técnicos y contratación de servicios agrupados',
     'description': "Gestión de capítulos técnicos como servicios completos con productos configurables para presupuestos de venta.",
@@ -14,10 +14,14 @@
     ],
     'data': [
         'security/ir.model.access.csv',
+        'security/capitulos_security.xml',
+        'data/capitulos_data.xml',
         'views/capitulo_views.xml',
         'views/sale_order_views.xml',
         'views/capitulo_wizard_view.xml',
+        'views/capitulo_mass_apply_view.xml',
         'views/product_views.xml',
+        'report/sale_order_capitulos_report.xml',
     ],
     'assets': {
         'web.assets_backend': [
@@ -1,15 +1,86 @@
 from odoo import http
-from odoo.http import request
+from odoo.exceptions import UserError
+from odoo.http import request, content_disposition
+from werkzeug.wsgi import wrap_file
+import csv
+import io
 import json
 import logging
+import tempfile
+
+from ..models.sale_order import COLUMNAS_EXPORTACION
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
 
 _logger = logging.getLogger(__name__)
 
+TIPOS_EXPORTACION = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Anchura de cada columna de la hoja de cálculo
+ANCHOS_COLUMNAS_XLSX = [14, 30, 30, 30, 45, 10, 10, 14, 12, 14, 14, 14]
+
+# Primera columna numérica (Cantidad) de ``COLUMNAS_EXPORTACION``
+PRIMERA_COLUMNA_NUMERICA = 5
+
+
+def _escribir_csv(filas, fichero):
+    """Escribe las filas en el fichero una a una"""
+    texto = io.TextIOWrapper(fichero, encoding='utf-8-sig', newline='')
+    writer = csv.writer(texto)
+    writer.writerow(COLUMNAS_EXPORTACION)
+    for _tipo, fila in filas:
+        writer.writerow(['' if valor is None else valor for valor in fila])
+    texto.flush()
+    # El fichero sigue abierto para enviarlo
+    texto.detach()
+
+
+def _escribir_xlsx(filas, fichero):
+    """Escribe las filas en una hoja en modo de memoria constante.
+
+    En ``constant_memory`` xlsxwriter vuelca cada fila a disco en cuanto se
+    pasa a la siguiente, por lo que las filas deben escribirse en orden.
+    """
+    libro = xlsxwriter.Workbook(fichero, {'constant_memory': True})
+    hoja = libro.add_worksheet('Capítulos')
+    negrita = libro.add_format({'bold': True})
+    formatos = {
+        'pedido': libro.add_format({'bold': True, 'bg_color': '#D9D9D9'}),
+        'capitulo': libro.add_format({'bold': True, 'bg_color': '#DDEBF7'}),
+        'seccion': libro.add_format({'bold': True, 'bg_color': '#FFF2CC'}),
+        'condiciones': libro.add_format({'italic': True, 'text_wrap': True}),
+        'nota': libro.add_format({'italic': True, 'text_wrap': True}),
+        'linea': None,
+    }
+    numeros = {tipo: libro.add_format(dict(
+        {'num_format': '#,##0.00'},
+        bold=tipo in ('pedido', 'capitulo', 'seccion'),
+    )) for tipo in formatos}
+    for columna, ancho in enumerate(ANCHOS_COLUMNAS_XLSX):
+        hoja.set_column(columna, columna, ancho)
+    hoja.write_row(0, 0, COLUMNAS_EXPORTACION, negrita)
+    hoja.freeze_panes(1, 0)
+    for num_fila, (tipo, fila) in enumerate(filas, start=1):
+        for columna, valor in enumerate(fila):
+            if valor is None or valor == '':
+                continue
+            if columna >= PRIMERA_COLUMNA_NUMERICA and isinstance(valor, (int, float)):
+                hoja.write_number(num_fila, columna, valor, numeros[tipo])
+            else:
+                hoja.write_string(num_fila, columna, str(valor), formatos[tipo])
+    libro.close()
+
 class CapitulosController(http.Controller):
     
 
     @http.route('/capitulos/add_product_to_section', type='json', auth='user', methods=['POST'])
-    def add_product_to_section(self, order_id, capitulo_name, seccion_name, product_id, quantity=1.0):
+    def add_product_to_section(self, order_id, capitulo_name, seccion_name, product_id, quantity=1.0, seccion_key=None):
         """Endpoint para añadir un producto a una sección específica"""
         try:
             # Validar parámetros
@@ -35,11 +106,13 @@ class CapitulosController(http.Controller):
                 return {'success': False, 'error': 'Sin permisos para modificar pedidos'}
             
             # Llamar al método del modelo
-            result = order.add_product_to_section(
-                capitulo_name=capitulo_name,
-                seccion_name=seccion_name,
-                product_id=int(product_id),
-                quantity=float(quantity)
+            result = request.env['sale.order'].add_product_to_section(
+                order.id,
+                capitulo_name,
+                seccion_name,
+                int(product_id),
+                quantity=float(quantity),
+                seccion_key=seccion_key,
             )
             
             _logger.info(f"Producto añadido exitosamente: {result}")
@@ -54,28 +127,67 @@ class CapitulosController(http.Controller):
             return {'success': False, 'error': str(e)}
     
     @http.route('/capitulos/search_products', type='json', auth='user', methods=['POST'])
-    def search_products(self, query='', limit=10):
-        """Endpoint para buscar productos"""
+    def search_products(self, query='', limit=10, offset=0, categ_id=None):
+        """Endpoint para buscar productos (filas compactas, en caché y paginadas)"""
         try:
-            domain = [('sale_ok', '=', True)]
-            
-            if query:
-                domain.append(('name', 'ilike', query))
-            
-            products = request.env['product.product'].search(domain, limit=limit)
-            
-            result = []
-            for product in products:
-                result.append({
-                    'id': product.id,
-                    'name': product.name,
-                    'default_code': product.default_code or '',
-                    'list_price': product.list_price,
-                    'uom_name': product.uom_id.name
-                })
-            
-            return {'success': True, 'products': result}
+            result = request.env['capitulos.product.lookup'].search_products(
+                categ_id=categ_id and int(categ_id),
+                query=query,
+                offset=offset,
+                limit=limit,
+            )
+            return dict(result, success=True)
             
         except Exception as e:
             _logger.error(f"Error en search_products: {str(e)}")
-            return {'success': False, 'error': str(e)}
\ No newline at end of file
+            return {'success': False, 'error': str(e)}
+    
+    @http.route('/capitulos/perf/stats', type='json', auth='user', methods=['POST'])
+    def perf_stats(self, reset=False):
+        """Endpoint para consultar (y opcionalmente reiniciar) las métricas de rendimiento"""
+        Perf = request.env['capitulos.perf']
+        stats = Perf.get_stats()
+        if reset:
+            Perf.reset_stats()
+        return stats
+
+    @http.route('/capitulos/export/<string:formato>', type='http', auth='user', methods=['GET'])
+    def export_capitulos(self, formato, order_ids='', **kwargs):
+        """Descarga los pedidos indicados agrupados por capítulos y secciones.
+
+        Las filas se generan recorriendo la estructura de cada pedido por
+        bloques y se escriben a medida en un fichero temporal, que se envía
+        al cliente por partes: ni el pedido ni el fichero completos llegan a
+        estar en memoria.
+        """
+        if formato not in TIPOS_EXPORTACION:
+            raise UserError(f"Formato de exportación no soportado: {formato}")
+        if formato == 'xlsx' and xlsxwriter is None:
+            raise UserError("La exportación a Excel requiere la librería xlsxwriter. Exporte en CSV.")
+        try:
+            ids = [int(order_id) for order_id in order_ids.split(',') if order_id]
+        except ValueError:
+            raise UserError("Identificadores de pedido no válidos.")
+        orders = request.env['sale.order'].browse(ids).exists()
+        if not orders:
+            raise UserError("No se ha encontrado ningún pedido para exportar.")
+        orders.check_access('read')
+
+        with request.env['capitulos.perf']._medir(f'exportar_{formato}') as metricas:
+            metricas['pedidos'] = len(orders)
+            fichero = tempfile.TemporaryFile()
+            filas = orders._capitulos_filas_exportacion()
+            if formato == 'csv':
+                _escribir_csv(filas, fichero)
+            else:
+                _escribir_xlsx(filas, fichero)
+            tamano = fichero.seek(0, io.SEEK_END)
+            fichero.seek(0)
+            metricas['bytes'] = tamano
+
+        nombre = orders.name if len(orders) == 1 else 'presupuestos'
+        return request.make_response(wrap_file(request.httprequest.environ, fichero), headers=[
+            ('Content-Type', TIPOS_EXPORTACION[formato]),
+            ('Content-Length', str(tamano)),
+            ('Content-Disposition', content_disposition(f"{nombre}_capitulos.{formato}")),
+        ])
@@ -0,0 +1,11 @@
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Asigna las claves estructurales a los capítulos ya existentes en pedidos"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    encabezados = env['sale.order.line'].search([
+        ('capitulo_key', '=', False),
+        '|', ('es_encabezado_capitulo', '=', True), ('es_encabezado_seccion', '=', True),
+    ])
+    encabezados.order_id._capitulos_asegurar_claves()
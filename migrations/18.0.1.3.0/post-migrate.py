@@ -0,0 +1,11 @@
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Crea las instancias de capítulo y sección de los pedidos existentes y enlaza sus líneas"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    encabezados = env['sale.order.line'].search([
+        ('order_capitulo_id', '=', False),
+        '|', ('es_encabezado_capitulo', '=', True), ('es_encabezado_seccion', '=', True),
+    ])
+    encabezados.order_id._capitulos_sincronizar_instancias()
@@ -0,0 +1,13 @@
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Enlaza por posición las líneas añadidas fuera del wizard en pedidos con capítulos"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    lineas = env['sale.order.line'].search([
+        ('capitulo_key', '=', False),
+        ('es_encabezado_capitulo', '=', False),
+        ('es_encabezado_seccion', '=', False),
+        ('order_id.order_line.es_encabezado_capitulo', '=', True),
+    ])
+    lineas._capitulos_enlazar_por_posicion()
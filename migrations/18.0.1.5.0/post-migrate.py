@@ -0,0 +1,11 @@
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Recalcula los fragmentos del acordeón"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    # Los fragmentos guardan ahora ids de producto, unidad y categoría en lugar de nombres
+    capitulos = env['sale.order.capitulo'].search([])
+    for nombre in ('payload_encabezado', 'payload_fragmento', 'payload_fragmento_estructura'):
+        env.add_to_compute(capitulos._fields[nombre], capitulos)
+    capitulos.flush_recordset()
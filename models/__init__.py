@@ -1,4 +1,10 @@
 from . import capitulo
 from . import capitulo_seccion
 from . import sale_order
+from . import sale_order_capitulo
 from . import product_template
+from . import product_product
+from . import product_category
+from . import capitulos_perf
+from . import capitulos_product_lookup
+from . import capitulo_apply_job
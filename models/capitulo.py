@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from collections import defaultdict
 from odoo import models, fields, api
 from odoo.exceptions import UserError
 import logging
@@ -14,10 +15,16 @@ class CapituloContrato(models.Model):
     description = fields.Text(string='Descripción')
     seccion_ids = fields.One2many('capitulo.seccion', 'capitulo_id', string='Secciones')
     condiciones_legales = fields.Text(string='Condiciones Legales')
-    plantilla_id = fields.Many2one('capitulo.contrato', string='Basado en Plantilla', 
+    plantilla_id = fields.Many2one('capitulo.contrato', string='Basado en Plantilla', index=True,
                                    help='Selecciona un capítulo existente como plantilla')
     es_plantilla = fields.Boolean(string='Es Plantilla', default=False,
                                   help='Marca este capítulo como plantilla para ser usado por otros')
+    modo_precio_copia = fields.Selection([
+        ('plantilla', 'Como en la Plantilla'),
+        ('vivo', 'Precio Actual del Producto'),
+        ('congelado', 'Congelar Precio Actual'),
+    ], string='Precios al Copiar', default='plantilla',
+       help='Cómo se copian los precios de las líneas al crear el capítulo desde una plantilla')
     capitulos_dependientes_count = fields.Integer(
         string='Capítulos Dependientes', 
         compute='_compute_capitulos_dependientes_count',
@@ -27,43 +34,174 @@ class CapituloContrato(models.Model):
     @api.depends('es_plantilla')
     def _compute_capitulos_dependientes_count(self):
         """Calcula el número de capítulos que dependen de esta plantilla"""
+        # Un único recuento agrupado para todas las plantillas del conjunto
+        plantilla_ids = [r._origin.id for r in self if r.es_plantilla and r._origin.id]
+        conteos = {}
+        if plantilla_ids:
+            conteos = dict(
+                (plantilla.id, cantidad)
+                for plantilla, cantidad in self._read_group(
+                    [('plantilla_id', 'in', plantilla_ids)], ['plantilla_id'], ['__count'],
+                )
+            )
         for record in self:
-            if record.es_plantilla:
-                record.capitulos_dependientes_count = self.search_count([('plantilla_id', '=', record.id)])
+            record.capitulos_dependientes_count = conteos.get(record._origin.id, 0) if record.es_plantilla else 0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Los capítulos creados desde una plantilla copian en bloque sus secciones y condiciones.
+
+        Es el único camino de copia, también desde el formulario: las
+        secciones de la plantilla se insertan al guardar, junto a las que el
+        usuario haya añadido. Con ``capitulos_clonar_plantilla=False`` en el
+        contexto no se copia nada.
+        """
+        records = super().create(vals_list)
+        if not self.env.context.get('capitulos_clonar_plantilla', True):
+            return records
+        for record, vals in zip(records, vals_list):
+            if record.plantilla_id:
+                record.plantilla_id._clonar_secciones_en(record, record.modo_precio_copia)
+                if 'condiciones_legales' not in vals:
+                    record.condiciones_legales = record.plantilla_id.condiciones_legales
+        return records
+
+    def _plantilla_estructura(self, modo_precio='plantilla'):
+        """Lee de una vez las secciones y líneas del capítulo para copiarlas.
+
+        Devuelve una lista de secciones (diccionarios con sus valores y la
+        clave ``lineas``) en el orden del capítulo. Las secciones, las líneas
+        y los precios de venta de los productos se leen con una consulta cada
+        uno, sin recorrer registro a registro. ``precio`` es el precio que
+        tiene hoy cada línea y ``modo_precio``/``precio_congelado`` los valores
+        que debe llevar la copia:
+
+        - ``plantilla``: cada línea conserva su modo de precio.
+        - ``vivo``: todas las líneas siguen el precio del producto.
+        - ``congelado``: todas las líneas fijan el precio que tienen hoy.
+        """
+        self.ensure_one()
+        secciones = self.env['capitulo.seccion'].search_read(
+            [('capitulo_id', '=', self.id)],
+            ['name', 'sequence', 'descripcion', 'es_fija', 'product_category_id'],
+            order='sequence, name, id', load=None,
+        )
+        lineas = self.env['capitulo.seccion.line'].search_read(
+            [('seccion_id', 'in', [seccion['id'] for seccion in secciones])],
+            ['seccion_id', 'product_id', 'cantidad', 'sequence', 'descripcion_personalizada',
+             'es_opcional', 'modo_precio', 'precio_congelado'],
+            order='sequence, id', load=None,
+        )
+        ids_productos = {linea['product_id'] for linea in lineas if linea['modo_precio'] == 'vivo'}
+        precios = {
+            producto['id']: producto['list_price']
+            for producto in self.env['product.product'].browse(ids_productos).read(['list_price'])
+        }
+        
+        lineas_por_seccion = defaultdict(list)
+        for linea in lineas:
+            if linea['modo_precio'] == 'congelado':
+                precio = linea['precio_congelado']
             else:
-                record.capitulos_dependientes_count = 0
+                precio = precios.get(linea['product_id'], 0.0)
+            modo = linea['modo_precio'] if modo_precio == 'plantilla' else modo_precio
+            lineas_por_seccion[linea['seccion_id']].append({
+                'product_id': linea['product_id'],
+                'cantidad': linea['cantidad'],
+                'sequence': linea['sequence'],
+                'descripcion_personalizada': linea['descripcion_personalizada'],
+                'es_opcional': linea['es_opcional'],
+                'modo_precio': modo,
+                'precio_congelado': precio if modo == 'congelado' else linea['precio_congelado'],
+                'precio': precio,
+            })
+        for seccion in secciones:
+            seccion['lineas'] = lineas_por_seccion[seccion['id']]
+        return secciones
+
+    def _secciones_para_pedido(self, modo_precio='plantilla', incluir_vacias=False):
+        """Secciones del capítulo en el formato que inserta ``sale.order``.
+
+        Mismo formato que ``capitulo.wizard._preparar_secciones``, pero leído
+        directamente de la plantilla: permite preparar los valores una sola
+        vez y reutilizarlos en muchos pedidos. Salvo ``incluir_vacias``, se
+        omiten las secciones sin productos, igual que en el wizard.
+        """
+        self.ensure_one()
+        estructura = self._plantilla_estructura(modo_precio)
+        ids_productos = {linea['product_id'] for seccion in estructura for linea in seccion['lineas']}
+        productos = {
+            producto['id']: producto
+            for producto in self.env['product.product'].browse(ids_productos).read(['name', 'uom_id'], load=None)
+        }
+        secciones = []
+        for seccion in estructura:
+            if not seccion['lineas'] and not incluir_vacias:
+                continue
+            secciones.append({
+                'name': seccion['name'],
+                'es_fija': seccion['es_fija'],
+                'origen_seccion_id': seccion['id'],
+                'lineas': [{
+                    'product_id': linea['product_id'],
+                    'name': linea['descripcion_personalizada'] or productos[linea['product_id']]['name'],
+                    'price_unit': linea['precio'],
+                    'product_uom_qty': linea['cantidad'],
+                    'product_uom': productos[linea['product_id']]['uom_id'],
+                } for linea in seccion['lineas']],
+            })
+        return secciones
+
+    @api.model
+    def _valores_linea_copia(self, linea):
+        """Valores de ``capitulo.seccion.line`` para una línea de la estructura.
+
+        No se escribe ``precio_unitario``: con precio vivo eso modificaría el
+        precio de venta del producto.
+        """
+        return {
+            'product_id': linea['product_id'],
+            'cantidad': linea['cantidad'],
+            'sequence': linea['sequence'],
+            'descripcion_personalizada': linea['descripcion_personalizada'],
+            'es_opcional': linea['es_opcional'],
+            'modo_precio': linea['modo_precio'],
+            'precio_congelado': linea['precio_congelado'],
+        }
+
+    @api.model
+    def _valores_seccion_copia(self, seccion):
+        return {
+            'name': seccion['name'],
+            'sequence': seccion['sequence'],
+            'descripcion': seccion['descripcion'],
+            'es_fija': seccion['es_fija'],
+            'product_category_id': seccion['product_category_id'],
+        }
+
+    def _clonar_secciones_en(self, destino, modo_precio='plantilla'):
+        """Copia las secciones y líneas de esta plantilla en ``destino``.
+
+        Secciones y líneas se insertan con una creación en bloque cada una,
+        independientemente del tamaño de la plantilla.
+        """
+        self.ensure_one()
+        estructura = self._plantilla_estructura(modo_precio)
+        secciones = self.env['capitulo.seccion'].create([
+            dict(self._valores_seccion_copia(seccion), capitulo_id=destino.id)
+            for seccion in estructura
+        ])
+        self.env['capitulo.seccion.line'].create([
+            dict(self._valores_linea_copia(linea), seccion_id=seccion.id)
+            for seccion, datos in zip(secciones, estructura)
+            for linea in datos['lineas']
+        ])
+        return secciones
 
     @api.onchange('plantilla_id')
     def _onchange_plantilla_id(self):
-        """Copia las secciones y productos de la plantilla seleccionada"""
+        """Propone las condiciones de la plantilla; sus secciones se copian al crear el capítulo"""
         if self.plantilla_id:
-            # Limpiar secciones existentes
-            self.seccion_ids = [(5, 0, 0)]
-            
-            # Copiar secciones de la plantilla
-            secciones_vals = []
-            for seccion in self.plantilla_id.seccion_ids:
-                # Copiar líneas de productos de la sección
-                lineas_vals = []
-                for linea in seccion.product_line_ids:
-                    lineas_vals.append((0, 0, {
-                        'product_id': linea.product_id.id,
-                        'cantidad': linea.cantidad,
-                        'precio_unitario': linea.precio_unitario,
-                        'sequence': linea.sequence,
-                        'descripcion_personalizada': linea.descripcion_personalizada,
-                        'es_opcional': linea.es_opcional,
-                    }))
-                
-                secciones_vals.append((0, 0, {
-                    'name': seccion.name,
-                    'sequence': seccion.sequence,
-                    'descripcion': seccion.descripcion,
-                    'es_fija': seccion.es_fija,
-                    'product_line_ids': lineas_vals,
-                }))
-            
-            self.seccion_ids = secciones_vals
             self.condiciones_legales = self.plantilla_id.condiciones_legales
 
     def action_crear_desde_plantilla(self):
@@ -80,19 +218,51 @@ class CapituloContrato(models.Model):
             }
         }
     
+    def _desvincular_dependientes(self):
+        """Desvincula con una sola escritura los capítulos que usan estas plantillas"""
+        plantillas = self.filtered('es_plantilla')
+        if not plantillas:
+            return self.browse()
+        # Los capítulos que también se eliminan no necesitan desvincularse
+        dependientes = self.search([
+            ('plantilla_id', 'in', plantillas.ids),
+            ('id', 'not in', self.ids),
+        ])
+        if dependientes:
+            # En lugar de bloquear completamente, limpiar las referencias
+            dependientes.write({'plantilla_id': False})
+            _logger.info(
+                f"Plantillas {', '.join(plantillas.mapped('name'))} eliminadas. "
+                f"Se han desvinculado {len(dependientes)} capítulos que las utilizaban."
+            )
+        return dependientes
+    
+    def _lineas_fuera_de_categoria(self):
+        """Líneas de sección cuyo producto no pertenece a la categoría de su sección.
+
+        La validación del wizard solo se aplica al guardar, así que los datos
+        anteriores pueden incumplirla: se registra un aviso por capítulo
+        afectado y se devuelven las líneas para poder corregirlas.
+        """
+        Category = self.env['product.category']
+        lineas = self.env['capitulo.seccion.line']
+        for seccion in self.seccion_ids.filtered('product_category_id'):
+            fuera = Category._capitulos_productos_fuera_de_categoria(
+                seccion.product_line_ids.product_id, seccion.product_category_id.id,
+            )
+            lineas |= seccion.product_line_ids.filtered(lambda l: l.product_id in fuera)
+        for capitulo in lineas.seccion_id.capitulo_id:
+            detalle = ', '.join(
+                f"{linea.product_id.display_name} en '{linea.seccion_id.name}' "
+                f"(categoría requerida: {linea.seccion_id.product_category_id.complete_name})"
+                for linea in lineas.filtered(lambda l: l.seccion_id.capitulo_id == capitulo)
+            )
+            _logger.warning(f"Capítulo '{capitulo.name}' (id {capitulo.id}) con productos fuera de categoría: {detalle}")
+        return lineas
+    
     def unlink(self):
         """Permite eliminar plantillas con validaciones mejoradas"""
-        for record in self:
-            if record.es_plantilla:
-                # Verificar si la plantilla está siendo utilizada
-                capitulos_usando_plantilla = self.search([('plantilla_id', '=', record.id)])
-                if capitulos_usando_plantilla:
-                    # En lugar de bloquear completamente, limpiar las referencias
-                    capitulos_usando_plantilla.write({'plantilla_id': False})
-                    # Mostrar mensaje informativo
-                    _logger.info(
-                        f"Plantilla '{record.name}' eliminada. Se han desvinculado {len(capitulos_usando_plantilla)} capítulos que la utilizaban."
-                    )
+        self._desvincular_dependientes()
         return super().unlink()
     
     def action_eliminar_plantilla_forzado(self):
@@ -101,17 +271,11 @@ class CapituloContrato(models.Model):
         if not self.es_plantilla:
             raise UserError("Este registro no es una plantilla.")
         
-        # Buscar capítulos que usan esta plantilla
-        capitulos_dependientes = self.search([('plantilla_id', '=', self.id)])
+        # Desvincular capítulos dependientes
+        capitulos_dependientes = self._desvincular_dependientes()
         
         if capitulos_dependientes:
-            # Desvincular capítulos dependientes
-            capitulos_dependientes.write({'plantilla_id': False})
-            
-            # Log de la operación
-            _logger.info(
-                f"Plantilla '{self.name}' eliminada. Capítulos desvinculados: {', '.join(capitulos_dependientes.mapped('name'))}"
-            )
+            nombres_dependientes = ', '.join(capitulos_dependientes.mapped('name'))
             
             # Eliminar la plantilla
             nombre_plantilla = self.name
@@ -122,7 +286,7 @@ class CapituloContrato(models.Model):
                 'tag': 'display_notification',
                 'params': {
                     'title': 'Plantilla Eliminada',
-                    'message': f'La plantilla "{nombre_plantilla}" ha sido eliminada. Se han desvinculado {len(capitulos_dependientes)} capítulos que la utilizaban: {', '.join(capitulos_dependientes.mapped("name"))}',
+                    'message': f'La plantilla "{nombre_plantilla}" ha sido eliminada. Se han desvinculado {len(capitulos_dependientes)} capítulos que la utilizaban: {nombres_dependientes}',
                     'type': 'success',
                     'sticky': True,
                 }
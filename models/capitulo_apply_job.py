@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+import time
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# Líneas que se insertan y confirman en cada bloque
+PARAM_TAMANO_BLOQUE = 'capitulos.apply_job_chunk_size'
+TAMANO_BLOQUE_DEFECTO = 500
+
+# Capítulos con más líneas que este umbral se aplican siempre en segundo plano (0 lo desactiva)
+PARAM_UMBRAL_SEGUNDO_PLANO = 'capitulos.async_line_threshold'
+UMBRAL_SEGUNDO_PLANO_DEFECTO = 2000
+
+# Tiempo máximo de cada ejecución del cron; si quedan bloques se vuelve a programar
+TIEMPO_MAXIMO_EJECUCION = 120
+
+ESTADOS_ACTIVOS = ('pendiente', 'en_curso')
+
+
+class CapituloApplyJob(models.Model):
+    _name = 'capitulo.apply.job'
+    _description = 'Aplicación de Capítulo en Segundo Plano'
+    _order = 'id'
+
+    name = fields.Char(string='Capítulo', required=True)
+    order_id = fields.Many2one('sale.order', string='Pedido de Venta', required=True, ondelete='cascade', index=True)
+    capitulo_id = fields.Many2one('capitulo.contrato', string='Capítulo de Origen', ondelete='set null')
+    user_id = fields.Many2one('res.users', string='Usuario', required=True, default=lambda self: self.env.user)
+    state = fields.Selection([
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En Curso'),
+        ('hecho', 'Completado'),
+        ('error', 'Error'),
+    ], string='Estado', default='pendiente', required=True, index=True)
+    lineas_total = fields.Integer(string='Líneas Totales', readonly=True)
+    lineas_insertadas = fields.Integer(string='Líneas Insertadas', readonly=True)
+    progreso = fields.Float(string='Progreso (%)', compute='_compute_progreso')
+    mensaje_error = fields.Text(string='Error', readonly=True)
+    # Valores de todas las líneas, preparados al encolar; se vacía al terminar
+    vals_json = fields.Text(string='Valores de las Líneas', prefetch=False)
+
+    @api.depends('lineas_total', 'lineas_insertadas')
+    def _compute_progreso(self):
+        for job in self:
+            job.progreso = 100.0 * job.lineas_insertadas / job.lineas_total if job.lineas_total else 0.0
+
+    @api.model
+    def _umbral_segundo_plano(self):
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            PARAM_UMBRAL_SEGUNDO_PLANO, UMBRAL_SEGUNDO_PLANO_DEFECTO)
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            _logger.warning(f"Valor no válido para {PARAM_UMBRAL_SEGUNDO_PLANO}: {valor}")
+            return UMBRAL_SEGUNDO_PLANO_DEFECTO
+
+    @api.model
+    def _tamano_bloque(self):
+        valor = self.env['ir.config_parameter'].sudo().get_param(PARAM_TAMANO_BLOQUE, TAMANO_BLOQUE_DEFECTO)
+        try:
+            return max(int(valor), 1)
+        except (TypeError, ValueError):
+            _logger.warning(f"Valor no válido para {PARAM_TAMANO_BLOQUE}: {valor}")
+            return TAMANO_BLOQUE_DEFECTO
+
+    @api.model
+    def _encolar(self, order, nombre_capitulo, capitulo, vals_list):
+        """Crea el trabajo con las líneas ya preparadas y despierta al cron.
+
+        Los usuarios solo pueden leer los trabajos: se crean como superusuario
+        tras comprobar que el usuario puede modificar el pedido.
+        """
+        order.check_access('write')
+        job = self.sudo().create({
+            'name': nombre_capitulo,
+            'order_id': order.id,
+            'user_id': self.env.uid,
+            'capitulo_id': capitulo.id if capitulo else False,
+            'lineas_total': len(vals_list),
+            'vals_json': json.dumps(vals_list),
+        })
+        self.env.ref('capitulos.ir_cron_capitulo_apply_job')._trigger()
+        return job
+
+    def _confirmar(self):
+        # Durante los tests no se puede confirmar la transacción
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _procesar(self, tamano_bloque, limite):
+        """Inserta los bloques pendientes del trabajo hasta terminar o agotar el tiempo.
+
+        El avance se guarda en la misma transacción que las líneas de cada
+        bloque: si el proceso se interrumpe, ambos se deshacen y el trabajo se
+        reanuda desde el último bloque confirmado sin duplicar líneas.
+        Devuelve True si el trabajo ha terminado.
+        """
+        self.ensure_one()
+        vals_list = json.loads(self.vals_json or '[]')
+        SaleOrderLine = self.env['sale.order.line'].with_user(self.user_id).with_company(
+            self.order_id.company_id
+        ).with_context(from_capitulo_wizard=True)
+        if self.state == 'pendiente':
+            self.state = 'en_curso'
+
+        with self.env['capitulos.perf']._medir('procesar_trabajo_capitulo') as metricas:
+            metricas['lineas_creadas'] = 0
+            while self.lineas_insertadas < len(vals_list):
+                if time.monotonic() > limite:
+                    return False
+                bloque = vals_list[self.lineas_insertadas:self.lineas_insertadas + tamano_bloque]
+                SaleOrderLine.create(bloque)
+                self.lineas_insertadas += len(bloque)
+                metricas['lineas_creadas'] += len(bloque)
+                self._confirmar()
+
+        self.write({'state': 'hecho', 'vals_json': False})
+        self._confirmar()
+        return True
+
+    @api.model
+    def _cron_procesar(self):
+        """Procesa los trabajos pendientes por orden de llegada.
+
+        Un mismo cron no se ejecuta en paralelo en varios workers, por lo que
+        cada trabajo solo lo procesa un proceso a la vez.
+        """
+        tamano_bloque = self._tamano_bloque()
+        limite = time.monotonic() + TIEMPO_MAXIMO_EJECUCION
+        while True:
+            job = self.search([('state', 'in', ESTADOS_ACTIVOS)], limit=1)
+            if not job:
+                return
+            try:
+                terminado = job._procesar(tamano_bloque, limite)
+            except Exception as e:
+                self.env.cr.rollback()
+                self.env.invalidate_all()
+                _logger.exception(f"Error al aplicar el capítulo del trabajo {job.id} en el pedido {job.order_id.id}")
+                job.write({'state': 'error', 'mensaje_error': str(e)})
+                self._confirmar()
+                continue
+            if not terminado:
+                # Quedan bloques: se continúa en una nueva ejecución del cron
+                self.env.ref('capitulos.ir_cron_capitulo_apply_job')._trigger()
+                return
+
+    def action_reintentar(self):
+        """Reanuda un trabajo con error desde el último bloque confirmado"""
+        self.filtered(lambda j: j.state == 'error').write({'state': 'pendiente', 'mensaje_error': False})
+        self.env.ref('capitulos.ir_cron_capitulo_apply_job')._trigger()
+        return True
+
+    @api.model
+    def _trabajo_del_pedido(self, job_id):
+        """Trabajo como superusuario, tras comprobar que el usuario puede modificar su pedido"""
+        job = self.sudo().browse(job_id).exists()
+        if not job:
+            raise UserError("El trabajo ya no existe.")
+        job.order_id.with_env(self.env).check_access('write')
+        return job
+
+    @api.model
+    def get_order_progress(self, order_id):
+        """Estado de los trabajos del pedido que el acordeón muestra como barra de progreso.
+
+        Cualquier usuario que pueda leer el pedido ve el progreso de todos sus
+        trabajos, aunque los haya encolado otro usuario.
+        """
+        self.env['sale.order'].browse(order_id).check_access('read')
+        jobs = self.sudo().search([('order_id', '=', order_id), ('state', '!=', 'hecho')])
+        return [{
+            'id': job.id,
+            'name': job.name,
+            'state': job.state,
+            'lineas_insertadas': job.lineas_insertadas,
+            'lineas_total': job.lineas_total,
+            'progreso': job.progreso,
+            'mensaje_error': job.mensaje_error or '',
+        } for job in jobs]
+
+    @api.model
+    def retry_job(self, job_id):
+        return self._trabajo_del_pedido(job_id).action_reintentar()
+
+    @api.model
+    def dismiss_job(self, job_id):
+        """Descarta un trabajo con error; las líneas ya insertadas se conservan"""
+        job = self._trabajo_del_pedido(job_id)
+        if job.state in ESTADOS_ACTIVOS:
+            raise UserError("No se puede descartar un trabajo en curso.")
+        job.unlink()
+        return True
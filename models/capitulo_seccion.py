@@ -27,11 +27,38 @@ class CapituloSeccionLine(models.Model):
     seccion_id = fields.Many2one('capitulo.seccion', string='Sección', ondelete='cascade', required=True)
     product_id = fields.Many2one('product.product', string='Producto', required=True)
     cantidad = fields.Float(string='Cantidad', default=1, required=True)
-    precio_unitario = fields.Float(string='Precio Unitario', related='product_id.list_price', readonly=False)
+    modo_precio = fields.Selection([
+        ('vivo', 'Precio del Producto'),
+        ('congelado', 'Precio Congelado'),
+    ], string='Modo de Precio', default='vivo', required=True,
+       help="Precio del Producto: sigue siempre el precio de venta actual del producto.\n"
+            "Precio Congelado: conserva el precio indicado en la línea aunque cambie el del producto.")
+    precio_congelado = fields.Float(string='Precio Congelado')
+    precio_unitario = fields.Float(
+        string='Precio Unitario',
+        compute='_compute_precio_unitario',
+        inverse='_inverse_precio_unitario',
+    )
     sequence = fields.Integer(string='Secuencia', default=10)
     descripcion_personalizada = fields.Char(string='Descripción Personalizada')
     es_opcional = fields.Boolean(string='Opcional', default=False)
     
+    @api.depends('modo_precio', 'precio_congelado', 'product_id.list_price')
+    def _compute_precio_unitario(self):
+        for line in self:
+            if line.modo_precio == 'congelado':
+                line.precio_unitario = line.precio_congelado
+            else:
+                line.precio_unitario = line.product_id.list_price
+    
+    def _inverse_precio_unitario(self):
+        """Con precio vivo se actualiza el precio del producto; con precio congelado, solo la línea"""
+        for line in self:
+            if line.modo_precio == 'congelado':
+                line.precio_congelado = line.precio_unitario
+            else:
+                line.product_id.list_price = line.precio_unitario
+    
     @api.depends('cantidad', 'precio_unitario')
     def _compute_subtotal(self):
         for line in self:
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from odoo import models, api
+from odoo.exceptions import AccessError
+from odoo.tools import str2bool
+
+_logger = logging.getLogger(__name__)
+
+# Parámetro de sistema que activa la instrumentación
+PARAM_PERF_ACTIVO = 'capitulos.perf_enabled'
+
+# Métricas acumuladas por base de datos y operación. Son propias de cada
+# proceso: con varios workers, cada uno publica sus propias cifras.
+_metricas = {}
+_metricas_lock = threading.Lock()
+
+
+class CapitulosPerf(models.AbstractModel):
+    _name = 'capitulos.perf'
+    _description = 'Instrumentación de Rendimiento de Capítulos'
+
+    @api.model
+    def _perf_activo(self):
+        """Indica si la instrumentación está activada (parámetro en caché del ORM)"""
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param(PARAM_PERF_ACTIVO, 'False'))
+
+    @contextmanager
+    def _medir(self, operacion):
+        """Mide duración y consultas SQL de ``operacion``.
+
+        Devuelve un diccionario en el que el código medido puede sumar
+        contadores propios (líneas procesadas, bytes generados...). Con la
+        instrumentación desactivada solo cuesta la lectura del parámetro.
+        """
+        contadores = {}
+        if not self._perf_activo():
+            yield contadores
+            return
+
+        cr = self.env.cr
+        consultas_inicio = cr.sql_log_count
+        inicio = time.perf_counter()
+        try:
+            yield contadores
+        finally:
+            duracion_ms = (time.perf_counter() - inicio) * 1000.0
+            contadores['consultas_sql'] = cr.sql_log_count - consultas_inicio
+            self._acumular(operacion, duracion_ms, contadores)
+            _logger.debug("%s: %.1f ms %s", operacion, duracion_ms, contadores)
+
+    @api.model
+    def _registrar(self, operacion, **contadores):
+        """Suma contadores a una operación sin medir tiempos"""
+        if self._perf_activo():
+            self._acumular(operacion, None, contadores)
+
+    @api.model
+    def _acumular(self, operacion, duracion_ms, contadores):
+        with _metricas_lock:
+            metricas_db = _metricas.setdefault(self.env.cr.dbname, {})
+            metrica = metricas_db.setdefault(operacion, {
+                'llamadas': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+            })
+            metrica['llamadas'] += 1
+            if duracion_ms is not None:
+                metrica['total_ms'] += duracion_ms
+                metrica['max_ms'] = max(metrica['max_ms'], duracion_ms)
+            for nombre, valor in contadores.items():
+                metrica[nombre] = metrica.get(nombre, 0) + valor
+
+    def _comprobar_acceso(self):
+        if not self.env.user.has_group('base.group_system'):
+            raise AccessError("Solo los administradores pueden consultar las métricas de capítulos.")
+
+    @api.model
+    def get_stats(self):
+        """Devuelve las métricas acumuladas en este proceso para la base de datos actual"""
+        self._comprobar_acceso()
+        with _metricas_lock:
+            metricas_db = _metricas.get(self.env.cr.dbname, {})
+            resultado = {}
+            for operacion, metrica in metricas_db.items():
+                metrica = dict(metrica)
+                if metrica['llamadas'] and metrica['total_ms']:
+                    metrica['media_ms'] = metrica['total_ms'] / metrica['llamadas']
+                resultado[operacion] = metrica
+        return {
+            'activo': self._perf_activo(),
+            'metricas': resultado,
+        }
+
+    @api.model
+    def reset_stats(self):
+        """Reinicia las métricas acumuladas de la base de datos actual"""
+        self._comprobar_acceso()
+        with _metricas_lock:
+            _metricas.pop(self.env.cr.dbname, None)
+        return True
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import logging
+import threading
+
+from odoo import models, api
+from odoo.tools import escape_psql
+
+_logger = logging.getLogger(__name__)
+
+# Secuencia de Postgres cuyo valor actúa como generación del catálogo: se
+# incrementa al modificar productos y deja obsoletas todas las entradas en
+# caché de todos los workers sin necesidad de comunicarlos entre sí
+SECUENCIA_GENERACION = 'capitulos_product_lookup_seq'
+
+# Campos de producto que afectan al resultado de las búsquedas
+CAMPOS_BUSQUEDA_PRODUCTO = {
+    'name', 'default_code', 'categ_id', 'sale_ok', 'active',
+    'list_price', 'lst_price', 'uom_id', 'company_id', 'product_tmpl_id',
+}
+
+# Límite de memoria: número total de filas guardadas entre todas las entradas
+MAX_FILAS_CACHE = 50000
+# Filas que se guardan por búsqueda; por encima se pagina contra la base de datos
+MAX_FILAS_ENTRADA = 2000
+LIMITE_PAGINA_DEFECTO = 100
+
+# Columnas de las filas compactas que devuelve la búsqueda
+COLUMNAS_PRODUCTO = ['id', 'name', 'default_code', 'list_price', 'uom_name']
+
+# Columnas del árbol de categorías: ``product_count`` cuenta los productos
+# vendibles de la propia categoría y ``product_count_total`` incluye los de
+# todas sus subcategorías
+COLUMNAS_CATEGORIA = ['id', 'name', 'complete_name', 'parent_id', 'product_count', 'product_count_total']
+
+_cache = OrderedDict()
+_cache_filas = [0]
+_cache_lock = threading.Lock()
+
+# Último árbol de categorías calculado por base de datos, idioma, compañías y grupos
+_cache_arbol = {}
+
+
+class CapitulosProductLookup(models.AbstractModel):
+    _name = 'capitulos.product.lookup'
+    _description = 'Búsqueda de Productos en Caché para Capítulos'
+
+    def init(self):
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {SECUENCIA_GENERACION}")
+
+    @api.model
+    def _generacion(self):
+        self.env.cr.execute(f"SELECT last_value FROM {SECUENCIA_GENERACION}")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _invalidar(self):
+        """Deja obsoletas las búsquedas en caché de todos los procesos.
+
+        La generación se incrementa ya y de nuevo tras el commit: así una
+        búsqueda concurrente que haya leído los datos anteriores al commit
+        no queda guardada como vigente.
+        """
+        self.env.cr.execute(f"SELECT nextval('{SECUENCIA_GENERACION}')")
+        postcommit = self.env.cr.postcommit
+        if not postcommit.data.get(SECUENCIA_GENERACION):
+            postcommit.data[SECUENCIA_GENERACION] = True
+            registry = self.env.registry
+
+            @postcommit.add
+            def _invalidar_tras_commit():
+                with registry.cursor() as cr:
+                    cr.execute(f"SELECT nextval('{SECUENCIA_GENERACION}')")
+
+    @api.model
+    def _normalizar(self, query):
+        return ' '.join((query or '').lower().split())
+
+    @api.model
+    def _visibilidad(self):
+        """Lo que determina qué productos ve el usuario y cómo se muestran.
+
+        Las reglas de producto dependen de las compañías permitidas y de los
+        grupos del usuario, no del usuario en sí: los comerciales con los
+        mismos grupos, compañías e idioma comparten las búsquedas en caché.
+        """
+        return (
+            self.env.su,
+            self.env.lang,
+            tuple(self.env.companies.ids),
+            tuple(sorted(self.env.user.groups_id.ids)),
+        )
+
+    @api.model
+    def _clave(self, generacion, categ_id, query):
+        return (self.env.cr.dbname, generacion, self._visibilidad(), categ_id or False, query)
+
+    @api.model
+    def _dominio(self, categ_id, query):
+        domain = [('sale_ok', '=', True)]
+        if categ_id:
+            domain.append(('categ_id', '=', categ_id))
+        if query:
+            # ``%`` y ``_`` se buscan literalmente, igual que en el filtrado en memoria
+            domain.append(('name', 'ilike', escape_psql(query)))
+        return domain
+
+    @api.model
+    def _comparable(self, texto):
+        """Texto tal como lo compara ``ilike``: en minúsculas y sin acentos si la base de datos usa unaccent"""
+        return self.env.registry.unaccent_python(texto.lower())
+
+    @api.model
+    def _leer_filas(self, domain, offset=0, limit=None):
+        productos = self.env['product.product'].search_read(
+            domain, ['name', 'default_code', 'list_price', 'uom_id'],
+            offset=offset, limit=limit, order='name, id',
+        )
+        return [
+            [p['id'], p['name'], p['default_code'] or '', p['list_price'], p['uom_id'][1] if p['uom_id'] else '']
+            for p in productos
+        ]
+
+    @api.model
+    def _obtener_entrada(self, generacion, categ_id, query):
+        """Devuelve la entrada en caché de una búsqueda, calculándola si falta.
+
+        Si un prefijo de la búsqueda ya está en caché con todas sus filas, el
+        resultado se obtiene filtrando esas filas en memoria, sin consultar
+        la base de datos.
+        """
+        clave = self._clave(generacion, categ_id, query)
+        with _cache_lock:
+            entrada = _cache.get(clave)
+            if entrada is not None:
+                _cache.move_to_end(clave)
+                return entrada
+            base = None
+            for longitud in range(len(query) - 1, -1, -1):
+                candidata = _cache.get(self._clave(generacion, categ_id, query[:longitud]))
+                if candidata is not None and candidata['completa']:
+                    base = candidata
+                    break
+
+        if base is not None:
+            buscado = self._comparable(query)
+            filas = [fila for fila in base['filas'] if buscado in self._comparable(fila[1])]
+            entrada = {'filas': filas, 'total': len(filas), 'completa': True}
+        else:
+            domain = self._dominio(categ_id, query)
+            filas = self._leer_filas(domain, limit=MAX_FILAS_ENTRADA + 1)
+            completa = len(filas) <= MAX_FILAS_ENTRADA
+            filas = filas[:MAX_FILAS_ENTRADA]
+            total = len(filas) if completa else self.env['product.product'].search_count(domain)
+            entrada = {'filas': filas, 'total': total, 'completa': completa}
+
+        with _cache_lock:
+            if clave not in _cache:
+                _cache[clave] = entrada
+                _cache_filas[0] += len(entrada['filas'])
+            # Expulsar las entradas usadas hace más tiempo hasta respetar el límite
+            while _cache_filas[0] > MAX_FILAS_CACHE and len(_cache) > 1:
+                _clave, expulsada = _cache.popitem(last=False)
+                _cache_filas[0] -= len(expulsada['filas'])
+        return entrada
+
+    @api.model
+    def search_products(self, categ_id=None, query='', offset=0, limit=LIMITE_PAGINA_DEFECTO):
+        """Busca productos vendibles por categoría y texto, paginando el resultado.
+
+        Devuelve ``columns`` con el nombre de cada posición, ``rows`` con las
+        filas de la página pedida y ``total`` con el número de coincidencias.
+        """
+        query = self._normalizar(query)
+        offset = max(int(offset or 0), 0)
+        limit = max(int(limit or LIMITE_PAGINA_DEFECTO), 1)
+        entrada = self._obtener_entrada(self._generacion(), categ_id, query)
+
+        if entrada['completa'] or offset + limit <= len(entrada['filas']):
+            filas = entrada['filas'][offset:offset + limit]
+        else:
+            # Páginas más allá de las filas guardadas: se consultan directamente
+            filas = self._leer_filas(self._dominio(categ_id, query), offset=offset, limit=limit)
+        return {
+            'columns': COLUMNAS_PRODUCTO,
+            'rows': filas,
+            'total': entrada['total'],
+        }
+
+    @api.model
+    def _calcular_arbol_categorias(self):
+        categorias = self.env['product.category'].search_read(
+            [], ['name', 'complete_name', 'parent_id', 'parent_path'], order='complete_name, id',
+        )
+        conteos = dict(
+            (categoria.id, cantidad)
+            for categoria, cantidad in self.env['product.product']._read_group(
+                [('sale_ok', '=', True)], ['categ_id'], ['__count'],
+            )
+        )
+        # Cada categoría suma sus productos a todos sus ancestros (parent_path = "1/5/9/")
+        totales = dict.fromkeys((c['id'] for c in categorias), 0)
+        for categoria in categorias:
+            cantidad = conteos.get(categoria['id'], 0)
+            if not cantidad:
+                continue
+            for ancestro in categoria['parent_path'].rstrip('/').split('/'):
+                if int(ancestro) in totales:
+                    totales[int(ancestro)] += cantidad
+        return [
+            [
+                c['id'], c['name'], c['complete_name'], c['parent_id'] or False,
+                conteos.get(c['id'], 0), totales[c['id']],
+            ]
+            for c in categorias
+        ]
+
+    @api.model
+    def get_category_tree(self, version=None):
+        """Devuelve el árbol completo de categorías con sus recuentos de productos.
+
+        El resultado va versionado con la generación del catálogo: si el
+        cliente envía la versión que ya tiene, solo se confirma que sigue
+        vigente y puede reutilizar su copia.
+        """
+        generacion = self._generacion()
+        if version == generacion:
+            return {'version': generacion, 'unchanged': True}
+
+        clave = (self.env.cr.dbname, self._visibilidad())
+        with _cache_lock:
+            arbol = _cache_arbol.get(clave)
+        if arbol is None or arbol[0] != generacion:
+            arbol = (generacion, self._calcular_arbol_categorias())
+            with _cache_lock:
+                _cache_arbol[clave] = arbol
+        return {
+            'version': generacion,
+            'columns': COLUMNAS_CATEGORIA,
+            'rows': arbol[1],
+        }
@@ -0,0 +1,47 @@
+from odoo import models, api, tools
+
+class ProductCategory(models.Model):
+    _inherit = 'product.category'
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['capitulos.product.lookup']._invalidar()
+        return records
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if {'name', 'parent_id'}.intersection(vals):
+            # También deja obsoletos los conjuntos de descendientes, que van por generación
+            self.env['capitulos.product.lookup']._invalidar()
+        return res
+    
+    def unlink(self):
+        res = super().unlink()
+        self.env['capitulos.product.lookup']._invalidar()
+        return res
+    
+    @api.model
+    def _capitulos_ids_descendientes(self, categ_id):
+        """Ids de la categoría y de todas sus subcategorías, a cualquier profundidad.
+
+        Se resuelve con ``parent_path`` en una sola consulta y queda en la
+        caché del ORM con la generación del catálogo como clave: al cambiar
+        la jerarquía basta con incrementarla, sin vaciar la caché del registro.
+        """
+        generacion = self.env['capitulos.product.lookup']._generacion()
+        return self._capitulos_ids_descendientes_generacion(generacion, categ_id)
+    
+    @api.model
+    @tools.ormcache('generacion', 'categ_id')
+    def _capitulos_ids_descendientes_generacion(self, generacion, categ_id):
+        categoria = self.sudo().browse(categ_id).exists()
+        if not categoria:
+            return frozenset()
+        return frozenset(self.sudo().search([('parent_path', '=like', f'{categoria.parent_path}%')]).ids)
+    
+    @api.model
+    def _capitulos_productos_fuera_de_categoria(self, productos, categ_id):
+        """Devuelve los productos cuya categoría no cuelga de ``categ_id``"""
+        permitidas = self._capitulos_ids_descendientes(categ_id)
+        return productos.filtered(lambda p: p.categ_id.id not in permitidas)
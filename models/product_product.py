@@ -0,0 +1,23 @@
+from odoo import models, api
+
+from .capitulos_product_lookup import CAMPOS_BUSQUEDA_PRODUCTO
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['capitulos.product.lookup']._invalidar()
+        return records
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if CAMPOS_BUSQUEDA_PRODUCTO.intersection(vals):
+            self.env['capitulos.product.lookup']._invalidar()
+        return res
+    
+    def unlink(self):
+        res = super().unlink()
+        self.env['capitulos.product.lookup']._invalidar()
+        return res
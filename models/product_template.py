@@ -1,5 +1,7 @@
 from odoo import models, fields, api
 
+from .capitulos_product_lookup import CAMPOS_BUSQUEDA_PRODUCTO
+
 class ProductTemplate(models.Model):
     _inherit = 'product.template'
     
@@ -24,4 +26,21 @@ class ProductTemplate(models.Model):
             domain.append(('capitulo_id', '=', capitulo_id))
         if tipo_seccion:
             domain.append(('tipo_seccion', '=', tipo_seccion))
-        return self.search(domain)
\ No newline at end of file
+        return self.search(domain)
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['capitulos.product.lookup']._invalidar()
+        return records
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if CAMPOS_BUSQUEDA_PRODUCTO.intersection(vals):
+            self.env['capitulos.product.lookup']._invalidar()
+        return res
+    
+    def unlink(self):
+        res = super().unlink()
+        self.env['capitulos.product.lookup']._invalidar()
+        return res
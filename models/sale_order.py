@@ -1,5 +1,82 @@
 from odoo import models, fields, api
 from odoo.exceptions import UserError
+from odoo.tools import split_every
+from bisect import bisect_left
+from collections import defaultdict
+import json
+import logging
+import math
+import re
+import uuid
+
+_logger = logging.getLogger(__name__)
+
+# Sufijos que se añaden a los nombres decorados: "(SECCIÓN FIJA)" o contadores "(2)"
+_SUFIJO_DECORADO_RE = re.compile(r'\s*\((SECCIÓN FIJA|\d+)\)$')
+
+# Número de líneas de producto a partir del cual el acordeón solo recibe la
+# estructura de capítulos y secciones (0 desactiva la carga diferida)
+PARAM_UMBRAL_CARGA_DIFERIDA = 'capitulos.lazy_line_threshold'
+UMBRAL_CARGA_DIFERIDA_DEFECTO = 200
+
+# Formato del JSON del acordeón: '1' (objetos por nombre) o '2' (compacto por columnas)
+PARAM_FORMATO_PAYLOAD = 'capitulos.payload_format'
+FORMATOS_PAYLOAD = ('1', '2')
+
+# Origen del precio de las líneas añadidas: 'plantilla' (precio del capítulo o
+# del producto) o 'tarifa' (tarifa del pedido)
+PARAM_MODO_PRECIO = 'capitulos.pricing_mode'
+MODOS_PRECIO = [
+    ('plantilla', 'Precio del Capítulo'),
+    ('tarifa', 'Tarifa del Pedido'),
+]
+
+# Campos de las líneas de producto que se pueden editar desde el acordeón
+CAMPOS_EDITABLES_ACORDEON = ('product_uom_qty', 'price_unit', 'name')
+
+# Importes por capítulo o sección cuando no tienen líneas de producto
+TOTALES_VACIOS = {'amount_untaxed': 0.0, 'amount_tax': 0.0, 'amount_total': 0.0, 'product_count': 0}
+
+# Pedidos que se insertan con una sola creación al aplicar un capítulo en lote
+TAMANO_LOTE_DEFECTO = 50
+
+# Estados de pedido en los que se pueden añadir capítulos
+ESTADOS_PRESUPUESTO = ('draft', 'sent')
+
+# Campos de los encabezados a partir de los que se crean las instancias de capítulo y sección
+CAMPOS_ENCABEZADO_INSTANCIA = [
+    'order_id', 'name', 'sequence', 'capitulo_key', 'seccion_key', 'capitulo_id',
+    'capitulo_seccion_id', 'es_encabezado_capitulo', 'es_encabezado_seccion',
+]
+
+# Campos que ligan una línea con su capítulo y su sección, copiados del encabezado de sección
+CAMPOS_PERTENENCIA_SECCION = (
+    'capitulo_key', 'seccion_key', 'capitulo_id', 'capitulo_seccion_id', 'order_capitulo_id', 'order_seccion_id',
+)
+
+# Campos de las líneas que se leen al recorrer la estructura de capítulos del pedido
+CAMPOS_LINEA_ESTRUCTURA = [
+    'sequence', 'name', 'display_type', 'product_id', 'product_uom_qty', 'product_uom', 'price_unit', 'discount',
+    'price_subtotal', 'price_tax', 'price_total', 'es_encabezado_capitulo', 'es_encabezado_seccion',
+    'order_capitulo_id', 'order_seccion_id', 'condiciones_particulares', 'seccion_key', 'capitulo_seccion_id',
+]
+
+# Datos de cada línea en el acordeón, los mismos que ``sale.order.line._capitulos_datos_linea``
+CAMPOS_LINEA_ACORDEON = [
+    'id', 'sequence', 'product_id', 'name', 'product_uom_qty', 'product_uom_id', 'price_unit', 'price_subtotal',
+]
+
+# Campos de las instancias de capítulo y sección que acompañan a sus encabezados
+CAMPOS_INSTANCIA_ESTRUCTURA = ['name', 'amount_untaxed', 'amount_tax', 'amount_total', 'line_count']
+
+# Líneas que se leen en cada bloque al exportar: la memoria no depende del tamaño del pedido
+TAMANO_BLOQUE_EXPORTACION = 1000
+
+# Columnas de la exportación de presupuestos por capítulos
+COLUMNAS_EXPORTACION = [
+    'Pedido', 'Capítulo', 'Sección', 'Producto', 'Descripción', 'Cantidad', 'Unidad',
+    'Precio Unitario', 'Descuento (%)', 'Base Imponible', 'Impuestos', 'Total',
+]
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
@@ -21,121 +98,1160 @@ class SaleOrder(models.Model):
         compute='_compute_tiene_multiples_capitulos',
         help="Indica si el pedido tiene capítulos para mostrar en acordeón"
     )
+    
+    order_capitulo_ids = fields.One2many(
+        'sale.order.capitulo',
+        'order_id',
+        string='Capítulos del Pedido',
+        help="Instancias de los capítulos aplicados al pedido, con sus totales"
+    )
+    
+    order_seccion_ids = fields.One2many(
+        'sale.order.seccion',
+        'order_id',
+        string='Secciones del Pedido',
+    )
+    
+    capitulo_job_ids = fields.One2many(
+        'capitulo.apply.job',
+        'order_id',
+        string='Capítulos en Segundo Plano',
+    )
 
     def _get_base_name(self, decorated_name):
         """Extrae el nombre base de un capítulo o sección decorado."""
-        import re
         name = str(decorated_name)
         # 1. Eliminar sufijos como (SECCIÓN FIJA) o contadores
-        name = re.sub(r'\s*\((SECCIÓN FIJA|\d+)\)$', '', name).strip()
+        name = _SUFIJO_DECORADO_RE.sub('', name).strip()
         # 2. Eliminar caracteres decorativos de los extremos
         decorative_chars = ' \t\n\r=═🔒📋'
         name = name.strip(decorative_chars)
         return name
     
-    @api.depends('order_line', 'order_line.es_encabezado_capitulo', 'order_line.es_encabezado_seccion', 
-                 'order_line.name', 'order_line.product_id', 'order_line.product_uom_qty', 
-                 'order_line.product_uom', 'order_line.price_unit', 'order_line.price_subtotal', 'order_line.sequence')
+    @api.model
+    def _capitulos_nueva_clave(self):
+        """Genera una clave única para una instancia de capítulo en el pedido"""
+        return uuid.uuid4().hex
+
+    def _capitulos_asegurar_claves(self):
+        """Asigna claves estructurales a las líneas de pedidos creados sin ellas.
+
+        Los pedidos anteriores a los campos ``capitulo_key``/``seccion_key``
+        solo conocen su estructura por la posición de los encabezados. Se
+        recorren una única vez y, a partir de ahí, todas las búsquedas se
+        resuelven por clave.
+        """
+        SaleOrderLine = self.env['sale.order.line']
+        pendientes = SaleOrderLine.search([
+            ('order_id', 'in', self.ids),
+            ('capitulo_key', '=', False),
+            '|', ('es_encabezado_capitulo', '=', True), ('es_encabezado_seccion', '=', True),
+        ])
+        for order in pendientes.order_id:
+            claves_por_linea = {}
+            capitulo_key = None
+            seccion_key = None
+            num_seccion = 0
+            for line in order.order_line.sorted(lambda l: (l.sequence, l.id)):
+                if line.es_encabezado_capitulo:
+                    capitulo_key = line.capitulo_key or self._capitulos_nueva_clave()
+                    seccion_key = None
+                    num_seccion = 0
+                    claves_por_linea[line] = (capitulo_key, False)
+                elif not capitulo_key:
+                    continue
+                elif line.es_encabezado_seccion:
+                    num_seccion += 1
+                    seccion_key = line.seccion_key or f"{capitulo_key}:{num_seccion}"
+                    claves_por_linea[line] = (capitulo_key, seccion_key)
+                elif seccion_key:
+                    claves_por_linea[line] = (capitulo_key, seccion_key)
+
+            # Una escritura por sección en lugar de una por línea
+            grupos = {}
+            for line, claves in claves_por_linea.items():
+                if (line.capitulo_key, line.seccion_key or False) != claves:
+                    grupos.setdefault(claves, SaleOrderLine)
+                    grupos[claves] |= line
+            for (capitulo_key, seccion_key), lines in grupos.items():
+                lines.with_context(from_capitulo_wizard=True).write({
+                    'capitulo_key': capitulo_key,
+                    'seccion_key': seccion_key,
+                })
+
+    @api.model
+    def _capitulos_totales(self, domain, campo):
+        """Importes y número de líneas de producto agrupados por ``campo``.
+
+        Se calculan con una única consulta agregada sobre ``sale.order.line``.
+        Devuelve un diccionario ``valor → TOTALES_VACIOS`` rellenado; los
+        Many2one se indexan por id.
+        """
+        totales = {}
+        for grupo, untaxed, tax, total, count in self.env['sale.order.line']._read_group(
+            domain + [('display_type', '=', False)],
+            [campo],
+            ['price_subtotal:sum', 'price_tax:sum', 'price_total:sum', '__count'],
+        ):
+            clave = grupo.id if isinstance(grupo, models.BaseModel) else grupo
+            if not clave:
+                # Líneas sin capítulo o sección: no se atribuyen a ninguno
+                continue
+            totales[clave] = {
+                'amount_untaxed': untaxed,
+                'amount_tax': tax,
+                'amount_total': total,
+                'product_count': count,
+            }
+        return totales
+
+    @api.model
+    def _capitulos_crear_instancias(self, encabezados):
+        """Crea las instancias de capítulo y sección de una lista de encabezados.
+
+        ``encabezados`` son diccionarios con los campos de
+        ``CAMPOS_ENCABEZADO_INSTANCIA`` (valores de creación o el resultado de
+        ``search_read``). Se crean todos los capítulos y todas las secciones
+        con una llamada a ``create`` para cada modelo. Devuelve dos diccionarios
+        indexados por ``(order_id, clave)``.
+        """
+        capitulos_vals = [{
+            'order_id': e['order_id'],
+            'name': self._get_base_name(e['name']),
+            'sequence': e['sequence'],
+            'capitulo_key': e['capitulo_key'],
+            'capitulo_id': e.get('capitulo_id') or False,
+        } for e in encabezados if e.get('es_encabezado_capitulo')]
+        capitulos = self.env['sale.order.capitulo'].create(capitulos_vals)
+        capitulos_por_clave = {(c.order_id.id, c.capitulo_key): c for c in capitulos}
+        
+        # Las secciones de capítulos que ya tenían instancia se cuelgan de ella
+        claves_sin_instancia = {
+            (e['order_id'], e['capitulo_key']) for e in encabezados
+            if e.get('es_encabezado_seccion') and (e['order_id'], e['capitulo_key']) not in capitulos_por_clave
+        }
+        if claves_sin_instancia:
+            existentes = self.env['sale.order.capitulo'].search([
+                ('order_id', 'in', list({order_id for order_id, clave in claves_sin_instancia})),
+                ('capitulo_key', 'in', list({clave for order_id, clave in claves_sin_instancia})),
+            ])
+            capitulos_por_clave.update({(c.order_id.id, c.capitulo_key): c for c in existentes})
+        
+        secciones_vals = [{
+            'order_capitulo_id': capitulos_por_clave[(e['order_id'], e['capitulo_key'])].id,
+            'name': self._get_base_name(e['name']),
+            'sequence': e['sequence'],
+            'seccion_key': e['seccion_key'],
+            'capitulo_seccion_id': e.get('capitulo_seccion_id') or False,
+            'es_fija': '(SECCIÓN FIJA)' in e['name'],
+        } for e in encabezados
+            if e.get('es_encabezado_seccion') and (e['order_id'], e['capitulo_key']) in capitulos_por_clave]
+        secciones = self.env['sale.order.seccion'].create(secciones_vals)
+        secciones_por_clave = {(s.order_id.id, s.seccion_key): s for s in secciones}
+        return capitulos_por_clave, secciones_por_clave
+    
+    def _capitulos_sincronizar_instancias(self):
+        """Crea las instancias que falten y enlaza con ellas las líneas de los pedidos.
+
+        Cubre los pedidos anteriores a los modelos de instancia y los pedidos
+        duplicados, cuyas líneas se copian sin enlace. Las líneas se enlazan
+        con una escritura por sección.
+        """
+        self._capitulos_asegurar_claves()
+        SaleOrderLine = self.env['sale.order.line']
+        encabezados = SaleOrderLine.search_read([
+            ('order_id', 'in', self.ids),
+            ('capitulo_key', '!=', False),
+            '|', ('es_encabezado_capitulo', '=', True), ('es_encabezado_seccion', '=', True),
+        ], CAMPOS_ENCABEZADO_INSTANCIA, order='order_id, sequence, id', load=None)
+        
+        capitulos_existentes = self.env['sale.order.capitulo'].search([('order_id', 'in', self.ids)])
+        claves_capitulo = {(c.order_id.id, c.capitulo_key) for c in capitulos_existentes}
+        claves_seccion = {(s.order_id.id, s.seccion_key) for s in capitulos_existentes.seccion_ids}
+        pendientes = [
+            e for e in encabezados
+            if (e['es_encabezado_capitulo'] and (e['order_id'], e['capitulo_key']) not in claves_capitulo)
+            or (e['es_encabezado_seccion'] and (e['order_id'], e['seccion_key']) not in claves_seccion)
+        ]
+        if pendientes:
+            self._capitulos_crear_instancias(pendientes)
+        
+        capitulos = self.env['sale.order.capitulo'].search([('order_id', 'in', self.ids)])
+        capitulos_por_clave = {(c.order_id.id, c.capitulo_key): c.id for c in capitulos}
+        secciones_por_clave = {(s.order_id.id, s.seccion_key): s.id for s in capitulos.seccion_ids}
+        
+        sin_enlazar = SaleOrderLine.search([
+            ('order_id', 'in', self.ids),
+            ('capitulo_key', '!=', False),
+            '|', ('order_capitulo_id', '=', False),
+            '&', ('seccion_key', '!=', False), ('order_seccion_id', '=', False),
+        ])
+        grupos = defaultdict(lambda: SaleOrderLine)
+        for line in sin_enlazar:
+            enlace = (
+                capitulos_por_clave.get((line.order_id.id, line.capitulo_key), False),
+                secciones_por_clave.get((line.order_id.id, line.seccion_key), False),
+            )
+            if enlace[0]:
+                grupos[enlace] |= line
+        for (order_capitulo_id, order_seccion_id), lines in grupos.items():
+            lines.with_context(from_capitulo_wizard=True).write({
+                'order_capitulo_id': order_capitulo_id,
+                'order_seccion_id': order_seccion_id,
+            })
+        
+        # Líneas añadidas fuera del wizard antes de que se enlazaran por posición
+        SaleOrderLine.search([
+            ('order_id', 'in', self.ids),
+            ('capitulo_key', '=', False),
+            ('es_encabezado_capitulo', '=', False),
+            ('es_encabezado_seccion', '=', False),
+        ])._capitulos_enlazar_por_posicion()
+    
+    def copy(self, default=None):
+        """Las líneas duplicadas conservan sus claves: se crean las instancias del nuevo pedido"""
+        # Los encabezados solo se pueden crear desde el wizard; las líneas se
+        # enlazan después con las instancias del pedido nuevo
+        nuevos = super(SaleOrder, self.with_context(from_capitulo_wizard=True)).copy(default)
+        nuevos._capitulos_sincronizar_instancias()
+        return nuevos
+    
+    def _capitulos_buscar_encabezado_capitulo(self, capitulo_name):
+        """Devuelve el encabezado de capítulo que corresponde a la clave del acordeón.
+
+        El acordeón distingue los capítulos duplicados añadiendo un contador
+        ("NOMBRE (2)"), así que el contador se resuelve por posición entre los
+        encabezados con el mismo nombre.
+        """
+        self.ensure_one()
+        encabezados = self.env['sale.order.line'].search([
+            ('order_id', '=', self.id),
+            ('es_encabezado_capitulo', '=', True),
+        ], order='sequence, id')
+
+        candidatos = encabezados.filtered(lambda l: l.name == capitulo_name)
+        if candidatos:
+            return candidatos[0]
+
+        match = re.match(r'^(.*) \((\d+)\)$', capitulo_name or '')
+        if match:
+            candidatos = encabezados.filtered(lambda l: l.name == match.group(1))
+            posicion = int(match.group(2))
+            if len(candidatos) >= posicion:
+                return candidatos[posicion - 1]
+
+        # Compatibilidad: comparar por nombre base sin decoración
+        capitulo_base_name = self._get_base_name(capitulo_name).upper()
+        return encabezados.filtered(
+            lambda l: self._get_base_name(l.name).upper() == capitulo_base_name
+        )[:1]
+
+    def _capitulos_buscar_encabezado_seccion(self, capitulo_name, seccion_name, seccion_key=None):
+        """Localiza el encabezado de una sección mediante las claves estructurales"""
+        self.ensure_one()
+        SaleOrderLine = self.env['sale.order.line']
+
+        if seccion_key:
+            seccion_line = SaleOrderLine.search([
+                ('order_id', '=', self.id),
+                ('seccion_key', '=', seccion_key),
+                ('es_encabezado_seccion', '=', True),
+            ], limit=1)
+            if seccion_line:
+                return seccion_line
+
+        capitulo_line = self._capitulos_buscar_encabezado_capitulo(capitulo_name)
+        if not capitulo_line:
+            raise UserError(f"No se encontró el capítulo: {capitulo_name}")
+
+        secciones = SaleOrderLine.search([
+            ('order_id', '=', self.id),
+            ('capitulo_key', '=', capitulo_line.capitulo_key),
+            ('es_encabezado_seccion', '=', True),
+        ], order='sequence, id')
+        seccion_line = secciones.filtered(lambda l: l.name == seccion_name)[:1]
+        if not seccion_line:
+            seccion_base_name = self._get_base_name(seccion_name).upper()
+            seccion_line = secciones.filtered(
+                lambda l: self._get_base_name(l.name).upper() == seccion_base_name
+            )[:1]
+        if not seccion_line:
+            raise UserError(f"No se encontró la sección: {seccion_name} en el capítulo: {capitulo_name}")
+        return seccion_line
+
+    @api.depends('order_capitulo_ids.sequence', 'order_capitulo_ids.line_count',
+                 'order_capitulo_ids.payload_encabezado', 'order_capitulo_ids.payload_fragmento',
+                 'order_capitulo_ids.payload_fragmento_estructura')
+    @api.depends_context('lang')
     def _compute_capitulos_agrupados(self):
         """Agrupa las líneas del pedido por capítulos para mostrar en acordeón"""
-        import json
-        import logging
-        _logger = logging.getLogger(__name__)
+        with self.env['capitulos.perf']._medir('compute_capitulos_agrupados') as metricas:
+            self._capitulos_calcular_agrupados(metricas)
+    
+    @api.model
+    def _capitulos_umbral_carga_diferida(self):
+        """Umbral de líneas para enviar solo el esqueleto del acordeón"""
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            PARAM_UMBRAL_CARGA_DIFERIDA, UMBRAL_CARGA_DIFERIDA_DEFECTO)
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            _logger.warning(f"Valor no válido para {PARAM_UMBRAL_CARGA_DIFERIDA}: {valor}")
+            return UMBRAL_CARGA_DIFERIDA_DEFECTO
+    
+    @api.model
+    def _capitulos_formato_payload(self):
+        """Versión del formato JSON que se envía al acordeón"""
+        formato = self.env['ir.config_parameter'].sudo().get_param(PARAM_FORMATO_PAYLOAD, '1')
+        if formato not in FORMATOS_PAYLOAD:
+            _logger.warning(f"Valor no válido para {PARAM_FORMATO_PAYLOAD}: {formato}")
+            return '1'
+        return formato
+    
+    @api.model
+    def _capitulos_modo_precio(self):
+        """Modo de precio por defecto de las líneas que se añaden a los pedidos"""
+        modo = self.env['ir.config_parameter'].sudo().get_param(PARAM_MODO_PRECIO, 'plantilla')
+        if modo not in dict(MODOS_PRECIO):
+            _logger.warning(f"Valor no válido para {PARAM_MODO_PRECIO}: {modo}")
+            return 'plantilla'
+        return modo
+    
+    def _capitulos_tarifar_lineas(self, lineas, memo=None):
+        """Fija precio, descuento y regla de tarifa en los valores de línea del pedido.
+
+        Obtiene lo mismo que ``sale.order.line`` al añadir el producto desde
+        el formulario: precio de la tarifa, descuento aparte cuando la regla
+        lo muestra y ajuste de la posición fiscal del pedido. Pero las reglas
+        se evalúan una vez por cantidad y unidad de medida sobre todos los
+        productos, en lugar de una vez por línea. ``memo`` guarda la
+        evaluación por tarifa, producto, cantidad, unidad y día del pedido y
+        puede compartirse entre los pedidos de una misma operación.
+        """
+        self.ensure_one()
+        memo = {} if memo is None else memo
+        pricelist = self.pricelist_id
+        moneda = self.currency_id
+        fecha = fields.Date.to_date(self.date_order) or fields.Date.context_today(self)
+        productos = self.env['product.product'].browse({linea['product_id'] for linea in lineas})
+        uoms = {producto.id: producto.uom_id.id for producto in productos}
+        
+        def clave(linea):
+            return (
+                pricelist.id, linea['product_id'], linea.get('product_uom_qty') or 1.0,
+                linea.get('product_uom') or uoms[linea['product_id']], fecha,
+            )
+        
+        pendientes = defaultdict(set)
+        for linea in lineas:
+            _tarifa, product_id, cantidad, uom_id, _fecha = clave_linea = clave(linea)
+            if clave_linea not in memo:
+                pendientes[(cantidad, uom_id)].add(product_id)
+        
+        with self.env['capitulos.perf']._medir('tarifar_lineas') as metricas:
+            metricas.update(lineas=len(lineas), evaluaciones_tarifa=len(pendientes))
+            for (cantidad, uom_id), ids_productos in pendientes.items():
+                grupo = productos.browse(ids_productos)
+                uom = self.env['uom.uom'].browse(uom_id)
+                precios = pricelist._compute_price_rule(grupo, cantidad, currency=moneda, uom=uom, date=fecha)
+                for producto in grupo:
+                    precio, regla_id = precios[producto.id]
+                    regla = self.env['product.pricelist.item'].browse(regla_id)
+                    precio_base = None
+                    if regla and regla._show_discount():
+                        precio_base = regla._compute_price_before_discount(
+                            product=producto, quantity=cantidad, uom=uom, date=fecha, currency=moneda,
+                        )
+                    memo[(pricelist.id, producto.id, cantidad, uom_id, fecha)] = (precio, regla_id, precio_base)
+        
+        for linea in lineas:
+            precio, regla_id, precio_base = memo[clave(linea)]
+            descuento = 0.0
+            if precio_base:
+                # Como en el formulario: se muestra el precio base y la rebaja como descuento
+                descuento = (precio_base - precio) / precio_base * 100
+                if descuento * precio_base <= 0:
+                    descuento = 0.0
+                precio = max(precio_base, precio)
+            producto = productos.browse(linea['product_id'])
+            precio = producto._get_tax_included_unit_price_from_price(
+                precio,
+                producto.taxes_id._filter_taxes_by_company(self.company_id),
+                fiscal_position=self.fiscal_position_id,
+            )
+            linea.update(price_unit=precio, discount=descuento, pricelist_item_id=regla_id or False)
+            if 'technical_price_unit' in self.env['sale.order.line']._fields:
+                # El precio sigue la tarifa al cambiar la cantidad, como si lo hubiera calculado la línea
+                linea['technical_price_unit'] = precio
+        return lineas
+    
+    def _capitulos_tarifar_secciones(self, secciones, memo=None):
+        """Copia de ``secciones`` con los precios de la tarifa del pedido.
+
+        Las secciones recibidas no se modifican, de modo que la misma
+        estructura puede tarifarse para varios pedidos.
+        """
+        self.ensure_one()
+        secciones = [dict(seccion, lineas=[dict(linea) for linea in seccion['lineas']]) for seccion in secciones]
+        self._capitulos_tarifar_lineas(
+            [linea for seccion in secciones for linea in seccion['lineas']], memo=memo,
+        )
+        return secciones
+    
+    @api.model
+    def _capitulos_codificar_compacto(self, capitulos_dict):
+        """Convierte la estructura del acordeón al formato compacto (v2).
+
+        Capítulos y secciones pasan a ser listas ordenadas con su nombre y
+        clave, las líneas de cada sección se envían por columnas y los
+        nombres de producto y unidad de medida se sustituyen por índices a
+        tablas sin duplicados. La descripción solo se envía cuando difiere
+        del nombre del producto.
+        """
+        productos = {}
+        uoms = {}
+        capitulos = []
+        for nombre_capitulo, capitulo in capitulos_dict.items():
+            secciones = []
+            for nombre_seccion, seccion in capitulo['sections'].items():
+                lineas = seccion['lines']
+                seccion_compacta = {
+                    key: valor for key, valor in seccion.items() if key != 'lines'
+                }
+                seccion_compacta['name'] = nombre_seccion
+                seccion_compacta['cols'] = {
+                    'id': [l['id'] for l in lineas],
+                    'product': [productos.setdefault(l['product_name'], len(productos)) for l in lineas],
+                    'name': [None if l['name'] == l['product_name'] else l['name'] for l in lineas],
+                    'qty': [l['product_uom_qty'] for l in lineas],
+                    'uom': [uoms.setdefault(l['product_uom'], len(uoms)) for l in lineas],
+                    'price_unit': [l['price_unit'] for l in lineas],
+                    'price_subtotal': [l['price_subtotal'] for l in lineas],
+                }
+                secciones.append(seccion_compacta)
+            capitulo_compacto = {
+                key: valor for key, valor in capitulo.items() if key != 'sections'
+            }
+            capitulo_compacto.update(name=nombre_capitulo, sections=secciones)
+            capitulos.append(capitulo_compacto)
+        return {
+            'v': 2,
+            'products': list(productos),
+            'uoms': list(uoms),
+            'chapters': capitulos,
+        }
+    
+    @api.model
+    def _capitulos_resolver_nombres(self, secciones, lang=None):
+        """Añade los nombres de producto, unidad de medida y categoría a las secciones.
+
+        Los fragmentos guardados y el delta solo llevan ids, de modo que los
+        nombres traducidos no quedan congelados en el idioma de quien los
+        calculó. Se leen en ``lang`` (por defecto, el del contexto) con una
+        lectura por modelo para todas las ``secciones`` recibidas, que se
+        completan en el sitio: cada línea recibe ``product_name`` y
+        ``product_uom``, y cada sección con ``category_id``, ``category_name``.
+        Una línea cuyo producto ya no existe muestra su descripción.
+        """
+        secciones = list(secciones)
+        lineas = [linea for seccion in secciones for linea in seccion.get('lines', ())]
+        env = self.with_context(lang=lang).env if lang else self.env
+        
+        def nombres(modelo, ids):
+            registros = env[modelo].browse({id_ for id_ in ids if id_}).exists()
+            return dict(zip(registros.ids, registros.mapped('name')))
+        
+        productos = nombres('product.product', [linea.get('product_id') for linea in lineas])
+        uoms = nombres('uom.uom', [linea.get('product_uom_id') for linea in lineas])
+        categorias = nombres('product.category', [seccion.get('category_id') for seccion in secciones])
+        for linea in lineas:
+            if linea.get('product_id'):
+                linea['product_name'] = productos.get(linea['product_id']) or linea['name']
+            else:
+                linea['product_name'] = ''
+            linea['product_uom'] = uoms.get(linea.get('product_uom_id'), '')
+        for seccion in secciones:
+            if 'category_id' in seccion:
+                seccion['category_name'] = categorias.get(seccion['category_id'])
+        return secciones
+    
+    def _capitulos_calcular_agrupados(self, metricas):
+        """Ensambla el JSON del acordeón a partir de los fragmentos de cada capítulo.
+
+        Cada ``sale.order.capitulo`` guarda ya serializado su propio
+        fragmento, que solo se recalcula cuando cambian sus líneas. Aquí no se
+        leen líneas: los fragmentos solo se completan con los nombres en el
+        idioma del usuario.
+        """
+        umbral = self._capitulos_umbral_carga_diferida()
+        compacto = self._capitulos_formato_payload() == '2'
+        metricas.update(pedidos=len(self), lineas=0, bytes_payload=0, pedidos_diferidos=0)
         
         for order in self:
-            _logger.info(f"DEBUG COMPUTE: Procesando pedido {order.id} con {len(order.order_line)} líneas")
+            capitulos = order.order_capitulo_ids.sorted(lambda c: (c.sequence, c.id))
+            lineas_producto = sum(capitulos.mapped('line_count'))
+            metricas['lineas'] += lineas_producto
             
-            capitulos_dict = {}
-            current_capitulo_key = None
-            current_seccion_name = None
-            capitulo_counter = {}
+            # En pedidos grandes solo se envía la estructura y los totales; las
+            # líneas se piden al desplegar cada capítulo
+            diferido = umbral > 0 and lineas_producto > umbral
+            if diferido:
+                metricas['pedidos_diferidos'] += 1
             
-            for line in order.order_line.sorted('sequence'):
-                if line.es_encabezado_capitulo:
-                    # Nuevo capítulo - crear clave única para permitir duplicados
-                    base_name = line.name
-                    if base_name not in capitulo_counter:
-                        capitulo_counter[base_name] = 0
-                    capitulo_counter[base_name] += 1
-                    
-                    # Crear clave única: nombre + contador si hay duplicados
-                    if capitulo_counter[base_name] == 1:
-                        current_capitulo_key = base_name
-                    else:
-                        current_capitulo_key = f"{base_name} ({capitulo_counter[base_name]})"
-                    
-                    capitulos_dict[current_capitulo_key] = {
-                        'sections': {},
-                        'total': 0.0
-                    }
-                    current_seccion_name = None
-                    
-                elif line.es_encabezado_seccion and current_capitulo_key:
-                    # Nueva sección dentro del capítulo actual
-                    current_seccion_name = line.name
-                    
-                    # Buscar la categoría de productos de esta sección
-                    category_id = None
-                    category_name = None
-                    
-                    # Buscar en los capítulos aplicados la sección correspondiente
-                    for capitulo in order.capitulo_ids:
-                        for seccion in capitulo.seccion_ids:
-                            # Comparar nombres de sección (normalizado)
-                            seccion_base_name = self._get_base_name(seccion.name)
-                            line_base_name = self._get_base_name(current_seccion_name)
-                            
-                            if seccion_base_name.upper() == line_base_name.upper():
-                                if seccion.product_category_id:
-                                    category_id = seccion.product_category_id.id
-                                    category_name = seccion.product_category_id.name
-                                break
-                        if category_id:
-                            break
-                    
-                    capitulos_dict[current_capitulo_key]['sections'][current_seccion_name] = {
-                        'lines': [],
-                        'condiciones_particulares': line.condiciones_particulares or '',
-                        'category_id': category_id,
-                        'category_name': category_name
-                    }
-                    
-                elif current_capitulo_key and current_seccion_name:
-                    # Producto dentro de la sección actual
-                    line_data = {
-                        'id': line.id,  # Añadir ID para edición
-                        'sequence': line.sequence,
-                        'product_name': line.product_id.name if line.product_id else '',
-                        'name': line.name,
-                        'product_uom_qty': line.product_uom_qty,
-                        'product_uom': line.product_uom.name if line.product_uom else '',
-                        'price_unit': line.price_unit,
-                        'price_subtotal': line.price_subtotal
-                    }
-                    capitulos_dict[current_capitulo_key]['sections'][current_seccion_name]['lines'].append(line_data)
-                    capitulos_dict[current_capitulo_key]['total'] += line.price_subtotal
+            # Clave única por capítulo: nombre + contador si hay duplicados
+            fragmentos = []
+            capitulo_counter = {}
+            for capitulo in capitulos:
+                base_name = capitulo.payload_encabezado or capitulo.name
+                capitulo_counter[base_name] = capitulo_counter.get(base_name, 0) + 1
+                if capitulo_counter[base_name] == 1:
+                    clave = base_name
+                else:
+                    clave = f"{base_name} ({capitulo_counter[base_name]})"
+                fragmento = capitulo.payload_fragmento_estructura if diferido else capitulo.payload_fragmento
+                fragmentos.append((clave, fragmento or '{}'))
             
-            result_json = json.dumps(capitulos_dict) if capitulos_dict else '{}'
+            capitulos_dict = {clave: json.loads(fragmento) for clave, fragmento in fragmentos}
+            self._capitulos_resolver_nombres(
+                seccion for capitulo in capitulos_dict.values() for seccion in capitulo.get('sections', {}).values()
+            )
+            if not capitulos_dict:
+                result_json = '{}'
+            elif compacto:
+                result_json = json.dumps(self._capitulos_codificar_compacto(capitulos_dict), separators=(',', ':'))
+            else:
+                result_json = json.dumps(capitulos_dict)
             order.capitulos_agrupados = result_json
+            metricas['bytes_payload'] += len(result_json)
+    
+    def _capitulos_preparar_vals(self, capitulo, nombre_capitulo, secciones, condiciones=None, sequence_inicial=None):
+        """Prepara en memoria los valores de todas las líneas de un capítulo.
+
+        ``secciones`` es una lista de diccionarios con ``name``, ``es_fija``,
+        ``origen_seccion_id`` y ``lineas`` (valores de producto ya resueltos).
+        Los nombres, claves y secuencias se calculan aquí para que el capítulo
+        completo se inserte con una única llamada a ``create``.
+        """
+        self.ensure_one()
+        if sequence_inicial is None:
+            max_sequence = max(self.order_line.mapped('sequence')) if self.order_line else 0
+            sequence_inicial = max_sequence + 10
+        current_sequence = sequence_inicial
+        
+        capitulo_key = self._capitulos_nueva_clave()
+        base_vals = {
+            'order_id': self.id,
+            'capitulo_key': capitulo_key,
+            'capitulo_id': capitulo.id if capitulo else False,
+        }
+        
+        # Título del capítulo como encabezado principal
+        vals_list = [dict(
+            base_vals,
+            name=f"📋 ═══ {nombre_capitulo.upper()} ═══",
+            product_uom_qty=0,
+            price_unit=0,
+            display_type='line_section',
+            es_encabezado_capitulo=True,
+            sequence=current_sequence,
+        )]
+        current_sequence += 10
+        
+        for num_seccion, seccion in enumerate(secciones, start=1):
+            seccion_vals = dict(
+                base_vals,
+                seccion_key=f"{capitulo_key}:{num_seccion}",
+                capitulo_seccion_id=seccion.get('origen_seccion_id') or False,
+            )
             
-            _logger.info(f"DEBUG COMPUTE: Pedido {order.id} - Resultado final:")
-            _logger.info(f"DEBUG COMPUTE: - Capítulos encontrados: {len(capitulos_dict)}")
-            _logger.info(f"DEBUG COMPUTE: - JSON generado: {len(result_json)} caracteres")
-            
-            if capitulos_dict:
-                for cap_name, cap_data in capitulos_dict.items():
-                    sections_count = len(cap_data.get('sections', {}))
-                    total_lines = sum(len(sec.get('lines', [])) for sec in cap_data.get('sections', {}).values())
-                    _logger.info(f"DEBUG COMPUTE: - Capítulo '{cap_name}': {sections_count} secciones, {total_lines} productos")
+            # Las secciones fijas se nombran directamente como no editables
+            if seccion.get('es_fija'):
+                nombre_seccion = f"🔒 === {seccion['name'].upper()} === (SECCIÓN FIJA)"
             else:
-                _logger.info(f"DEBUG COMPUTE: - ❌ No se generaron capítulos")
+                nombre_seccion = f"=== {seccion['name'].upper()} ==="
+            vals_list.append(dict(
+                seccion_vals,
+                name=nombre_seccion,
+                product_uom_qty=0,
+                price_unit=0,
+                display_type='line_section',
+                es_encabezado_seccion=True,
+                sequence=current_sequence,
+            ))
+            current_sequence += 10
+            
+            for linea in seccion['lineas']:
+                vals_list.append(dict(seccion_vals, sequence=current_sequence, **linea))
+                current_sequence += 10
+            
+            if not seccion['lineas']:
+                # Si no hay productos, añadir una línea informativa
+                vals_list.append(dict(
+                    seccion_vals,
+                    name="(Sin productos añadidos en esta sección)",
+                    product_uom_qty=0,
+                    price_unit=0,
+                    display_type='line_note',
+                    sequence=current_sequence,
+                ))
+                current_sequence += 10
+        
+        # Añadir condiciones particulares si existen
+        if condiciones:
+            vals_list.append(dict(
+                base_vals,
+                seccion_key=f"{capitulo_key}:condiciones",
+                name="=== CONDICIONES PARTICULARES ===",
+                product_uom_qty=0,
+                price_unit=0,
+                display_type='line_section',
+                es_encabezado_seccion=True,
+                condiciones_particulares=condiciones,
+                sequence=current_sequence,
+            ))
+        
+        return vals_list
+    
+    def _capitulos_insertar_capitulo(self, capitulo, nombre_capitulo, secciones, condiciones=None):
+        """Inserta un capítulo completo en el pedido con una sola creación en bloque"""
+        self.ensure_one()
+        vals_list = self._capitulos_preparar_vals(capitulo, nombre_capitulo, secciones, condiciones=condiciones)
+        return self._capitulos_crear_lineas(vals_list)
+    
+    @api.model
+    def _capitulos_enlazar_instancias(self, vals_list):
+        """Crea las instancias de capítulos ya preparados y las enlaza en sus valores.
+
+        ``vals_list`` puede contener capítulos de varios pedidos, tal como los
+        devuelve ``_capitulos_preparar_vals``.
+        """
+        capitulos, secciones_por_clave = self._capitulos_crear_instancias([
+            vals for vals in vals_list
+            if vals.get('es_encabezado_capitulo') or vals.get('es_encabezado_seccion')
+        ])
+        for vals in vals_list:
+            vals['order_capitulo_id'] = capitulos[(vals['order_id'], vals['capitulo_key'])].id
+            if vals.get('seccion_key'):
+                vals['order_seccion_id'] = secciones_por_clave[(vals['order_id'], vals['seccion_key'])].id
+        return vals_list
+    
+    @api.model
+    def _capitulos_crear_lineas(self, vals_list):
+        """Crea las instancias y las líneas de capítulos ya preparados.
+
+        Las instancias se crean antes que las líneas para enlazarlas ya en la
+        creación.
+        """
+        self._capitulos_enlazar_instancias(vals_list)
+        return self.env['sale.order.line'].with_context(from_capitulo_wizard=True).create(vals_list)
+    
+    def _capitulos_encolar_capitulo(self, capitulo, nombre_capitulo, secciones, condiciones=None):
+        """Prepara el capítulo y deja su inserción a un trabajo en segundo plano.
+
+        Claves, secuencias e instancias se fijan ahora, de modo que el trabajo
+        solo tiene que crear las líneas por bloques.
+        """
+        self.ensure_one()
+        vals_list = self._capitulos_preparar_vals(capitulo, nombre_capitulo, secciones, condiciones=condiciones)
+        self._capitulos_enlazar_instancias(vals_list)
+        return self.env['capitulo.apply.job']._encolar(self, nombre_capitulo, capitulo, vals_list)
+    
+    def _capitulos_aplicar_en_lote(self, capitulo, nombre_capitulo, secciones, condiciones=None,
+                                   tamano_lote=TAMANO_LOTE_DEFECTO, modo_precio='plantilla',
+                                   al_terminar_lote=None):
+        """Inserta el mismo capítulo en todos los pedidos de ``self``.
+
+        ``secciones`` se prepara una sola vez para todos los pedidos; con
+        ``modo_precio='tarifa'`` se tarifa por pedido compartiendo la
+        evaluación de las reglas entre pedidos con la misma tarifa y día. Los
+        pedidos se procesan en lotes de
+        ``tamano_lote``: cada lote se inserta con una única creación dentro de
+        un savepoint y, si falla, se reintenta pedido a pedido para aislar los
+        que dan error sin perder el resto.
+
+        Con ``al_terminar_lote``, cada lote se confirma en la base de datos en
+        cuanto termina, después de pasar sus resultados a esa función para que
+        los guarde en la misma transacción: si el proceso se interrumpe, los
+        lotes ya aplicados y su informe se conservan.
+        Devuelve un diccionario ``order_id → {'success', 'message', 'lineas'}``.
+        """
+        resultados = {}
+        
+        def terminar_lote(resultados_lote):
+            resultados.update(resultados_lote)
+            if al_terminar_lote:
+                al_terminar_lote(resultados_lote)
+                self.env['capitulo.apply.job']._confirmar()
+        
+        aplicables = self.filtered(lambda o: o.state in ESTADOS_PRESUPUESTO)
+        if self - aplicables:
+            terminar_lote({
+                order.id: {
+                    'success': False,
+                    'message': "Solo se pueden añadir capítulos a presupuestos en borrador o enviados.",
+                    'lineas': 0,
+                }
+                for order in self - aplicables
+            })
+        
+        tamano_lote = max(int(tamano_lote or TAMANO_LOTE_DEFECTO), 1)
+        memo_precios = {}
+        
+        def secciones_pedido(order):
+            if modo_precio == 'tarifa':
+                return order._capitulos_tarifar_secciones(secciones, memo=memo_precios)
+            return secciones
+        
+        with self.env['capitulos.perf']._medir('aplicar_capitulo_en_lote') as metricas:
+            metricas.update(pedidos=len(self), lineas_creadas=0, lotes_fallidos=0)
+            for inicio in range(0, len(aplicables), tamano_lote):
+                lote = aplicables[inicio:inicio + tamano_lote]
+                resultados_lote = {}
+                # Última secuencia de todos los pedidos del lote con una consulta
+                secuencias = dict(self.env['sale.order.line']._read_group(
+                    [('order_id', 'in', lote.ids)], ['order_id'], ['sequence:max'],
+                ))
+                vals_por_pedido = {
+                    order: order._capitulos_preparar_vals(
+                        capitulo, nombre_capitulo, secciones_pedido(order), condiciones=condiciones,
+                        sequence_inicial=(secuencias.get(order) or 0) + 10,
+                    )
+                    for order in lote
+                }
+                try:
+                    with self.env.cr.savepoint():
+                        self._capitulos_crear_lineas([vals for vals_list in vals_por_pedido.values() for vals in vals_list])
+                except Exception:
+                    _logger.warning(f"Fallo al aplicar el capítulo {capitulo.id} en un lote de {len(lote)} pedidos; "
+                                    "se reintenta pedido a pedido", exc_info=True)
+                    self.env.invalidate_all()
+                    metricas['lotes_fallidos'] += 1
+                    for order in lote:
+                        try:
+                            with self.env.cr.savepoint():
+                                lineas = order._capitulos_insertar_capitulo(
+                                    capitulo, nombre_capitulo, secciones_pedido(order), condiciones=condiciones,
+                                )
+                        except Exception as e:
+                            self.env.invalidate_all()
+                            resultados_lote[order.id] = {'success': False, 'message': str(e), 'lineas': 0}
+                        else:
+                            resultados_lote[order.id] = {'success': True, 'message': '', 'lineas': len(lineas)}
+                            metricas['lineas_creadas'] += len(lineas)
+                else:
+                    for order, vals_list in vals_por_pedido.items():
+                        resultados_lote[order.id] = {'success': True, 'message': '', 'lineas': len(vals_list)}
+                        metricas['lineas_creadas'] += len(vals_list)
+                terminar_lote(resultados_lote)
+        return resultados
+    
+    def _capitulos_secuencia_despues_de(self, linea_anterior):
+        """Reserva una secuencia libre justo después de ``linea_anterior``.
+
+        Las líneas de capítulo se numeran de 10 en 10, de modo que normalmente
+        basta con tomar el punto medio entre la línea y su vecina siguiente sin
+        escribir en ninguna otra línea. Solo cuando no queda hueco se renumera
+        el capítulo afectado.
+        """
+        self.ensure_one()
+        siguiente = self._capitulos_linea_siguiente(linea_anterior)
+        if not siguiente:
+            return linea_anterior.sequence + 10
+        if siguiente.sequence - linea_anterior.sequence > 1:
+            return (linea_anterior.sequence + siguiente.sequence) // 2
+        
+        self._capitulos_renumerar_capitulo(linea_anterior)
+        siguiente = self._capitulos_linea_siguiente(linea_anterior)
+        if not siguiente:
+            return linea_anterior.sequence + 10
+        return (linea_anterior.sequence + siguiente.sequence) // 2
+    
+    def _capitulos_linea_siguiente(self, linea):
+        """Primera línea del pedido posterior a ``linea`` en el orden (secuencia, id)"""
+        return self.env['sale.order.line'].search([
+            ('order_id', '=', self.id),
+            '|', ('sequence', '>', linea.sequence),
+            '&', ('sequence', '=', linea.sequence), ('id', '>', linea.id),
+        ], order='sequence, id', limit=1)
+    
+    def _capitulos_renumerar_capitulo(self, linea):
+        """Renumera con huecos, en un único UPDATE, el tramo del pedido que contiene ``linea``.
+
+        El tramo va desde el encabezado de capítulo anterior a ``linea`` (o la
+        primera línea del pedido) hasta el siguiente encabezado de capítulo y
+        se renumera por posición, de modo que las líneas sin clave que haya en
+        él conservan su orden. Si el tramo no cabe antes del siguiente
+        capítulo se renumeran también todas las líneas posteriores del pedido.
+        Devuelve el número de líneas actualizadas.
+        """
+        self.ensure_one()
+        SaleOrderLine = self.env['sale.order.line']
+        SaleOrderLine.flush_model(['order_id', 'sequence', 'es_encabezado_capitulo'])
+        
+        primera = SaleOrderLine.search([
+            ('order_id', '=', self.id),
+            ('es_encabezado_capitulo', '=', True),
+            '|', ('sequence', '<', linea.sequence),
+            '&', ('sequence', '=', linea.sequence), ('id', '<=', linea.id),
+        ], order='sequence desc, id desc', limit=1) or SaleOrderLine.search([
+            ('order_id', '=', self.id),
+        ], order='sequence, id', limit=1)
+        siguiente = SaleOrderLine.search([
+            ('order_id', '=', self.id),
+            ('es_encabezado_capitulo', '=', True),
+            '|', ('sequence', '>', linea.sequence),
+            '&', ('sequence', '=', linea.sequence), ('id', '>', linea.id),
+        ], order='sequence, id', limit=1)
+        params = {
+            'order_id': self.id,
+            'inicio': primera.sequence,
+            'primera_id': primera.id,
+            'fin': siguiente.sequence,
+            'siguiente_id': siguiente.id,
+        }
+        
+        paso = 0
+        filtro = "(sequence, id) >= (%(inicio)s, %(primera_id)s)"
+        if siguiente:
+            filtro += " AND (sequence, id) < (%(fin)s, %(siguiente_id)s)"
+            self.env.cr.execute(f"""
+                SELECT COUNT(*) FROM sale_order_line WHERE order_id = %(order_id)s AND {filtro}
+            """, params)
+            num_lineas = self.env.cr.fetchone()[0]
+            paso = min(10, (siguiente.sequence - primera.sequence) // (num_lineas + 1))
+        if paso < 2:
+            # El tramo no cabe antes del siguiente capítulo: se desplazan también las líneas posteriores
+            paso = 10
+            filtro = "(sequence, id) >= (%(inicio)s, %(primera_id)s)"
+        
+        self.env.cr.execute(f"""
+            UPDATE sale_order_line sol
+               SET sequence = numeradas.nueva_secuencia
+              FROM (
+                    SELECT id,
+                           %(inicio)s + (ROW_NUMBER() OVER (ORDER BY sequence, id) - 1) * %(paso)s
+                               AS nueva_secuencia
+                      FROM sale_order_line
+                     WHERE order_id = %(order_id)s AND {filtro}
+                   ) numeradas
+             WHERE sol.id = numeradas.id
+               AND sol.sequence != numeradas.nueva_secuencia
+         RETURNING sol.id
+        """, dict(params, paso=paso))
+        ids_actualizados = [row[0] for row in self.env.cr.fetchall()]
+        self.env['capitulos.perf']._registrar('renumerar_capitulo', lineas_desplazadas=len(ids_actualizados))
+        
+        lineas_actualizadas = SaleOrderLine.browse(ids_actualizados)
+        lineas_actualizadas.invalidate_recordset(['sequence'])
+        lineas_actualizadas.modified(['sequence'])
+        self._capitulos_sincronizar_secuencias(ids_actualizados)
+        return len(ids_actualizados)
+    
+    def _capitulos_sincronizar_secuencias(self, line_ids):
+        """Copia a las instancias de capítulo y sección la secuencia de sus encabezados.
+
+        Se usa tras renumerar por SQL: solo se tocan las instancias cuyo
+        encabezado está entre ``line_ids`` y tiene otra secuencia.
+        """
+        if not line_ids:
+            return
+        self.env['sale.order.line'].flush_model([
+            'sequence', 'order_capitulo_id', 'order_seccion_id', 'es_encabezado_capitulo', 'es_encabezado_seccion',
+        ])
+        for modelo, campo, marca in (
+            ('sale.order.capitulo', 'order_capitulo_id', 'es_encabezado_capitulo'),
+            ('sale.order.seccion', 'order_seccion_id', 'es_encabezado_seccion'),
+        ):
+            Instancia = self.env[modelo]
+            Instancia.flush_model(['sequence'])
+            self.env.cr.execute(f"""
+                UPDATE {Instancia._table} instancia
+                   SET sequence = sol.sequence
+                  FROM sale_order_line sol
+                 WHERE sol.id = ANY(%s)
+                   AND sol.{marca}
+                   AND instancia.id = sol.{campo}
+                   AND instancia.sequence != sol.sequence
+             RETURNING instancia.id
+            """, [list(line_ids)])
+            instancias = Instancia.browse(row[0] for row in self.env.cr.fetchall())
+            instancias.invalidate_recordset(['sequence'])
+            instancias.modified(['sequence'])
+    
+    def _capitulos_delta(self, seccion_keys=(), capitulo_keys=()):
+        """Devuelve solo la parte del acordeón afectada por una modificación.
+
+        Incluye las líneas, condiciones e importes de las secciones indicadas
+        y los importes de sus capítulos, de forma que el widget pueda actualizar su
+        estado sin volver a cargar ni recalcular ``capitulos_agrupados``. Las
+        líneas e importes de cada sección siguen la misma regla de pertenencia
+        que los fragmentos del acordeón: el enlace con su instancia de sección.
+        """
+        self.ensure_one()
+        SaleOrderLine = self.env['sale.order.line']
+        seccion_keys = [key for key in seccion_keys if key]
+        capitulo_keys = set(key for key in capitulo_keys if key)
+        
+        secciones = []
+        if seccion_keys:
+            instancias = self.env['sale.order.seccion'].search([
+                ('order_id', '=', self.id),
+                ('seccion_key', 'in', seccion_keys),
+            ])
+            instancias_por_clave = {seccion.seccion_key: seccion for seccion in instancias}
+            encabezados = {}
+            lineas_por_seccion = defaultdict(list)
+            for line in SaleOrderLine.search([('order_seccion_id', 'in', instancias.ids)], order='sequence, id'):
+                if line.es_encabezado_seccion:
+                    encabezados.setdefault(line.order_seccion_id.id, line)
+                else:
+                    lineas_por_seccion[line.order_seccion_id.id].append(line._capitulos_datos_linea())
+            totales = self._capitulos_totales([('order_seccion_id', 'in', instancias.ids)], 'order_seccion_id')
+            for seccion_key in seccion_keys:
+                instancia = instancias_por_clave.get(seccion_key, self.env['sale.order.seccion'])
+                capitulo_key = instancia.order_capitulo_id.capitulo_key
+                if capitulo_key:
+                    capitulo_keys.add(capitulo_key)
+                secciones.append(dict(
+                    totales.get(instancia.id, TOTALES_VACIOS),
+                    capitulo_key=capitulo_key or '',
+                    seccion_key=seccion_key,
+                    condiciones_particulares=encabezados.get(instancia.id, SaleOrderLine).condiciones_particulares or '',
+                    lines=lineas_por_seccion[instancia.id],
+                ))
+            self._capitulos_resolver_nombres(secciones)
+        
+        capitulos = []
+        if capitulo_keys:
+            instancias = self.env['sale.order.capitulo'].search([
+                ('order_id', '=', self.id),
+                ('capitulo_key', 'in', list(capitulo_keys)),
+            ])
+            ids_por_clave = {capitulo.capitulo_key: capitulo.id for capitulo in instancias}
+            totales = self._capitulos_totales([('order_capitulo_id', 'in', instancias.ids)], 'order_capitulo_id')
+            for key in capitulo_keys:
+                totales_capitulo = totales.get(ids_por_clave.get(key), TOTALES_VACIOS)
+                capitulos.append(dict(
+                    totales_capitulo,
+                    capitulo_key=key,
+                    total=totales_capitulo['amount_untaxed'],
+                ))
+        
+        return {
+            'sections': secciones,
+            'chapters': capitulos,
+        }
     
-    @api.depends('order_line', 'order_line.es_encabezado_capitulo')
+    def _capitulos_recorrer(self, tamano_bloque=None, idioma_cliente=False, capitulo_ids=None, nombres=True):
+        """Recorre en orden los capítulos, secciones y líneas de los pedidos.
+
+        Genera tuplas ``(tipo, datos)``: ``('pedido', order)`` al empezar cada
+        pedido y, a continuación, ``'capitulo'``, ``'seccion'``, ``'linea'`` y
+        ``'nota'`` con diccionarios en el orden de las líneas; las notas son
+        las líneas de nota y de sección estándar, según su ``display_type``.
+        Capítulos y secciones llevan los importes ya agregados en sus
+        instancias, y todos, las instancias a las que pertenecen
+        (``order_capitulo_id``, ``order_seccion_id``); líneas y notas, también
+        sus nombres (``capitulo_name``, ``seccion_name``): agrupando por ellas
+        las líneas suman lo mismo que los importes de las instancias. Los
+        nombres de producto y unidad de medida se añaden con
+        ``_capitulos_resolver_nombres`` en el idioma del contexto o, con
+        ``idioma_cliente``, en el del cliente de cada pedido; sin ``nombres``,
+        las líneas solo llevan sus ids. ``capitulo_ids`` limita el recorrido a
+        las líneas de esas instancias de capítulo.
+        Con ``tamano_bloque`` las líneas se leen por bloques que se expulsan de
+        la caché al terminar cada uno, y la memoria no depende del tamaño del
+        pedido; sin él se leen de una vez.
+        """
+        dominio_capitulos = [('order_id', 'in', self.ids)]
+        dominio_lineas = []
+        if capitulo_ids is not None:
+            dominio_capitulos.append(('order_capitulo_id', 'in', capitulo_ids))
+            dominio_lineas.append(('order_capitulo_id', 'in', capitulo_ids))
+        capitulos = {c['id']: c for c in self.env['sale.order.capitulo'].search_read(
+            [('id', 'in', capitulo_ids)] if capitulo_ids is not None else [('order_id', 'in', self.ids)],
+            CAMPOS_INSTANCIA_ESTRUCTURA, load=None,
+        )}
+        secciones = {s['id']: s for s in self.env['sale.order.seccion'].search_read(
+            dominio_capitulos, CAMPOS_INSTANCIA_ESTRUCTURA, load=None,
+        )}
+        SaleOrderLine = self.env['sale.order.line']
+        for order in self:
+            yield 'pedido', order
+            lang = order.partner_id.lang if idioma_cliente else None
+            line_ids = SaleOrderLine.search(
+                [('order_id', '=', order.id)] + dominio_lineas, order='sequence, id',
+            ).ids
+            bloques = split_every(tamano_bloque, line_ids, list) if tamano_bloque else [line_ids]
+            for bloque in bloques:
+                lineas = SaleOrderLine.browse(bloque)
+                filas = []
+                for fila in lineas.read(CAMPOS_LINEA_ESTRUCTURA, load=None):
+                    capitulo = capitulos.get(fila['order_capitulo_id'])
+                    seccion = secciones.get(fila['order_seccion_id'])
+                    if fila['es_encabezado_capitulo']:
+                        datos = self._capitulos_datos_encabezado(fila, capitulo)
+                        datos['encabezado'] = fila['name']
+                        datos['order_capitulo_id'] = fila['order_capitulo_id'] or False
+                        filas.append(('capitulo', datos))
+                    elif fila['es_encabezado_seccion']:
+                        datos = self._capitulos_datos_encabezado(fila, seccion)
+                        datos.update(
+                            encabezado=fila['name'],
+                            seccion_key=fila['seccion_key'] or '',
+                            capitulo_seccion_id=fila['capitulo_seccion_id'] or False,
+                            condiciones_particulares=fila['condiciones_particulares'] or '',
+                            order_capitulo_id=fila['order_capitulo_id'] or False,
+                            order_seccion_id=fila['order_seccion_id'] or False,
+                        )
+                        filas.append(('seccion', datos))
+                    else:
+                        filas.append(('nota' if fila['display_type'] else 'linea', {
+                            'id': fila['id'],
+                            'sequence': fila['sequence'],
+                            'display_type': fila['display_type'] or False,
+                            'product_id': fila['product_id'],
+                            'name': fila['name'],
+                            'product_uom_qty': fila['product_uom_qty'],
+                            'product_uom_id': fila['product_uom'],
+                            'price_unit': fila['price_unit'],
+                            'discount': fila['discount'],
+                            'price_subtotal': fila['price_subtotal'],
+                            'price_tax': fila['price_tax'],
+                            'price_total': fila['price_total'],
+                            'order_capitulo_id': fila['order_capitulo_id'] or False,
+                            'order_seccion_id': fila['order_seccion_id'] or False,
+                            'capitulo_name': capitulo['name'] if capitulo else '',
+                            'seccion_name': seccion['name'] if seccion else '',
+                        }))
+                if nombres:
+                    self._capitulos_resolver_nombres(
+                        [{'lines': [datos for tipo, datos in filas if tipo in ('linea', 'nota')]}], lang=lang,
+                    )
+                yield from filas
+                if tamano_bloque:
+                    lineas.invalidate_recordset()
+
+    def _capitulos_estructura(self, capitulo_ids=None, nombres=True):
+        """Estructura ordenada capítulo → sección → línea de cada pedido, con sus importes.
+
+        Devuelve un diccionario por id de pedido con ``capitulos`` (cada uno
+        con sus ``secciones`` y estas con sus ``lineas``) y ``lineas`` con las
+        líneas y notas que no pertenecen a ningún capítulo. Cada sección va en
+        el capítulo y cada línea en la sección o el capítulo a los que está
+        enlazada, los mismos cuyos importes se muestran. Es la estructura que
+        imprime el informe y de la que salen los fragmentos del acordeón; con
+        ``nombres``, los de producto y unidad se leen en el idioma del cliente.
+        Lee las líneas de cada pedido de una vez: el número de consultas no
+        depende de su número de líneas.
+        """
+        estructuras = {}
+        estructura = capitulo = None
+        for tipo, datos in self._capitulos_recorrer(idioma_cliente=True, capitulo_ids=capitulo_ids, nombres=nombres):
+            if tipo == 'pedido':
+                estructura = estructuras[datos.id] = {'capitulos': [], 'lineas': []}
+                capitulo = None
+                capitulos_por_id, secciones_por_id = {}, {}
+            elif tipo == 'capitulo':
+                capitulo = dict(datos, secciones=[], lineas=[])
+                estructura['capitulos'].append(capitulo)
+                if datos['order_capitulo_id']:
+                    capitulos_por_id[datos['order_capitulo_id']] = capitulo
+            elif tipo == 'seccion':
+                seccion = dict(datos, lineas=[])
+                contenedor = capitulos_por_id.get(datos['order_capitulo_id']) or capitulo
+                if contenedor is None:
+                    # Sección sin encabezado de capítulo delante: se agrupa en uno sin nombre
+                    contenedor = capitulo = dict(
+                        self._capitulos_datos_encabezado({'name': ''}, None), secciones=[], lineas=[],
+                    )
+                    estructura['capitulos'].append(capitulo)
+                contenedor['secciones'].append(seccion)
+                if datos['order_seccion_id']:
+                    secciones_por_id[datos['order_seccion_id']] = seccion
+            else:
+                contenedor = (
+                    secciones_por_id.get(datos['order_seccion_id'])
+                    or capitulos_por_id.get(datos['order_capitulo_id'])
+                    or estructura
+                )
+                contenedor['lineas'].append(datos)
+        return estructuras
+
+    @api.model
+    def _capitulos_datos_encabezado(self, fila, instancia):
+        """Nombre e importes de un encabezado a partir de su instancia.
+
+        Los encabezados de pedidos aún sin sincronizar no tienen instancia:
+        se muestran con su nombre base y sin importes.
+        """
+        if not instancia:
+            return {
+                'name': self._get_base_name(fila['name']),
+                'amount_untaxed': None,
+                'amount_tax': None,
+                'amount_total': None,
+                'product_count': None,
+            }
+        return {
+            'name': instancia['name'],
+            'amount_untaxed': instancia['amount_untaxed'],
+            'amount_tax': instancia['amount_tax'],
+            'amount_total': instancia['amount_total'],
+            'product_count': instancia['line_count'],
+        }
+
+    def _capitulos_filas_exportacion(self, tamano_bloque=TAMANO_BLOQUE_EXPORTACION):
+        """Genera las filas de la exportación por capítulos como tuplas ``(tipo, fila)``.
+
+        Cada fila sigue ``COLUMNAS_EXPORTACION``. Pedidos, capítulos y
+        secciones llevan sus subtotales; las condiciones particulares de una
+        sección van en una fila propia justo después de ella. Las líneas y
+        notas llevan el capítulo y la sección a los que pertenecen, los mismos
+        que suman sus subtotales.
+        """
+        pedido = capitulo = seccion = ''
+        for tipo, datos in self._capitulos_recorrer(tamano_bloque=tamano_bloque):
+            if tipo == 'pedido':
+                pedido, capitulo, seccion = datos.name, '', ''
+                yield tipo, [
+                    pedido, '', '', '', datos.partner_id.display_name, '', '', '', '',
+                    datos.amount_untaxed, datos.amount_tax, datos.amount_total,
+                ]
+            elif tipo == 'linea':
+                yield tipo, [
+                    pedido, datos['capitulo_name'], datos['seccion_name'], datos['product_name'], datos['name'],
+                    datos['product_uom_qty'], datos['product_uom'], datos['price_unit'], datos['discount'],
+                    datos['price_subtotal'], datos['price_tax'], datos['price_total'],
+                ]
+            elif tipo == 'nota':
+                yield tipo, [
+                    pedido, datos['capitulo_name'], datos['seccion_name'], '', datos['name'],
+                    '', '', '', '', '', '', '',
+                ]
+            else:
+                if tipo == 'capitulo':
+                    capitulo, seccion = datos['name'], ''
+                else:
+                    seccion = datos['name']
+                yield tipo, [
+                    pedido, capitulo, seccion, '', '', '', '', '', '',
+                    datos['amount_untaxed'], datos['amount_tax'], datos['amount_total'],
+                ]
+                if datos.get('condiciones_particulares'):
+                    yield 'condiciones', [
+                        pedido, capitulo, seccion, '', datos['condiciones_particulares'],
+                        '', '', '', '', '', '', '',
+                    ]
+
+    @api.depends('order_line', 'order_line.es_encabezado_capitulo', 'capitulo_job_ids.state')
     def _compute_tiene_multiples_capitulos(self):
         """Calcula si el pedido tiene capítulos para mostrar el acordeón"""
         for order in self:
             capitulos_count = len(order.order_line.filtered('es_encabezado_capitulo'))
-            order.tiene_multiples_capitulos = capitulos_count >= 1
+            # El acordeón también muestra el progreso de los capítulos en segundo plano
+            trabajos = order.capitulo_job_ids.filtered(lambda j: j.state != 'hecho')
+            order.tiene_multiples_capitulos = capitulos_count >= 1 or bool(trabajos)
     
     def action_add_capitulo(self):
         """Acción para abrir el wizard de capítulos"""
@@ -154,10 +1270,18 @@ class SaleOrder(models.Model):
             }
         }
     
+    def action_capitulos_exportar(self, formato='xlsx'):
+        """Descarga los pedidos seleccionados agrupados por capítulos y secciones"""
+        if not self:
+            raise UserError("Debe seleccionar al menos un pedido de venta.")
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f"/capitulos/export/{formato}?order_ids={','.join(str(order_id) for order_id in self.ids)}",
+            'target': 'self',
+        }
+    
     def toggle_capitulo_collapse(self, capitulo_index):
         """Alterna el estado colapsado/expandido de un capítulo"""
-        import json
-        
         self.ensure_one()
         capitulos = json.loads(self.capitulos_agrupados or '[]')
         
@@ -168,131 +1292,32 @@ class SaleOrder(models.Model):
         return {'type': 'ir.actions.client', 'tag': 'reload'}
     
     @api.model
-    def add_product_to_section(self, order_id, capitulo_name, seccion_name, product_id, quantity=1.0):
+    def add_product_to_section(self, order_id, capitulo_name, seccion_name, product_id, quantity=1.0, seccion_key=None):
         """Añade un producto a una sección específica de un capítulo"""
-        import logging
-        _logger = logging.getLogger(__name__)
-        
-        _logger.info(f"DEBUG ADD_PRODUCT: Iniciando adición de producto {product_id} a capítulo '{capitulo_name}', sección '{seccion_name}'")
-        
         order = self.browse(order_id)
         order.ensure_one()
         
-        _logger.info(f"DEBUG ADD_PRODUCT: Pedido {order.id} tiene {len(order.order_line)} líneas antes de añadir")
-        
-        try:
+        with self.env['capitulos.perf']._medir('add_product_to_section') as metricas:
             if not product_id:
-                _logger.error(f"DEBUG ADD_PRODUCT: ❌ No se proporcionó product_id")
                 raise UserError("Debe seleccionar un producto")
             
             product = self.env['product.product'].browse(product_id)
             if not product.exists():
-                _logger.error(f"DEBUG ADD_PRODUCT: ❌ Producto {product_id} no existe")
                 raise UserError("El producto seleccionado no existe")
-                
-            _logger.info(f"DEBUG ADD_PRODUCT: ✅ Producto encontrado: {product.name} (ID: {product.id})")
-        except Exception as e:
-            _logger.error(f"DEBUG ADD_PRODUCT: ❌ Error al validar producto: {str(e)}")
-            raise e
-        
-        _logger.info(f"DEBUG ADD_PRODUCT: Producto encontrado: {product.name}")
-        
-        # Buscar la línea de encabezado del capítulo
-        capitulo_line = None
-        seccion_line = None
-        
-        _logger.info(f"DEBUG ADD_PRODUCT: Buscando capítulo '{capitulo_name}' y sección '{seccion_name}'")
-        _logger.info(f"DEBUG ADD_PRODUCT: Líneas en el pedido:")
-        for line in order.order_line.sorted('sequence'):
-            _logger.info(f"DEBUG ADD_PRODUCT: - Línea {line.sequence}: '{line.name}' (Capítulo: {line.es_encabezado_capitulo}, Sección: {line.es_encabezado_seccion})")
-        
-        for line in order.order_line.sorted('sequence'):
-            if line.es_encabezado_capitulo:
-                line_base_name = self._get_base_name(line.name)
-                capitulo_base_name = self._get_base_name(capitulo_name)
-                
-                _logger.info(f"DEBUG ADD_PRODUCT: Comparando capítulo base '{line_base_name}' con '{capitulo_base_name}'")
-                
-                if line_base_name.upper() == capitulo_base_name.upper():
-                    capitulo_line = line
-                    _logger.info(f"DEBUG ADD_PRODUCT: ✅ Capítulo encontrado: {line.name}")
-                    break
-        
-        if capitulo_line:
-            _logger.info(f"DEBUG ADD_PRODUCT: Buscando sección '{seccion_name}' después del capítulo '{capitulo_line.name}'")
-            _logger.info(f"DEBUG ADD_PRODUCT: Capítulo encontrado en secuencia: {capitulo_line.sequence}")
             
-            # Obtener todas las líneas después del capítulo
-            # Si todas las líneas tienen la misma secuencia, usar el ID para ordenar
-            all_lines = order.order_line.sorted(lambda l: (l.sequence, l.id))
-            capitulo_index = None
-            for i, line in enumerate(all_lines):
-                if line.id == capitulo_line.id:
-                    capitulo_index = i
-                    break
+            # Localizar la sección por sus claves estructurales (consultas indexadas)
+            seccion_line = order._capitulos_buscar_encabezado_seccion(capitulo_name, seccion_name, seccion_key)
             
-            if capitulo_index is not None:
-                lines_after_chapter = all_lines[capitulo_index + 1:]
-            else:
-                lines_after_chapter = order.order_line.filtered(lambda l: l.sequence > capitulo_line.sequence).sorted('sequence')
+            # VALIDACIÓN: Verificar si es una sección de solo texto (condiciones particulares)
+            seccion_name_lower = seccion_name.lower().strip()
+            if 'condiciones particulares' in seccion_name_lower:
+                raise UserError(f"No se pueden añadir productos a la sección '{seccion_name}'. Esta sección es solo para texto editable.")
             
-            _logger.info(f"DEBUG ADD_PRODUCT: Líneas después del capítulo: {len(lines_after_chapter)}")
+            # Insertar inmediatamente después del encabezado de sección, en el hueco
+            # libre entre el encabezado y la línea siguiente
+            insert_sequence = order._capitulos_secuencia_despues_de(seccion_line)
             
-            for line in lines_after_chapter:
-                _logger.info(f"DEBUG ADD_PRODUCT: Revisando línea {line.sequence}: '{line.name}' (Capítulo: {line.es_encabezado_capitulo}, Sección: {line.es_encabezado_seccion})")
-                
-                if line.es_encabezado_capitulo:
-                    # Si encontramos otro capítulo, paramos la búsqueda
-                    _logger.info(f"DEBUG ADD_PRODUCT: Encontrado otro capítulo, parando búsqueda")
-                    break
-                elif line.es_encabezado_seccion:
-                    line_base_name = self._get_base_name(line.name)
-                    seccion_base_name = self._get_base_name(seccion_name)
-                    
-                    _logger.info(f"DEBUG ADD_PRODUCT: Comparando sección base '{line_base_name}' con '{seccion_base_name}'")
-                    
-                    if line_base_name.upper() == seccion_base_name.upper():
-                        seccion_line = line
-                        _logger.info(f"DEBUG ADD_PRODUCT: ✅ Sección encontrada: {line.name}")
-                        break
-                else:
-                    _logger.info(f"DEBUG ADD_PRODUCT: Línea de producto: '{line.name}' (secuencia: {line.sequence})")
-        else:
-            _logger.error(f"DEBUG ADD_PRODUCT: ❌ No se encontró el capítulo '{capitulo_name}'")
-        
-        if not capitulo_line:
-            raise UserError(f"No se encontró el capítulo: {capitulo_name}")
-        
-        if not seccion_line:
-            raise UserError(f"No se encontró la sección: {seccion_name} en el capítulo: {capitulo_name}")
-        
-        # VALIDACIÓN: Verificar si es una sección de solo texto (condiciones particulares)
-        seccion_name_lower = seccion_name.lower().strip()
-        if 'condiciones particulares' in seccion_name_lower:
-            _logger.warning(f"DEBUG ADD_PRODUCT: ❌ Intento de añadir producto a sección de solo texto: '{seccion_name}'")
-            raise UserError(f"No se pueden añadir productos a la sección '{seccion_name}'. Esta sección es solo para texto editable.")
-        
-        # Estrategia simplificada: insertar inmediatamente después del encabezado de sección
-        # Esto garantiza que el producto aparezca en la sección correcta
-        insert_sequence = seccion_line.sequence + 1
-        _logger.info(f"DEBUG: Insertando producto inmediatamente después de la sección '{seccion_line.name}' (seq: {seccion_line.sequence})")
-        _logger.info(f"DEBUG: Secuencia de inserción: {insert_sequence}")
-
-        # Desplazar todas las líneas que tengan secuencia >= insert_sequence
-        lines_to_shift = order.order_line.filtered(lambda l: l.sequence >= insert_sequence)
-        _logger.info(f"DEBUG: {len(lines_to_shift)} líneas para desplazar.")
-
-        # Ordenamos de forma descendente para evitar conflictos de clave única al actualizar
-        for line_to_shift in lines_to_shift.sorted(key=lambda r: r.sequence, reverse=True):
-            new_seq = line_to_shift.sequence + 1
-            _logger.info(f"DEBUG: Desplazando línea '{line_to_shift.name}' de {line_to_shift.sequence} a {new_seq}.")
-            # Usamos el contexto para saltar la validación de escritura en encabezados
-            line_to_shift.with_context(from_capitulo_wizard=True).sequence = new_seq
-        
-        _logger.info(f"DEBUG: Secuencia de inserción final: {insert_sequence}")
-        
-        # Crear la nueva línea de producto
-        try:
+            # Crear la nueva línea de producto
             new_line_vals = {
                 'order_id': order.id,
                 'product_id': product.id,
@@ -303,89 +1328,184 @@ class SaleOrder(models.Model):
                 'sequence': insert_sequence,
                 'es_encabezado_capitulo': False,
                 'es_encabezado_seccion': False,
+                'capitulo_key': seccion_line.capitulo_key,
+                'seccion_key': seccion_line.seccion_key,
+                'capitulo_id': seccion_line.capitulo_id.id,
+                'capitulo_seccion_id': seccion_line.capitulo_seccion_id.id,
+                'order_capitulo_id': seccion_line.order_capitulo_id.id,
+                'order_seccion_id': seccion_line.order_seccion_id.id,
             }
+            if self._capitulos_modo_precio() == 'tarifa':
+                order._capitulos_tarifar_lineas([new_line_vals])
             
-            _logger.info(f"DEBUG ADD_PRODUCT: Valores para nueva línea: {new_line_vals}")
-            
-            # Crear la línea con contexto especial para evitar restricciones
-            _logger.info(f"DEBUG ADD_PRODUCT: Creando línea con contexto from_capitulo_wizard=True")
-            new_line = self.env['sale.order.line'].with_context(
-                from_capitulo_wizard=True
-            ).create(new_line_vals)
-            
-            _logger.info(f"DEBUG ADD_PRODUCT: ✅ Línea creada exitosamente con ID: {new_line.id}")
+            try:
+                # Crear la línea con contexto especial para evitar restricciones
+                new_line = self.env['sale.order.line'].with_context(
+                    from_capitulo_wizard=True
+                ).create(new_line_vals)
+            except Exception as e:
+                _logger.exception(f"Error al añadir el producto {product.id} al pedido {order.id}")
+                raise UserError(f"Error al crear la línea de producto: {str(e)}")
             
-        except Exception as e:
-            _logger.error(f"DEBUG ADD_PRODUCT: ❌ Error al crear línea: {str(e)}")
-            import traceback
-            _logger.error(f"DEBUG ADD_PRODUCT: Traceback completo: {traceback.format_exc()}")
-            raise UserError(f"Error al crear la línea de producto: {str(e)}")
-        
-        # Forzar la escritura de los datos pendientes sin commit
-        self.env.cr.flush()
-        
-        # Refrescar el record completo desde la base de datos
-        order.invalidate_recordset()
-        # Forzar el recálculo del campo computed
-        order._compute_capitulos_agrupados()
-        
-        _logger.info(f"DEBUG: Producto añadido exitosamente. ID de nueva línea: {new_line.id}")
-        _logger.info(f"DEBUG: Secuencia de nueva línea: {new_line.sequence}")
-        _logger.info(f"DEBUG: Total de líneas en el pedido: {len(order.order_line)}")
-        _logger.info(f"DEBUG: Campo capitulos_agrupados recalculado: {len(order.capitulos_agrupados)} caracteres")
-        
-        # Verificar que la nueva línea está en order_line
-        if new_line.id in order.order_line.ids:
-            _logger.info(f"DEBUG: ✓ Nueva línea confirmada en order_line")
-        else:
-            _logger.error(f"DEBUG: ✗ Nueva línea NO encontrada en order_line")
+            # Solo se devuelve la sección modificada: el widget no recarga el pedido
+            delta = order._capitulos_delta(seccion_keys=[seccion_line.seccion_key])
+            metricas['lineas_creadas'] = 1
         
         return {
             'success': True,
             'message': f'Producto {product.name} añadido a {seccion_name}',
-            'line_id': new_line.id
+            'line_id': new_line.id,
+            'delta': delta,
         }
     
     @api.model
-    def save_condiciones_particulares(self, order_id, capitulo_name, seccion_name, condiciones_text):
+    def save_condiciones_particulares(self, order_id, capitulo_name, seccion_name, condiciones_text, seccion_key=None):
         """Guarda las condiciones particulares de una sección específica"""
-        import logging
-        _logger = logging.getLogger(__name__)
-        
-        _logger.info(f"DEBUG SAVE_CONDICIONES: Guardando condiciones para capítulo '{capitulo_name}', sección '{seccion_name}'")
-        _logger.info(f"DEBUG SAVE_CONDICIONES: Texto: {condiciones_text[:100]}...")
-        
         order = self.browse(order_id)
         order.ensure_one()
         
-        # Buscar la línea de la sección específica
-        seccion_line = None
-        for line in order.order_line.sorted('sequence'):
-            if line.es_encabezado_seccion:
-                line_base_name = self._get_base_name(line.name)
-                seccion_base_name = self._get_base_name(seccion_name)
-                
-                if line_base_name.upper() == seccion_base_name.upper():
-                    seccion_line = line
-                    break
+        with self.env['capitulos.perf']._medir('save_condiciones_particulares'):
+            # Buscar la línea de la sección específica dentro de su capítulo
+            seccion_line = order._capitulos_buscar_encabezado_seccion(capitulo_name, seccion_name, seccion_key)
+            
+            try:
+                # Guardar las condiciones particulares en la línea de sección
+                seccion_line.with_context(from_capitulo_wizard=True).condiciones_particulares = condiciones_text
+            except Exception as e:
+                _logger.exception(f"Error al guardar condiciones particulares en la línea {seccion_line.id}")
+                raise UserError(f"Error al guardar las condiciones particulares: {str(e)}")
+            delta = order._capitulos_delta(seccion_keys=[seccion_line.seccion_key])
         
-        if not seccion_line:
-            _logger.error(f"DEBUG SAVE_CONDICIONES: ❌ No se encontró la sección '{seccion_name}'")
-            raise UserError(f"No se encontró la sección: {seccion_name}")
+        return {
+            'success': True,
+            'message': f'Condiciones particulares guardadas para {seccion_name}',
+            'delta': delta,
+        }
+    
+    @api.model
+    def update_section_line(self, order_id, line_id, vals):
+        """Modifica una línea de producto del acordeón y devuelve el delta de su sección"""
+        result = self.update_section_lines(order_id, [dict(vals, id=line_id)])
+        result['message'] = 'Línea actualizada correctamente'
+        return result
+    
+    @api.model
+    def update_section_lines(self, order_id, cambios):
+        """Modifica varias líneas de producto del acordeón en una sola llamada.
+
+        ``cambios`` es una lista de diccionarios con el ``id`` de la línea y
+        los campos modificados. Todo se valida antes de escribir, las líneas
+        con los mismos valores se escriben juntas y se devuelve un único
+        delta con las secciones afectadas.
+        """
+        order = self.browse(order_id)
+        order.ensure_one()
         
-        try:
-            # Guardar las condiciones particulares en la línea de sección
-            seccion_line.with_context(from_capitulo_wizard=True).condiciones_particulares = condiciones_text
-            _logger.info(f"DEBUG SAVE_CONDICIONES: ✅ Condiciones guardadas en línea {seccion_line.id}")
+        with self.env['capitulos.perf']._medir('update_section_lines') as metricas:
+            vals_por_linea = {}
+            for cambio in cambios:
+                vals = {campo: cambio[campo] for campo in CAMPOS_EDITABLES_ACORDEON if campo in cambio}
+                for campo in ('product_uom_qty', 'price_unit'):
+                    if campo not in vals:
+                        continue
+                    try:
+                        vals[campo] = float(vals[campo])
+                    except (TypeError, ValueError):
+                        raise UserError(f"La cantidad y el precio deben ser números: '{vals[campo]}' no es válido.")
+                    if not math.isfinite(vals[campo]) or vals[campo] < 0:
+                        raise UserError("La cantidad y el precio deben ser mayores o iguales a 0.")
+                vals_por_linea[int(cambio['id'])] = vals
+            lines = order._capitulos_lineas_editables(list(vals_por_linea))
             
-            return {
-                'success': True,
-                'message': f'Condiciones particulares guardadas para {seccion_name}'
-            }
+            grupos = defaultdict(list)
+            for line_id, vals in vals_por_linea.items():
+                if vals:
+                    grupos[tuple(sorted(vals.items()))].append(line_id)
+            for vals, line_ids in grupos.items():
+                lines.browse(line_ids).write(dict(vals))
             
-        except Exception as e:
-            _logger.error(f"DEBUG SAVE_CONDICIONES: ❌ Error al guardar: {str(e)}")
-            raise UserError(f"Error al guardar las condiciones particulares: {str(e)}")
+            delta = order._capitulos_delta(
+                seccion_keys=lines.order_seccion_id.mapped('seccion_key'),
+                capitulo_keys=lines.order_capitulo_id.mapped('capitulo_key'),
+            )
+            metricas['lineas'] = len(lines)
+            metricas['escrituras'] = len(grupos)
+        
+        return {
+            'success': True,
+            'message': f'{len(lines)} líneas actualizadas correctamente',
+            'delta': delta,
+        }
+    
+    @api.model
+    def delete_section_line(self, order_id, line_id):
+        """Elimina una línea de producto del acordeón y devuelve el delta de su sección"""
+        result = self.delete_section_lines(order_id, [line_id])
+        result['message'] = 'Línea eliminada correctamente'
+        return result
+    
+    @api.model
+    def delete_section_lines(self, order_id, line_ids):
+        """Elimina varias líneas de producto del acordeón con un único ``unlink``"""
+        order = self.browse(order_id)
+        order.ensure_one()
+        
+        with self.env['capitulos.perf']._medir('delete_section_lines') as metricas:
+            lines = order._capitulos_lineas_editables(line_ids)
+            seccion_keys = lines.order_seccion_id.mapped('seccion_key')
+            capitulo_keys = lines.order_capitulo_id.mapped('capitulo_key')
+            lines.unlink()
+            delta = order._capitulos_delta(seccion_keys=seccion_keys, capitulo_keys=capitulo_keys)
+            metricas['lineas'] = len(line_ids)
+        
+        return {
+            'success': True,
+            'message': f'{len(line_ids)} líneas eliminadas correctamente',
+            'delta': delta,
+        }
+    
+    @api.model
+    def get_accordion_lines(self, order_id, capitulo_key=None, seccion_keys=None):
+        """Devuelve las líneas de un capítulo o de secciones concretas.
+
+        Es la carga diferida del acordeón: el widget la llama al desplegar
+        un capítulo cuyo contenido no venía en ``capitulos_agrupados``. Las
+        secciones del capítulo son sus instancias, igual que en la estructura
+        que ya tiene el widget.
+        """
+        order = self.browse(order_id)
+        order.ensure_one()
+        
+        with self.env['capitulos.perf']._medir('get_accordion_lines') as metricas:
+            seccion_keys = list(seccion_keys or [])
+            if capitulo_key:
+                seccion_keys += self.env['sale.order.seccion'].search([
+                    ('order_id', '=', order.id),
+                    ('order_capitulo_id.capitulo_key', '=', capitulo_key),
+                ]).mapped('seccion_key')
+            delta = order._capitulos_delta(
+                seccion_keys=seccion_keys,
+                capitulo_keys=[capitulo_key] if capitulo_key else (),
+            )
+            metricas['lineas'] = sum(len(seccion['lines']) for seccion in delta['sections'])
+        
+        return {
+            'success': True,
+            'delta': delta,
+        }
+    
+    def _capitulos_lineas_editables(self, line_ids):
+        """Comprueba que las líneas pertenecen al pedido y no son encabezados"""
+        self.ensure_one()
+        lines = self.env['sale.order.line'].browse(line_ids).exists()
+        if len(lines) != len(set(line_ids)) or lines.order_id != self:
+            raise UserError("Alguna de las líneas indicadas no pertenece al presupuesto.")
+        headers = lines.filtered(lambda l: l.es_encabezado_capitulo or l.es_encabezado_seccion)
+        if headers:
+            raise UserError(
+                f"No se pueden modificar los siguientes encabezados: {', '.join(headers.mapped('name'))}"
+            )
+        return lines
 
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
@@ -407,39 +1527,132 @@ class SaleOrderLine(models.Model):
         help="Texto libre para condiciones particulares de esta sección"
     )
     
+    # Estructura del capítulo: evita reconstruirla a partir de los nombres decorados
+    capitulo_key = fields.Char(
+        string='Clave de Capítulo',
+        index=True,
+        help="Identifica la instancia de capítulo a la que pertenece la línea dentro del pedido"
+    )
+    
+    seccion_key = fields.Char(
+        string='Clave de Sección',
+        index=True,
+        help="Identifica el encabezado de sección al que pertenece la línea dentro del pedido"
+    )
+    
+    capitulo_id = fields.Many2one(
+        'capitulo.contrato',
+        string='Capítulo de Origen',
+        index=True,
+        ondelete='set null',
+        help="Capítulo técnico desde el que se generó la línea"
+    )
+    
+    capitulo_seccion_id = fields.Many2one(
+        'capitulo.seccion',
+        string='Sección de Origen',
+        index=True,
+        ondelete='set null',
+        help="Sección del capítulo técnico desde la que se generó la línea"
+    )
+    
+    # Instancias del capítulo y la sección en el pedido. No se copian: al
+    # duplicar el pedido se enlazan con las instancias del pedido nuevo
+    order_capitulo_id = fields.Many2one(
+        'sale.order.capitulo',
+        string='Capítulo del Pedido',
+        index=True,
+        ondelete='set null',
+        copy=False,
+    )
+    
+    order_seccion_id = fields.Many2one(
+        'sale.order.seccion',
+        string='Sección del Pedido',
+        index=True,
+        ondelete='set null',
+        copy=False,
+    )
+    
+    def _capitulos_datos_linea(self):
+        """Representación de una línea de producto en el acordeón.
+
+        Producto y unidad de medida van como ids; sus nombres se añaden al
+        leer con ``sale.order._capitulos_resolver_nombres``.
+        """
+        self.ensure_one()
+        return {
+            'id': self.id,  # Añadir ID para edición
+            'sequence': self.sequence,
+            'product_id': self.product_id.id,
+            'name': self.name,
+            'product_uom_qty': self.product_uom_qty,
+            'product_uom_id': self.product_uom.id,
+            'price_unit': self.price_unit,
+            'price_subtotal': self.price_subtotal
+        }
+    
+    def _capitulos_pertenencia(self):
+        """Valores de ``CAMPOS_PERTENENCIA_SECCION`` de la línea, con los Many2one como ids"""
+        self.ensure_one()
+        return tuple(
+            (campo, self[campo].id if self._fields[campo].type == 'many2one' else self[campo])
+            for campo in CAMPOS_PERTENENCIA_SECCION
+        )
+    
+    def _capitulos_enlazar_por_posicion(self):
+        """Liga las líneas con la sección cuyo encabezado tienen delante en el pedido.
+
+        Las líneas que se crean o se mueven con el editor estándar del pedido
+        no pasan por el wizard: pertenecen a la sección del encabezado que las
+        precede en el orden (secuencia, id), como en los pedidos anteriores a
+        las claves, y a ninguna si lo que las precede es un encabezado de
+        capítulo o nada. Las líneas se escriben una vez por sección.
+        """
+        lineas = self.filtered(lambda l: not (l.es_encabezado_capitulo or l.es_encabezado_seccion))
+        if not lineas:
+            return
+        encabezados = self.search([
+            ('order_id', 'in', lineas.order_id.ids),
+            '|', ('es_encabezado_capitulo', '=', True), ('es_encabezado_seccion', '=', True),
+        ], order='order_id, sequence, id')
+        if not encabezados:
+            return
+        posiciones = defaultdict(list)
+        encabezados_pedido = defaultdict(list)
+        for encabezado in encabezados:
+            posiciones[encabezado.order_id.id].append((encabezado.sequence, encabezado.id))
+            encabezados_pedido[encabezado.order_id.id].append(encabezado)
+        
+        grupos = defaultdict(lambda: self.browse())
+        for line in lineas:
+            indice = bisect_left(posiciones[line.order_id.id], (line.sequence, line.id)) - 1
+            anterior = encabezados_pedido[line.order_id.id][indice] if indice >= 0 else None
+            if anterior and anterior.es_encabezado_seccion:
+                pertenencia = anterior._capitulos_pertenencia()
+            else:
+                pertenencia = tuple((campo, False) for campo in CAMPOS_PERTENENCIA_SECCION)
+            if line._capitulos_pertenencia() != pertenencia:
+                grupos[pertenencia] |= line
+        for pertenencia, lines in grupos.items():
+            lines.with_context(from_capitulo_wizard=True).write(dict(pertenencia))
+    
     def unlink(self):
         """Previene la eliminación de encabezados de capítulos y secciones"""
-        import logging
-        _logger = logging.getLogger(__name__)
-        
-        _logger.info(f"DEBUG UNLINK: Intentando eliminar {len(self)} líneas")
-        _logger.info(f"DEBUG UNLINK: Contexto completo: {dict(self.env.context)}")
-        _logger.info(f"DEBUG UNLINK: from_capitulo_widget: {self.env.context.get('from_capitulo_widget')}")
-        
-        for line in self:
-            _logger.info(f"DEBUG UNLINK: Línea {line.id} - '{line.name}' - Capítulo: {line.es_encabezado_capitulo}, Sección: {line.es_encabezado_seccion}")
-        
-        # Verificar si alguna línea es un encabezado
-        headers_to_delete = self.filtered(lambda l: l.es_encabezado_capitulo or l.es_encabezado_seccion)
-        
-        if headers_to_delete:
-            header_names = ', '.join(headers_to_delete.mapped('name'))
-            _logger.error(f"DEBUG UNLINK: Intentando eliminar encabezados: {header_names}")
-            raise UserError(
-                f"No se pueden eliminar los siguientes encabezados: {header_names}\n"
-                "Los encabezados de capítulos y secciones son elementos estructurales del presupuesto."
-            )
-        
-        # Si llegamos aquí, todas las líneas son productos normales
-        _logger.info("DEBUG UNLINK: Todas las líneas son productos normales, procediendo con eliminación")
-        
-        try:
-            result = super().unlink()
-            _logger.info("DEBUG UNLINK: Eliminación exitosa")
-            return result
-        except Exception as e:
-            _logger.error(f"DEBUG UNLINK: Error durante eliminación: {str(e)}")
-            raise e
+        with self.env['capitulos.perf']._medir('unlink_lineas') as metricas:
+            # Verificar si alguna línea es un encabezado
+            headers_to_delete = self.filtered(lambda l: l.es_encabezado_capitulo or l.es_encabezado_seccion)
+            
+            if headers_to_delete:
+                header_names = ', '.join(headers_to_delete.mapped('name'))
+                raise UserError(
+                    f"No se pueden eliminar los siguientes encabezados: {header_names}\n"
+                    "Los encabezados de capítulos y secciones son elementos estructurales del presupuesto."
+                )
+            
+            # Si llegamos aquí, todas las líneas son productos normales
+            metricas['lineas'] = len(self)
+            return super().unlink()
     
     def write(self, vals):
         """Previene la modificación de campos críticos en encabezados"""
@@ -460,61 +1673,48 @@ class SaleOrderLine(models.Model):
                             f"Los encabezados son elementos estructurales del presupuesto y no se pueden editar."
                         )
         
-        return super().write(vals)
+        res = super().write(vals)
+        if 'sequence' in vals or 'order_id' in vals:
+            # La línea se ha movido: pasa a la sección que tenga delante
+            self._capitulos_enlazar_por_posicion()
+        return res
     
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Controla la creación de nuevas líneas cuando hay capítulos estructurados"""
-        import logging
-        _logger = logging.getLogger(__name__)
-        
-        _logger.info(f"DEBUG CREATE: Creando línea con valores: {vals}")
-        _logger.info(f"DEBUG CREATE: Contexto: {dict(self.env.context)}")
-        _logger.info(f"DEBUG CREATE: from_capitulo_wizard: {self.env.context.get('from_capitulo_wizard')}")
-        
-        # Si se está creando desde el wizard de capítulos, permitir la creación
+        with self.env['capitulos.perf']._medir('create_lineas') as metricas:
+            metricas['lineas'] = len(vals_list)
+            return self._capitulos_crear_validado(vals_list)
+    
+    def _capitulos_crear_validado(self, vals_list):
+        # Si se está creando desde el wizard de capítulos, permitir la creación en bloque
         if self.env.context.get('from_capitulo_wizard'):
-            _logger.info(f"DEBUG CREATE: ✅ Creación permitida por contexto from_capitulo_wizard")
-            try:
-                result = super().create(vals)
-                _logger.info(f"DEBUG CREATE: ✅ Línea creada exitosamente con ID: {result.id}")
-                return result
-            except Exception as e:
-                _logger.error(f"DEBUG CREATE: ❌ Error en super().create(): {str(e)}")
-                import traceback
-                _logger.error(f"DEBUG CREATE: Traceback: {traceback.format_exc()}")
-                raise e
-        
-        # Bloquear la creación manual de encabezados de capítulos y secciones
-        if vals.get('es_encabezado_capitulo') or vals.get('es_encabezado_seccion'):
-            _logger.error(f"DEBUG CREATE: ❌ Intento de crear encabezado manualmente")
-            raise UserError(
-                "No se pueden crear encabezados de capítulos o secciones manualmente.\n"
-                "Use el botón 'Gestionar Capítulos' para añadir capítulos estructurados."
-            )
+            return super().create(vals_list)
         
-        # Bloquear la creación de líneas de tipo 'line_section' que no sean productos normales
-        if vals.get('display_type') in ['line_section', 'line_note'] and not vals.get('product_id'):
-            order_id = vals.get('order_id')
-            if order_id:
-                order = self.env['sale.order'].browse(order_id)
-                existing_headers = order.order_line.filtered(
-                    lambda l: l.es_encabezado_capitulo or l.es_encabezado_seccion
+        order_ids_secciones = set()
+        for vals in vals_list:
+            # Bloquear la creación manual de encabezados de capítulos y secciones
+            if vals.get('es_encabezado_capitulo') or vals.get('es_encabezado_seccion'):
+                raise UserError(
+                    "No se pueden crear encabezados de capítulos o secciones manualmente.\n"
+                    "Use el botón 'Gestionar Capítulos' para añadir capítulos estructurados."
                 )
-                if existing_headers:
-                    _logger.error(f"DEBUG CREATE: ❌ Intento de crear sección/nota con capítulos estructurados")
-                    raise UserError(
-                        "No se pueden añadir secciones o notas manualmente cuando el presupuesto tiene capítulos estructurados.\n"
-                        "Use el botón 'Gestionar Capítulos' para gestionar la estructura."
-                    )
+            
+            # Bloquear la creación de líneas de tipo 'line_section' que no sean productos normales
+            if vals.get('display_type') in ['line_section', 'line_note'] and not vals.get('product_id') and vals.get('order_id'):
+                order_ids_secciones.add(vals['order_id'])
         
-        _logger.info(f"DEBUG CREATE: ✅ Validaciones pasadas, creando línea normal")
-        try:
-            result = super().create(vals)
-            _logger.info(f"DEBUG CREATE: ✅ Línea normal creada exitosamente con ID: {result.id}")
-            return result
-        except Exception as e:
-            _logger.error(f"DEBUG CREATE: ❌ Error en super().create() para línea normal: {str(e)}")
-            import traceback
-            _logger.error(f"DEBUG CREATE: Traceback: {traceback.format_exc()}")
-            raise e
\ No newline at end of file
+        if order_ids_secciones:
+            existing_headers = self.search_count([
+                ('order_id', 'in', list(order_ids_secciones)),
+                '|', ('es_encabezado_capitulo', '=', True), ('es_encabezado_seccion', '=', True),
+            ], limit=1)
+            if existing_headers:
+                raise UserError(
+                    "No se pueden añadir secciones o notas manualmente cuando el presupuesto tiene capítulos estructurados.\n"
+                    "Use el botón 'Gestionar Capítulos' para gestionar la estructura."
+                )
+        
+        lines = super().create(vals_list)
+        lines._capitulos_enlazar_por_posicion()
+        return lines
@@ -0,0 +1,202 @@
+import json
+
+from odoo import models, fields, api
+
+from .sale_order import CAMPOS_LINEA_ACORDEON, TOTALES_VACIOS
+
+
+class SaleOrderCapitulo(models.Model):
+    _name = 'sale.order.capitulo'
+    _description = 'Capítulo Aplicado a un Pedido'
+    _order = 'order_id, sequence, id'
+
+    order_id = fields.Many2one('sale.order', string='Pedido', required=True, ondelete='cascade', index=True)
+    name = fields.Char(string='Nombre del Capítulo', required=True)
+    sequence = fields.Integer(string='Secuencia', default=10)
+    capitulo_key = fields.Char(string='Clave de Capítulo', required=True, index=True)
+    capitulo_id = fields.Many2one(
+        'capitulo.contrato',
+        string='Capítulo de Origen',
+        index=True,
+        ondelete='set null',
+        help="Capítulo técnico desde el que se aplicó al pedido"
+    )
+    seccion_ids = fields.One2many('sale.order.seccion', 'order_capitulo_id', string='Secciones')
+    line_ids = fields.One2many('sale.order.line', 'order_capitulo_id', string='Líneas')
+    currency_id = fields.Many2one(related='order_id.currency_id')
+
+    amount_untaxed = fields.Monetary(string='Base Imponible', compute='_compute_amounts', store=True)
+    amount_tax = fields.Monetary(string='Impuestos', compute='_compute_amounts', store=True)
+    amount_total = fields.Monetary(string='Total', compute='_compute_amounts', store=True)
+    line_count = fields.Integer(string='Nº de Productos', compute='_compute_amounts', store=True)
+
+    # Fragmentos del JSON del acordeón ya serializados. Solo se recalculan
+    # cuando cambian las líneas del propio capítulo; el pedido los concatena
+    payload_encabezado = fields.Char(
+        string='Encabezado en el Acordeón', compute='_compute_payload_fragmento', store=True,
+    )
+    payload_fragmento = fields.Text(
+        string='Fragmento del Acordeón', compute='_compute_payload_fragmento', store=True, prefetch=False,
+        help="Capítulo completo con sus líneas en el formato del acordeón"
+    )
+    payload_fragmento_estructura = fields.Text(
+        string='Estructura del Acordeón', compute='_compute_payload_fragmento', store=True, prefetch=False,
+        help="Capítulo sin líneas para la carga diferida de pedidos grandes"
+    )
+
+    _sql_constraints = [
+        ('capitulo_key_uniq', 'unique(order_id, capitulo_key)', 'La clave del capítulo debe ser única en el pedido.'),
+    ]
+
+    @api.depends('line_ids.price_subtotal', 'line_ids.price_tax', 'line_ids.price_total', 'line_ids.display_type')
+    def _compute_amounts(self):
+        totales = self.env['sale.order']._capitulos_totales([('order_capitulo_id', 'in', self.ids)], 'order_capitulo_id')
+        for capitulo in self:
+            importes = totales.get(capitulo.id, TOTALES_VACIOS)
+            capitulo.amount_untaxed = importes['amount_untaxed']
+            capitulo.amount_tax = importes['amount_tax']
+            capitulo.amount_total = importes['amount_total']
+            capitulo.line_count = importes['product_count']
+
+    @api.depends('capitulo_key', 'name', 'line_ids.sequence', 'line_ids.name', 'line_ids.display_type',
+                 'line_ids.es_encabezado_capitulo', 'line_ids.es_encabezado_seccion',
+                 'line_ids.seccion_key', 'line_ids.order_seccion_id',
+                 'line_ids.product_id', 'line_ids.product_uom_qty', 'line_ids.product_uom',
+                 'line_ids.price_unit', 'line_ids.price_subtotal', 'line_ids.price_tax', 'line_ids.price_total',
+                 'line_ids.condiciones_particulares',
+                 'line_ids.capitulo_seccion_id.product_category_id',
+                 'capitulo_id.seccion_ids.product_category_id')
+    def _compute_payload_fragmento(self):
+        with self.env['capitulos.perf']._medir('compute_fragmentos_capitulo') as metricas:
+            metricas.update(capitulos=len(self), lineas=0)
+            # Importes de todas las secciones afectadas con una sola consulta agregada
+            totales = self.env['sale.order']._capitulos_totales(
+                [('order_capitulo_id', 'in', self.ids)], 'order_seccion_id',
+            )
+            # Misma estructura que el informe y la exportación, limitada a estos capítulos
+            estructuras = self.order_id._capitulos_estructura(capitulo_ids=self.ids, nombres=False)
+            por_capitulo = {
+                capitulo_estructura['order_capitulo_id']: capitulo_estructura
+                for estructura in estructuras.values()
+                for capitulo_estructura in estructura['capitulos']
+                if capitulo_estructura.get('order_capitulo_id')
+            }
+            for capitulo in self:
+                capitulo_estructura = por_capitulo.get(capitulo.id, {'secciones': []})
+                metricas['lineas'] += sum(len(seccion['lineas']) for seccion in capitulo_estructura['secciones'])
+                encabezado, estructura, completo = capitulo._capitulos_fragmento(capitulo_estructura, totales)
+                capitulo.payload_encabezado = encabezado
+                capitulo.payload_fragmento = json.dumps(completo)
+                capitulo.payload_fragmento_estructura = json.dumps(estructura)
+
+    def _capitulos_categorias_por_nombre(self):
+        """Índice nombre normalizado → id de categoría para encabezados sin sección de origen"""
+        self.ensure_one()
+        SaleOrder = self.env['sale.order']
+        por_nombre = {}
+        for seccion in self.capitulo_id.seccion_ids:
+            nombre = SaleOrder._get_base_name(seccion.name).upper()
+            if seccion.product_category_id and nombre not in por_nombre:
+                por_nombre[nombre] = seccion.product_category_id.id
+        return por_nombre
+
+    def _capitulos_fragmento(self, capitulo_estructura, totales):
+        """Construye el capítulo en el formato del acordeón a partir de su estructura.
+
+        ``capitulo_estructura`` es el capítulo tal como lo devuelve
+        ``sale.order._capitulos_estructura``: cada sección lleva las líneas
+        enlazadas a ella, las mismas que imprime el informe. ``totales`` son
+        los importes agregados por id de ``sale.order.seccion``.
+        Devuelve el nombre del encabezado y dos versiones del capítulo: solo
+        la estructura (carga diferida) y la completa, con los datos de cada
+        línea de producto. Productos, unidades de medida y categorías se
+        guardan como ids: los nombres dependen del idioma de quien lee y los
+        añade ``sale.order._capitulos_resolver_nombres``.
+        """
+        self.ensure_one()
+        categorias_por_nombre = None
+        secciones_origen = self.env['capitulo.seccion'].browse(
+            {seccion['capitulo_seccion_id'] for seccion in capitulo_estructura['secciones']} - {False}
+        )
+        categorias_origen = {s.id: s.product_category_id.id for s in secciones_origen if s.product_category_id}
+        encabezado = capitulo_estructura.get('encabezado') or self.name
+        secciones = {}
+        importes_capitulo = dict(TOTALES_VACIOS)
+        for seccion in capitulo_estructura['secciones']:
+            # Categoría de la sección de origen y, en encabezados sin ella,
+            # la de la sección con el mismo nombre en el capítulo de origen
+            category_id = categorias_origen.get(seccion['capitulo_seccion_id'])
+            if not category_id:
+                if categorias_por_nombre is None:
+                    categorias_por_nombre = self._capitulos_categorias_por_nombre()
+                category_id = categorias_por_nombre.get(
+                    self.env['sale.order']._get_base_name(seccion['encabezado']).upper()
+                )
+            seccion_data = {
+                'seccion_key': seccion['seccion_key'],
+                'lines': [{campo: linea[campo] for campo in CAMPOS_LINEA_ACORDEON} for linea in seccion['lineas']],
+                'line_count': len(seccion['lineas']),
+                'lazy': False,
+                'condiciones_particulares': seccion['condiciones_particulares'],
+                'category_id': category_id,
+            }
+            importes = totales.get(seccion['order_seccion_id'], TOTALES_VACIOS)
+            seccion_data.update(importes)
+            for campo, valor in importes.items():
+                importes_capitulo[campo] += valor
+            secciones[seccion['encabezado']] = seccion_data
+
+        completo = dict(
+            importes_capitulo,
+            capitulo_key=self.capitulo_key,
+            sections=secciones,
+            total=importes_capitulo['amount_untaxed'],
+            lazy=False,
+        )
+        estructura = dict(completo, lazy=True, sections={
+            nombre: dict(seccion, lines=[], lazy=True) for nombre, seccion in secciones.items()
+        })
+        return encabezado, estructura, completo
+
+
+class SaleOrderSeccion(models.Model):
+    _name = 'sale.order.seccion'
+    _description = 'Sección de un Capítulo Aplicado a un Pedido'
+    _order = 'order_capitulo_id, sequence, id'
+
+    order_capitulo_id = fields.Many2one(
+        'sale.order.capitulo', string='Capítulo', required=True, ondelete='cascade', index=True,
+    )
+    order_id = fields.Many2one(related='order_capitulo_id.order_id', store=True, index=True)
+    name = fields.Char(string='Nombre de la Sección', required=True)
+    sequence = fields.Integer(string='Secuencia', default=10)
+    seccion_key = fields.Char(string='Clave de Sección', required=True, index=True)
+    capitulo_seccion_id = fields.Many2one(
+        'capitulo.seccion',
+        string='Sección de Origen',
+        index=True,
+        ondelete='set null',
+        help="Sección del capítulo técnico desde la que se generó"
+    )
+    es_fija = fields.Boolean(string='Sección Fija', default=False)
+    line_ids = fields.One2many('sale.order.line', 'order_seccion_id', string='Líneas')
+    currency_id = fields.Many2one(related='order_capitulo_id.currency_id')
+
+    amount_untaxed = fields.Monetary(string='Base Imponible', compute='_compute_amounts', store=True)
+    amount_tax = fields.Monetary(string='Impuestos', compute='_compute_amounts', store=True)
+    amount_total = fields.Monetary(string='Total', compute='_compute_amounts', store=True)
+    line_count = fields.Integer(string='Nº de Productos', compute='_compute_amounts', store=True)
+
+    _sql_constraints = [
+        ('seccion_key_uniq', 'unique(order_capitulo_id, seccion_key)', 'La clave de la sección debe ser única en el capítulo.'),
+    ]
+
+    @api.depends('line_ids.price_subtotal', 'line_ids.price_tax', 'line_ids.price_total', 'line_ids.display_type')
+    def _compute_amounts(self):
+        totales = self.env['sale.order']._capitulos_totales([('order_seccion_id', 'in', self.ids)], 'order_seccion_id')
+        for seccion in self:
+            importes = totales.get(seccion.id, TOTALES_VACIOS)
+            seccion.amount_untaxed = importes['amount_untaxed']
+            seccion.amount_tax = importes['amount_tax']
+            seccion.amount_total = importes['amount_total']
+            seccion.line_count = importes['product_count']
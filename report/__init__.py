@@ -0,0 +1 @@
+from . import sale_order_capitulos_report
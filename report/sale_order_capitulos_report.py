@@ -0,0 +1,26 @@
+from odoo import models, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+class ReportSaleOrderCapitulos(models.AbstractModel):
+    _name = 'report.capitulos.report_saleorder_capitulos'
+    _description = 'Presupuesto Agrupado por Capítulos'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        """Prepara la estructura de capítulos de todos los pedidos antes de renderizar.
+
+        La plantilla solo recorre ``estructuras``: no vuelve a leer ni a
+        agrupar las líneas de los pedidos.
+        """
+        docs = self.env['sale.order'].browse(docids)
+        with self.env['capitulos.perf']._medir('informe_capitulos') as metricas:
+            estructuras = docs._capitulos_estructura()
+            metricas['pedidos'] = len(docs)
+        return {
+            'doc_ids': docs.ids,
+            'doc_model': 'sale.order',
+            'docs': docs,
+            'estructuras': estructuras,
+        }
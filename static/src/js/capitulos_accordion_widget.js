@@ -2,11 +2,61 @@
 
 import { registry } from "@web/core/registry";
 import { standardFieldProps } from "@web/views/fields/standard_field_props";
-import { Component, useState } from "@odoo/owl";
+import { Component, useState, onWillStart, onWillUnmount } from "@odoo/owl";
 import { useService } from "@web/core/utils/hooks";
 import { _t } from "@web/core/l10n/translation";
 import { Dialog } from "@web/core/dialog/dialog";
 
+// Trabajos de aplicación en segundo plano que siguen avanzando
+const ACTIVE_JOB_STATES = ["pendiente", "en_curso"];
+const JOB_POLL_INTERVAL = 2000;
+
+// Importes agregados que el servidor envía por capítulo y por sección
+const AMOUNT_FIELDS = ["amount_untaxed", "amount_tax", "amount_total", "product_count"];
+
+function assignAmounts(target, source) {
+    for (const field of AMOUNT_FIELDS) {
+        if (field in source) {
+            target[field] = source[field];
+        }
+    }
+}
+
+/**
+ * Devuelve los datos del acordeón en la forma agrupada por nombres (v1).
+ *
+ * El formato compacto (v2) envía capítulos y secciones como listas y las
+ * líneas por columnas, con los nombres de producto y unidad de medida en
+ * tablas de consulta; aquí se reconstruyen los objetos que usa el widget.
+ */
+export function decodeCapitulosPayload(payload) {
+    if (!payload || payload.v !== 2) {
+        return payload || {};
+    }
+    const { products, uoms } = payload;
+    const data = {};
+    for (const { name: chapterName, sections, ...chapter } of payload.chapters) {
+        const decodedSections = {};
+        for (const { name: sectionName, cols, ...section } of sections) {
+            section.lines = cols.id.map((id, index) => {
+                const productName = products[cols.product[index]];
+                return {
+                    id,
+                    product_name: productName,
+                    name: cols.name[index] ?? productName,
+                    product_uom_qty: cols.qty[index],
+                    product_uom: uoms[cols.uom[index]],
+                    price_unit: cols.price_unit[index],
+                    price_subtotal: cols.price_subtotal[index],
+                };
+            });
+            decodedSections[sectionName] = section;
+        }
+        data[chapterName] = { ...chapter, sections: decodedSections };
+    }
+    return data;
+}
+
 export class CapitulosAccordionWidget extends Component {
     static template = "capitulos.CapitulosAccordionWidget";
     static props = {
@@ -17,17 +67,62 @@ export class CapitulosAccordionWidget extends Component {
     setup() {
         this.state = useState({ 
             collapsedChapters: {},
+            loadingChapters: {},
             editingLine: null,
             editValues: {},
+            batchEdit: false,
+            batchValues: {}, // Cambios pendientes por línea en el modo de edición múltiple
+            selectedLines: {}, // Líneas marcadas para eliminación múltiple
             showProductDialog: false,
             currentSection: null,
             currentChapter: null,
-            condicionesParticulares: {} // Objeto para almacenar condiciones por sección
+            condicionesParticulares: {}, // Objeto para almacenar condiciones por sección
+            jobs: [] // Capítulos que se están aplicando en segundo plano
         });
         
         this.orm = useService("orm");
         this.notification = useService("notification");
         this.dialog = useService("dialog");
+        
+        onWillStart(() => this.loadJobs());
+        onWillUnmount(() => clearTimeout(this.jobPollTimeout));
+    }
+
+    get activeJobs() {
+        return this.state.jobs.filter((job) => ACTIVE_JOB_STATES.includes(job.state));
+    }
+
+    async loadJobs() {
+        const orderId = this.props.record.resId;
+        if (!orderId) {
+            return;
+        }
+        const activeBefore = this.activeJobs.length;
+        try {
+            this.state.jobs = await this.orm.call("capitulo.apply.job", "get_order_progress", [orderId]);
+        } catch (error) {
+            console.error('Error al consultar el progreso de los capítulos:', error);
+            return;
+        }
+        const activeNow = this.activeJobs.length;
+        if (activeNow < activeBefore) {
+            // Un trabajo ha terminado: se recarga el pedido una sola vez
+            await this.props.record.load();
+        }
+        clearTimeout(this.jobPollTimeout);
+        if (activeNow) {
+            this.jobPollTimeout = setTimeout(() => this.loadJobs(), JOB_POLL_INTERVAL);
+        }
+    }
+
+    async retryJob(job) {
+        await this.orm.call("capitulo.apply.job", "retry_job", [job.id]);
+        await this.loadJobs();
+    }
+
+    async dismissJob(job) {
+        await this.orm.call("capitulo.apply.job", "dismiss_job", [job.id]);
+        await this.loadJobs();
     }
 
     get value() {
@@ -35,12 +130,60 @@ export class CapitulosAccordionWidget extends Component {
     }
 
     get parsedData() {
-        try {
-            return this.value ? JSON.parse(this.value) : {};
-        } catch (e) {
-            console.error('Error parsing capitulos data:', e);
-            return {};
+        // El JSON del servidor se interpreta una sola vez; después las
+        // modificaciones del acordeón se aplican sobre esta copia como deltas
+        if (this.value !== this.loadedValue) {
+            this.loadedValue = this.value;
+            try {
+                this.localData = this.value ? decodeCapitulosPayload(JSON.parse(this.value)) : {};
+            } catch (e) {
+                console.error('Error parsing capitulos data:', e);
+                this.localData = {};
+            }
+        }
+        return this.localData;
+    }
+
+    getSectionKey(chapterName, sectionName) {
+        const section = this.parsedData[chapterName]?.sections?.[sectionName];
+        return section ? section.seccion_key || null : null;
+    }
+
+    applyDelta(delta) {
+        if (!delta) {
+            return;
+        }
+        const data = this.parsedData;
+        const sectionsByKey = {};
+        const chaptersByKey = {};
+        for (const chapter of Object.values(data)) {
+            if (chapter.capitulo_key) {
+                chaptersByKey[chapter.capitulo_key] = chapter;
+            }
+            for (const section of Object.values(chapter.sections || {})) {
+                if (section.seccion_key) {
+                    sectionsByKey[section.seccion_key] = section;
+                }
+            }
+        }
+        for (const sectionDelta of delta.sections || []) {
+            const section = sectionsByKey[sectionDelta.seccion_key];
+            if (section) {
+                section.lines = sectionDelta.lines;
+                section.line_count = sectionDelta.lines.length;
+                section.lazy = false;
+                section.condiciones_particulares = sectionDelta.condiciones_particulares;
+                assignAmounts(section, sectionDelta);
+            }
+        }
+        for (const chapterDelta of delta.chapters || []) {
+            const chapter = chaptersByKey[chapterDelta.capitulo_key];
+            if (chapter) {
+                chapter.total = chapterDelta.total;
+                assignAmounts(chapter, chapterDelta);
+            }
         }
+        this.render();
     }
 
     get chapters() {
@@ -56,20 +199,68 @@ export class CapitulosAccordionWidget extends Component {
     }
 
     toggleChapter(chapterName) {
+        const collapse = !this.isChapterCollapsed(chapterName);
         this.state.collapsedChapters = {
             ...this.state.collapsedChapters,
-            [chapterName]: !this.state.collapsedChapters[chapterName]
+            [chapterName]: collapse
         };
+        if (!collapse) {
+            this.loadChapterLines(chapterName);
+        }
     }
 
     isChapterCollapsed(chapterName) {
-        return this.state.collapsedChapters[chapterName] || false;
+        const collapsed = this.state.collapsedChapters[chapterName];
+        if (collapsed !== undefined) {
+            return collapsed;
+        }
+        // Los capítulos sin líneas cargadas empiezan plegados
+        return Boolean(this.parsedData[chapterName]?.lazy);
+    }
+
+    isChapterLoading(chapterName) {
+        return this.state.loadingChapters[chapterName] || false;
+    }
+
+    async loadChapterLines(chapterName) {
+        // Carga diferida: las líneas solo se piden la primera vez que se
+        // despliega el capítulo y quedan en la copia local hasta que el
+        // servidor envíe un nuevo valor del campo
+        const chapter = this.parsedData[chapterName];
+        if (!chapter || !chapter.lazy || this.isChapterLoading(chapterName)) {
+            return;
+        }
+        this.state.loadingChapters[chapterName] = true;
+        try {
+            const result = await this.orm.call(
+                'sale.order',
+                'get_accordion_lines',
+                [this.props.record.resId],
+                { capitulo_key: chapter.capitulo_key }
+            );
+            chapter.lazy = false;
+            this.applyDelta(result.delta);
+        } catch (error) {
+            console.error('Error al cargar las líneas del capítulo:', error);
+            this.notification.add(
+                _t('Error al cargar las líneas del capítulo'),
+                { type: 'danger' }
+            );
+        } finally {
+            this.state.loadingChapters[chapterName] = false;
+        }
     }
 
     getSections(chapter) {
         return Object.keys(chapter.sections || {}).map((sectionName) => ({
             name: sectionName,
-            lines: chapter.sections[sectionName].lines || []
+            lines: chapter.sections[sectionName].lines || [],
+            lazy: chapter.sections[sectionName].lazy || false,
+            lineCount: chapter.sections[sectionName].line_count || 0,
+            productCount: chapter.sections[sectionName].product_count || 0,
+            amountUntaxed: chapter.sections[sectionName].amount_untaxed || 0,
+            amountTax: chapter.sections[sectionName].amount_tax || 0,
+            amountTotal: chapter.sections[sectionName].amount_total || 0
         }));
     }
 
@@ -79,99 +270,39 @@ export class CapitulosAccordionWidget extends Component {
 
     async addProductToSection(chapterName, sectionName) {
         try {
-            console.log('DEBUG: addProductToSection llamado con:', {
-                chapterName: chapterName,
-                sectionName: sectionName,
-                orderId: this.props.record.resId
-            });
-            
             // Obtener la categoría de la sección
             const data = this.parsedData;
             let categoryId = null;
             
             if (data && data[chapterName] && data[chapterName].sections && data[chapterName].sections[sectionName]) {
                 categoryId = data[chapterName].sections[sectionName].category_id;
-                console.log('DEBUG: Categoría de la sección:', categoryId);
-            }
-            
-            // Debug: Mostrar todos los capítulos y secciones disponibles
-            console.log('DEBUG: Capítulos disponibles en parsedData:');
-            for (const [capName, capData] of Object.entries(data || {})) {
-                console.log(`DEBUG: - Capítulo: '${capName}'`);
-                for (const [secName, secData] of Object.entries(capData.sections || {})) {
-                    console.log(`DEBUG:   - Sección: '${secName}' (categoría: ${secData.category_id || 'ninguna'})`);
-                }
             }
             
             // Abrir el diálogo de selección de productos con filtro de categoría
             const productId = await this.openProductSelector(categoryId);
             
             if (!productId) {
-                console.log('DEBUG: No se seleccionó producto, cancelando');
                 return;
             }
             
-            console.log('DEBUG: Producto seleccionado:', productId);
             const orderId = this.props.record.resId;
             
             // Usar el método del modelo Python para añadir el producto
-            console.log('DEBUG: Llamando al método add_product_to_section...');
             const result = await this.orm.call(
                 'sale.order',
                 'add_product_to_section',
-                [orderId, chapterName, sectionName, productId, 1.0]
+                [orderId, chapterName, sectionName, productId, 1.0],
+                { seccion_key: this.getSectionKey(chapterName, sectionName) }
             );
             
-            console.log('DEBUG: Resultado del método:', result);
-            
             if (result && result.success) {
-                console.log('DEBUG: Producto añadido exitosamente, recargando datos...');
                 this.notification.add(
                     result.message || _t('Producto añadido correctamente'),
                     { type: 'success' }
                 );
-                
-                // ESTRATEGIA DE RECARGA MEJORADA
-                console.log('DEBUG: Iniciando recarga de datos...');
-                
-                // 1. Recargar el registro completo
-                await this.props.record.load();
-                console.log('DEBUG: Registro recargado');
-                
-                // 2. Forzar recálculo del modelo raíz si existe
-                if (this.props.record.model && this.props.record.model.root) {
-                    await this.props.record.model.root.load();
-                    console.log('DEBUG: Modelo raíz recargado');
-                }
-                
-                // 3. Forzar actualización del estado reactivo
-                this.state.collapsedChapters = { ...this.state.collapsedChapters };
-                
-                // 4. Esperar un tick para que se procesen los cambios
-                await new Promise(resolve => setTimeout(resolve, 100));
-                
-                // 5. Forzar re-renderizado del componente
-                this.render();
-                
-                console.log('DEBUG: Datos después de recarga:', this.parsedData);
-                console.log('DEBUG: Capítulos encontrados:', this.chapters.length);
-                
-                // Verificar si los datos se actualizaron correctamente
-                const updatedData = this.parsedData;
-                if (updatedData && Object.keys(updatedData).length > 0) {
-                    console.log('DEBUG: ✅ Datos actualizados correctamente');
-                    for (const [chapterName, chapterData] of Object.entries(updatedData)) {
-                        console.log(`DEBUG: Capítulo '${chapterName}' tiene ${Object.keys(chapterData.sections || {}).length} secciones`);
-                        for (const [sectionName, sectionData] of Object.entries(chapterData.sections || {})) {
-                            console.log(`DEBUG: Sección '${sectionName}' tiene ${(sectionData.lines || []).length} productos`);
-                        }
-                    }
-                } else {
-                    console.log('DEBUG: ❌ Los datos siguen vacíos después de la recarga');
-                }
-                
+                // Solo se actualiza la sección afectada, sin recargar el pedido
+                this.applyDelta(result.delta);
             } else {
-                console.log('DEBUG: Error en el resultado:', result);
                 this.notification.add(
                     result?.error || result?.message || _t('Error al añadir el producto'),
                     { type: 'danger' }
@@ -179,7 +310,7 @@ export class CapitulosAccordionWidget extends Component {
             }
             
         } catch (error) {
-            console.error('DEBUG: Error al añadir producto:', error);
+            console.error('Error al añadir producto:', error);
             this.notification.add(
                 _t('Error al añadir producto a la sección: ') + (error.message || error),
                 { type: 'danger' }
@@ -232,32 +363,16 @@ export class CapitulosAccordionWidget extends Component {
             const lineId = this.state.editingLine;
             
             // Validar valores antes de guardar
-            const quantity = parseFloat(this.state.editValues.product_uom_qty);
-            const price = parseFloat(this.state.editValues.price_unit);
-            
-            if (isNaN(quantity) || quantity < 0) {
-                this.notification.add(
-                    _t('La cantidad debe ser un número válido mayor o igual a 0'),
-                    { type: 'warning' }
-                );
-                return;
-            }
-            
-            if (isNaN(price) || price < 0) {
-                this.notification.add(
-                    _t('El precio debe ser un número válido mayor o igual a 0'),
-                    { type: 'warning' }
-                );
+            const updateValues = this.prepareLineValues(this.state.editValues);
+            if (!updateValues) {
                 return;
             }
             
-            const updateValues = {
-                product_uom_qty: quantity,
-                price_unit: price,
-                name: this.state.editValues.name || ''
-            };
-            
-            await this.orm.write('sale.order.line', [parseInt(lineId)], updateValues);
+            const result = await this.orm.call(
+                'sale.order',
+                'update_section_line',
+                [this.props.record.resId, parseInt(lineId), updateValues]
+            );
             
             this.notification.add(
                 _t('Línea actualizada correctamente'),
@@ -267,8 +382,7 @@ export class CapitulosAccordionWidget extends Component {
             this.state.editingLine = null;
             this.state.editValues = {};
             
-            // Recargar los datos del widget
-            await this.props.record.load();
+            this.applyDelta(result.delta);
             
         } catch (error) {
             console.error('Error al guardar:', error);
@@ -281,11 +395,8 @@ export class CapitulosAccordionWidget extends Component {
 
     async deleteLine(lineId) {
         try {
-            console.log('DEBUG: deleteLine llamado con lineId:', lineId);
-            
             // Verificar que el lineId es válido
             if (!lineId || isNaN(parseInt(lineId))) {
-                console.error('DEBUG: lineId inválido:', lineId);
                 this.notification.add(_t('ID de línea inválido'), { type: 'danger' });
                 return;
             }
@@ -305,27 +416,21 @@ export class CapitulosAccordionWidget extends Component {
               });
             
             if (!confirmed) {
-                console.log('DEBUG: Eliminación cancelada por el usuario');
                 return;
             }
             
-            console.log('DEBUG: Iniciando eliminación de línea ID:', parseInt(lineId));
-            
-            // Llamada directa sin contexto adicional
-            await this.orm.call(
-                'sale.order.line',
-                'unlink',
-                [[parseInt(lineId)]]
+            const result = await this.orm.call(
+                'sale.order',
+                'delete_section_line',
+                [this.props.record.resId, parseInt(lineId)]
             );
             
-            console.log('DEBUG: Eliminación exitosa');
             this.notification.add(_t('Línea eliminada correctamente'), { type: 'success' });
-            
-            // Recargar los datos
-            await this.props.record.load();
+            delete this.state.selectedLines[lineId];
+            this.applyDelta(result.delta);
             
         } catch (error) {
-            console.error('DEBUG: Error al eliminar línea:', error);
+            console.error('Error al eliminar línea:', error);
             let errorMessage = 'Error desconocido';
             
             if (error.data && error.data.message) {
@@ -338,6 +443,85 @@ export class CapitulosAccordionWidget extends Component {
         }
     }
 
+    // Métodos para selección y eliminación múltiple
+    isLineSelected(lineId) {
+        return Boolean(this.state.selectedLines[lineId]);
+    }
+
+    toggleLineSelection(lineId) {
+        if (this.state.selectedLines[lineId]) {
+            delete this.state.selectedLines[lineId];
+        } else {
+            this.state.selectedLines[lineId] = true;
+        }
+    }
+
+    areLinesSelected(lines) {
+        return lines.length > 0 && lines.every((line) => this.state.selectedLines[line.id]);
+    }
+
+    setLinesSelection(lines, selected) {
+        for (const line of lines) {
+            if (selected) {
+                this.state.selectedLines[line.id] = true;
+            } else {
+                delete this.state.selectedLines[line.id];
+            }
+        }
+    }
+
+    getChapterLines(chapter) {
+        return Object.values(chapter.sections || {}).flatMap((section) => section.lines || []);
+    }
+
+    get selectedLineCount() {
+        return Object.keys(this.state.selectedLines).length;
+    }
+
+    clearSelection() {
+        this.state.selectedLines = {};
+    }
+
+    async deleteSelectedLines() {
+        const lineIds = Object.keys(this.state.selectedLines).map((lineId) => parseInt(lineId));
+        if (!lineIds.length) {
+            return;
+        }
+        
+        const confirmed = await new Promise((resolve) => {
+            this.dialog.add(DeleteConfirmDialog, {
+                title: _t("Confirmar eliminación"),
+                productName: `${lineIds.length} líneas seleccionadas`,
+                onConfirm: () => resolve(true),
+                onCancel: () => resolve(false),
+            });
+        });
+        if (!confirmed) {
+            return;
+        }
+        
+        try {
+            // Una sola llamada: el servidor elimina todas las líneas con un único unlink
+            const result = await this.orm.call(
+                'sale.order',
+                'delete_section_lines',
+                [this.props.record.resId, lineIds]
+            );
+            this.notification.add(
+                result.message || _t('Líneas eliminadas correctamente'),
+                { type: 'success' }
+            );
+            this.clearSelection();
+            this.applyDelta(result.delta);
+        } catch (error) {
+            console.error('Error al eliminar líneas:', error);
+            this.notification.add(
+                _t('Error al eliminar las líneas: ') + (error.data?.message || error.message || error),
+                { type: 'danger' }
+            );
+        }
+    }
+
     findLineById(lineId) {
         const data = this.parsedData;
         if (!data) {
@@ -364,13 +548,119 @@ export class CapitulosAccordionWidget extends Component {
         return null;
     }
 
-    updateEditValue(field, value) {
+    updateEditValue(field, value, lineId = null) {
+        if (this.state.batchEdit && lineId !== null) {
+            this.state.batchValues[lineId] = {
+                ...this.state.batchValues[lineId],
+                [field]: value
+            };
+            return;
+        }
         this.state.editValues = {
             ...this.state.editValues,
             [field]: value
         };
     }
 
+    isLineEditable(lineId) {
+        return this.state.batchEdit || this.state.editingLine === lineId;
+    }
+
+    getEditValue(lineId, field) {
+        if (!this.state.batchEdit) {
+            return this.state.editValues[field];
+        }
+        const pending = this.state.batchValues[lineId];
+        if (pending && pending[field] !== undefined) {
+            return pending[field];
+        }
+        const line = this.findLineById(lineId);
+        return line ? line[field] : '';
+    }
+
+    // Métodos para edición múltiple
+    startBatchEdit() {
+        this.cancelEdit();
+        this.state.batchValues = {};
+        this.state.batchEdit = true;
+    }
+
+    cancelBatchEdit() {
+        this.state.batchEdit = false;
+        this.state.batchValues = {};
+    }
+
+    get batchChangeCount() {
+        return Object.keys(this.state.batchValues).length;
+    }
+
+    prepareLineValues(values) {
+        // Valida y convierte los campos editados; devuelve null si hay errores
+        const result = {};
+        if (values.product_uom_qty !== undefined) {
+            const quantity = parseFloat(values.product_uom_qty);
+            if (isNaN(quantity) || quantity < 0) {
+                this.notification.add(
+                    _t('La cantidad debe ser un número válido mayor o igual a 0'),
+                    { type: 'warning' }
+                );
+                return null;
+            }
+            result.product_uom_qty = quantity;
+        }
+        if (values.price_unit !== undefined) {
+            const price = parseFloat(values.price_unit);
+            if (isNaN(price) || price < 0) {
+                this.notification.add(
+                    _t('El precio debe ser un número válido mayor o igual a 0'),
+                    { type: 'warning' }
+                );
+                return null;
+            }
+            result.price_unit = price;
+        }
+        if (values.name !== undefined) {
+            result.name = values.name || '';
+        }
+        return result;
+    }
+
+    async saveBatchEdit() {
+        const changes = [];
+        for (const [lineId, values] of Object.entries(this.state.batchValues)) {
+            const updateValues = this.prepareLineValues(values);
+            if (!updateValues) {
+                return;
+            }
+            changes.push({ id: parseInt(lineId), ...updateValues });
+        }
+        if (!changes.length) {
+            this.cancelBatchEdit();
+            return;
+        }
+        
+        try {
+            // Todas las líneas se guardan en una única llamada y transacción
+            const result = await this.orm.call(
+                'sale.order',
+                'update_section_lines',
+                [this.props.record.resId, changes]
+            );
+            this.notification.add(
+                result.message || _t('Líneas actualizadas correctamente'),
+                { type: 'success' }
+            );
+            this.cancelBatchEdit();
+            this.applyDelta(result.delta);
+        } catch (error) {
+            console.error('Error al guardar los cambios:', error);
+            this.notification.add(
+                _t('Error al guardar los cambios: ') + (error.data?.message || error.message || error),
+                { type: 'danger' }
+            );
+        }
+    }
+
     // Métodos para manejar las condiciones particulares
     updateCondicionesParticulares(chapterName, sectionName, value) {
         // Crear clave única para esta sección específica
@@ -379,10 +669,6 @@ export class CapitulosAccordionWidget extends Component {
         // Guardar el valor en el estado local para esta sección específica
         this.state.condicionesParticulares[sectionKey] = value;
         
-        // Log para depuración
-        console.log(`Condiciones particulares actualizadas para ${sectionKey}:`, value);
-        console.log('Estado completo de condiciones:', this.state.condicionesParticulares);
-        
         // Guardar automáticamente en el servidor
         this.saveCondicionesParticulares(chapterName, sectionName, value);
     }
@@ -390,13 +676,14 @@ export class CapitulosAccordionWidget extends Component {
     async saveCondicionesParticulares(chapterName, sectionName, value) {
         try {
             const orderId = this.props.record.resId;
-            console.log(`Guardando condiciones particulares para ${chapterName}::${sectionName}:`, value);
             
-            await this.orm.call('sale.order', 'save_condiciones_particulares', [
-                orderId, chapterName, sectionName, value
-            ]);
-            
-            console.log('✅ Condiciones particulares guardadas correctamente');
+            const result = await this.orm.call(
+                'sale.order',
+                'save_condiciones_particulares',
+                [orderId, chapterName, sectionName, value],
+                { seccion_key: this.getSectionKey(chapterName, sectionName) }
+            );
+            this.applyDelta(result.delta);
         } catch (error) {
             console.error('❌ Error al guardar condiciones particulares:', error);
             this.notification.add(
@@ -429,32 +716,12 @@ export class CapitulosAccordionWidget extends Component {
     }
     
     // MÉTODO DE DEBUGGING - FORZAR ACTUALIZACIÓN MANUAL
+    // El servidor mantiene los fragmentos de cada capítulo al día: basta con
+    // recargar el registro para obtener el JSON ensamblado
     async forceRefresh() {
-        console.log('🔄 FORCE REFRESH: Iniciando actualización forzada...');
-        
         try {
-            // Obtener datos frescos directamente del servidor
-            const orderId = this.props.record.resId;
-            console.log('🔄 FORCE REFRESH: Order ID:', orderId);
-            
-            // Llamar directamente al método computed
-            await this.orm.call('sale.order', '_compute_capitulos_agrupados', [[orderId]]);
-            console.log('🔄 FORCE REFRESH: Método computed ejecutado');
-            
-            // Recargar el registro
             await this.props.record.load();
-            console.log('🔄 FORCE REFRESH: Registro recargado');
-            
-            // Verificar datos
-            const newData = this.parsedData;
-            console.log('🔄 FORCE REFRESH: Nuevos datos:', newData);
-            console.log('🔄 FORCE REFRESH: Capítulos:', Object.keys(newData).length);
-            
-            // Forzar re-render
             this.render();
-            
-            console.log('🔄 FORCE REFRESH: ✅ Actualización completada');
-            
         } catch (error) {
             console.error('🔄 FORCE REFRESH: ❌ Error:', error);
         }
@@ -495,6 +762,12 @@ export class CapitulosAccordionWidget extends Component {
     }
 }
 
+// Productos por página en el selector
+const PRODUCT_PAGE_SIZE = 100;
+
+// Árbol de categorías compartido por todas las aperturas del selector
+const categoryTreeCache = { version: null, categories: [] };
+
 // Diálogo para seleccionar productos
 class ProductSelectorDialog extends Component {
     static template = "capitulos.ProductSelectorDialog";
@@ -523,6 +796,7 @@ class ProductSelectorDialog extends Component {
             // Para productos
             productSearchTerm: "",
             products: [],
+            productsTotal: 0,
             selectedProduct: null,
             loadingProducts: false,
         });
@@ -561,15 +835,23 @@ class ProductSelectorDialog extends Component {
     async loadCategories() {
         this.state.loadingCategories = true;
         try {
-            const categories = await this.orm.call(
-                'product.category',
-                'search_read',
-                [[], ['name', 'parent_id', 'product_count']],
-                { limit: 100 }
+            // El árbol se guarda entre aperturas del diálogo y solo se vuelve a
+            // descargar cuando cambia su versión en el servidor
+            const result = await this.orm.call(
+                'capitulos.product.lookup',
+                'get_category_tree',
+                [],
+                { version: categoryTreeCache.version }
             );
-            
-            // Filtrar categorías base de Odoo
-            this.state.categories = this.filterOdooBaseCategories(categories);
+            if (!result.unchanged) {
+                categoryTreeCache.version = result.version;
+                categoryTreeCache.categories = this.filterOdooBaseCategories(
+                    result.rows.map((row) => Object.fromEntries(
+                        result.columns.map((column, index) => [column, row[index]])
+                    ))
+                );
+            }
+            this.state.categories = categoryTreeCache.categories;
         } catch (error) {
             console.error('Error al cargar categorías:', error);
             this.notification.add('Error al cargar las categorías', { type: 'danger' });
@@ -699,24 +981,14 @@ class ProductSelectorDialog extends Component {
     }
 
     async searchCategories(searchTerm) {
-        this.state.loadingCategories = true;
-        try {
-            const domain = [['name', 'ilike', searchTerm]];
-            const categories = await this.orm.call(
-                'product.category',
-                'search_read',
-                [domain, ['name', 'parent_id', 'product_count']],
-                { limit: 50 }
-            );
-            
-            // Filtrar categorías base de Odoo
-            this.state.categories = this.filterOdooBaseCategories(categories);
-        } catch (error) {
-            console.error('Error al buscar categorías:', error);
-            this.notification.add('Error al buscar categorías', { type: 'danger' });
-        } finally {
-            this.state.loadingCategories = false;
+        // La búsqueda se hace sobre el árbol ya descargado
+        if (!categoryTreeCache.categories.length) {
+            await this.loadCategories();
         }
+        const term = searchTerm.trim().toLowerCase();
+        this.state.categories = categoryTreeCache.categories.filter(
+            (category) => category.complete_name.toLowerCase().includes(term)
+        );
     }
 
     selectCategory(category) {
@@ -754,26 +1026,29 @@ class ProductSelectorDialog extends Component {
         await this.loadProductsByCategory();
     }
 
-    async loadProductsByCategory(searchTerm = '') {
+    async loadProductsByCategory(searchTerm = '', append = false) {
         this.state.loadingProducts = true;
         try {
-            const domain = [
-                ['categ_id', '=', this.state.selectedCategory.id],
-                ['sale_ok', '=', true]
-            ];
-            
-            // Si hay término de búsqueda, añadirlo al dominio
-            if (searchTerm.trim()) {
-                domain.push(['name', 'ilike', searchTerm.trim()]);
-            }
-            
-            const products = await this.orm.call(
-                'product.product',
-                'search_read',
-                [domain, ['name', 'default_code', 'categ_id', 'list_price', 'uom_id']],
-                { limit: 100 }
+            // Búsqueda en caché del servidor: filas compactas y paginadas
+            const category = this.state.selectedCategory;
+            const result = await this.orm.call(
+                'capitulos.product.lookup',
+                'search_products',
+                [],
+                {
+                    categ_id: category.id,
+                    query: searchTerm.trim(),
+                    offset: append ? this.state.products.length : 0,
+                    limit: PRODUCT_PAGE_SIZE,
+                }
             );
-            this.state.products = products;
+            const products = result.rows.map((row) => {
+                const product = Object.fromEntries(result.columns.map((column, index) => [column, row[index]]));
+                product.categ_id = [category.id, category.name];
+                return product;
+            });
+            this.state.products = append ? [...this.state.products, ...products] : products;
+            this.state.productsTotal = result.total;
             
         } catch (error) {
             console.error('Error al cargar productos:', error);
@@ -783,6 +1058,14 @@ class ProductSelectorDialog extends Component {
         }
     }
 
+    get hasMoreProducts() {
+        return this.state.products.length < this.state.productsTotal;
+    }
+
+    async loadMoreProducts() {
+        await this.loadProductsByCategory(this.state.productSearchTerm, true);
+    }
+
     async onProductSearchInput(event) {
         const searchTerm = event.target.value;
         this.state.productSearchTerm = searchTerm;
@@ -0,0 +1,19 @@
+from . import test_benchmark_capitulos
+from . import test_capitulos_claves
+from . import test_capitulos_aplicar
+from . import test_capitulos_categorias_payload
+from . import test_capitulos_secuencias
+from . import test_capitulos_lineas_pedido
+from . import test_capitulos_delta
+from . import test_capitulos_carga_diferida
+from . import test_capitulos_payload_compacto
+from . import test_capitulos_edicion_lote
+from . import test_capitulos_busqueda_productos
+from . import test_capitulos_categorias
+from . import test_capitulos_plantillas
+from . import test_capitulos_instancias
+from . import test_capitulos_aplicar_lote
+from . import test_capitulos_trabajos
+from . import test_capitulos_tarifa
+from . import test_capitulos_exportacion
+from . import test_capitulos_informe
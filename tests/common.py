@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import TransactionCase
+
+
+class CapitulosCase(TransactionCase):
+    """Datos comunes a las pruebas de capítulos.
+
+    Un cliente, una categoría con tres productos vendibles y una plantilla
+    con dos secciones (dos productos en la primera y uno en la segunda).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Las pruebas aplican los capítulos de forma síncrona salvo que indiquen lo contrario
+        cls.env['ir.config_parameter'].sudo().set_param('capitulos.async_line_threshold', '0')
+
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente Capítulos'})
+        cls.categoria = cls.env['product.category'].create({'name': 'Capítulos Pruebas'})
+        cls.productos = cls.env['product.product'].create([{
+            'name': f'Producto Capítulos {i}',
+            'categ_id': cls.categoria.id,
+            'list_price': 10.0 * (i + 1),
+            'sale_ok': True,
+        } for i in range(3)])
+        cls.plantilla = cls.env['capitulo.contrato'].create({
+            'name': 'Instalación',
+            'es_plantilla': True,
+            'condiciones_legales': 'Condiciones de la plantilla',
+            'seccion_ids': [
+                (0, 0, {
+                    'name': 'Materiales',
+                    'sequence': 10,
+                    'product_category_id': cls.categoria.id,
+                    'product_line_ids': [
+                        (0, 0, {'product_id': cls.productos[0].id, 'cantidad': 2.0, 'sequence': 10}),
+                        (0, 0, {'product_id': cls.productos[1].id, 'cantidad': 1.0, 'sequence': 20}),
+                    ],
+                }),
+                (0, 0, {
+                    'name': 'Mano de Obra',
+                    'sequence': 20,
+                    'product_category_id': cls.categoria.id,
+                    'product_line_ids': [
+                        (0, 0, {'product_id': cls.productos[2].id, 'cantidad': 3.0, 'sequence': 10}),
+                    ],
+                }),
+            ],
+        })
+
+    def _crear_pedido(self, **vals):
+        return self.env['sale.order'].create(dict({'partner_id': self.partner.id}, **vals))
+
+    def _aplicar_plantilla(self, order, plantilla=None, **vals):
+        """Aplica la plantilla al pedido con el wizard y devuelve el resultado de la aplicación"""
+        plantilla = plantilla or self.plantilla
+        wizard = self.env['capitulo.wizard'].create(dict({
+            'order_id': order.id,
+            'modo_creacion': 'existente',
+            'capitulo_id': plantilla.id,
+            'condiciones_particulares': plantilla.condiciones_legales,
+        }, **vals))
+        return wizard._aplicar_al_pedido()
+
+    def _lineas_ordenadas(self, order):
+        return order.order_line.sorted(lambda l: (l.sequence, l.id))
+
+    def _lineas_producto(self, order):
+        return self._lineas_ordenadas(order).filtered(lambda l: not l.display_type)
+
+    def _encabezados_seccion(self, order):
+        return self._lineas_ordenadas(order).filtered('es_encabezado_seccion')
+
+    def _activar_perf(self):
+        """Activa la instrumentación y parte de métricas vacías"""
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.perf_enabled', 'True')
+        self.env['capitulos.perf'].reset_stats()
+
+    def _metrica(self, operacion):
+        return self.env['capitulos.perf'].get_stats()['metricas'].get(operacion, {})
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""Banco de pruebas de rendimiento para presupuestos con capítulos grandes.
+
+No forma parte de la batería estándar: se ejecuta explícitamente con
+
+    odoo-bin -d <bd> -i capitulos --test-tags capitulos_benchmark --stop-after-init
+
+El tamaño se configura con las variables de entorno ``CAPITULOS_BENCH_CAPITULOS``,
+``CAPITULOS_BENCH_SECCIONES``, ``CAPITULOS_BENCH_LINEAS`` (líneas por sección) y
+``CAPITULOS_BENCH_PEDIDOS`` (pedidos de la aplicación en lote).
+Cada medición se emite como una línea JSON en el log y, si se define
+``CAPITULOS_BENCH_OUTPUT``, se añade también a ese fichero.
+"""
+
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from odoo.tests import HttpCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+
+def _entero_entorno(nombre, defecto):
+    try:
+        return int(os.environ.get(nombre, defecto))
+    except ValueError:
+        return defecto
+
+
+@tagged('capitulos_benchmark', '-standard', 'post_install', '-at_install')
+class TestBenchmarkCapitulos(HttpCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.num_capitulos = _entero_entorno('CAPITULOS_BENCH_CAPITULOS', 10)
+        cls.num_secciones = _entero_entorno('CAPITULOS_BENCH_SECCIONES', 20)
+        cls.num_lineas = _entero_entorno('CAPITULOS_BENCH_LINEAS', 50)
+        cls.num_pedidos = _entero_entorno('CAPITULOS_BENCH_PEDIDOS', 20)
+        cls.fichero_salida = os.environ.get('CAPITULOS_BENCH_OUTPUT')
+        # Se mide siempre la inserción síncrona, sea cual sea el tamaño del capítulo
+        cls.env['ir.config_parameter'].sudo().set_param('capitulos.async_line_threshold', '0')
+
+        cls.categoria = cls.env['product.category'].create({'name': 'Benchmark Capítulos'})
+        cls.productos = cls.env['product.product'].create([{
+            'name': f'Producto benchmark {i}',
+            'categ_id': cls.categoria.id,
+            'list_price': 10.0 + i,
+            'sale_ok': True,
+        } for i in range(cls.num_lineas)])
+
+        cls.plantillas = cls.env['capitulo.contrato'].create([
+            cls._vals_plantilla(num_capitulo) for num_capitulo in range(cls.num_capitulos)
+        ])
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente benchmark'})
+
+    @classmethod
+    def _vals_plantilla(cls, num_capitulo):
+        return {
+            'name': f'Capítulo benchmark {num_capitulo}',
+            'es_plantilla': True,
+            'condiciones_legales': 'Condiciones de prueba',
+            'seccion_ids': [(0, 0, {
+                'name': f'Sección {num_seccion}',
+                'sequence': num_seccion * 10,
+                'product_category_id': cls.categoria.id,
+                'product_line_ids': [(0, 0, {
+                    'product_id': producto.id,
+                    'cantidad': 1.0,
+                    'sequence': num_linea * 10,
+                }) for num_linea, producto in enumerate(cls.productos)],
+            }) for num_seccion in range(cls.num_secciones)],
+        }
+
+    def _crear_pedido_con_capitulos(self):
+        """Aplica todas las plantillas a un pedido nuevo mediante el wizard"""
+        order = self.env['sale.order'].create({'partner_id': self.partner.id})
+        for plantilla in self.plantillas:
+            wizard = self.env['capitulo.wizard'].create({
+                'order_id': order.id,
+                'modo_creacion': 'existente',
+                'capitulo_id': plantilla.id,
+                'condiciones_particulares': plantilla.condiciones_legales,
+            })
+            wizard.add_to_order()
+        return order
+
+    def _medir(self, operacion, funcion, **extra):
+        """Mide ``funcion`` y emite el resultado en JSON.
+
+        ``funcion`` recibe el diccionario del resultado para añadir sus
+        propias cifras. Se ejecuta dos veces desde el mismo estado: la
+        primera mide tiempo y consultas SQL y se deshace con un savepoint; la
+        segunda mide la memoria pico, ya que el rastreo de ``tracemalloc``
+        ralentiza la ejecución y falsearía los tiempos.
+        """
+        resultado = dict(extra)
+        self.env.flush_all()
+        self.env.invalidate_all()
+        with self.env.cr.savepoint() as savepoint:
+            consultas_inicio = self.cr.sql_log_count
+            inicio = time.perf_counter()
+            funcion(dict(resultado))
+            self.env.flush_all()
+            duracion = time.perf_counter() - inicio
+            consultas = self.cr.sql_log_count - consultas_inicio
+            savepoint.rollback()
+        self.env.invalidate_all()
+
+        tracemalloc.start()
+        try:
+            funcion(resultado)
+            self.env.flush_all()
+            _actual, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        resultado.update({
+            'operacion': operacion,
+            'capitulos': self.num_capitulos,
+            'secciones': self.num_secciones,
+            'lineas_por_seccion': self.num_lineas,
+            'tiempo_s': round(duracion, 4),
+            'consultas_sql': consultas,
+            'memoria_pico_kb': round(pico / 1024, 1),
+        })
+        self._emitir(resultado)
+        return resultado
+
+    def _emitir(self, resultado):
+        linea = json.dumps(resultado, sort_keys=True)
+        _logger.info("CAPITULOS_BENCHMARK %s", linea)
+        if self.fichero_salida:
+            with open(self.fichero_salida, 'a', encoding='utf-8') as fichero:
+                fichero.write(linea + '\n')
+
+    def _primera_seccion(self, order):
+        """Devuelve (capítulo, sección) de la primera sección con productos del acordeón"""
+        datos = json.loads(order.capitulos_agrupados)
+        capitulo_name = next(iter(datos))
+        seccion_name = next(
+            nombre for nombre in datos[capitulo_name]['sections']
+            if 'condiciones particulares' not in nombre.lower()
+        )
+        return capitulo_name, seccion_name
+
+    def test_benchmark_add_to_order(self):
+        order = self.env['sale.order'].create({'partner_id': self.partner.id})
+        wizard = self.env['capitulo.wizard'].create({
+            'order_id': order.id,
+            'modo_creacion': 'existente',
+            'capitulo_id': self.plantillas[0].id,
+        })
+
+        def aplicar(resultado):
+            wizard.add_to_order()
+            resultado['lineas_pedido'] = len(order.order_line)
+            resultado['filas_wizard'] = len(wizard.seccion_ids) + len(wizard.seccion_ids.line_ids)
+
+        resultado = self._medir('wizard_add_to_order', aplicar)
+        self.assertTrue(resultado['lineas_pedido'])
+
+    def test_benchmark_compute_capitulos_agrupados(self):
+        order = self._crear_pedido_con_capitulos()
+
+        def calcular(resultado):
+            order._compute_capitulos_agrupados()
+            resultado['json_bytes'] = len(order.capitulos_agrupados.encode())
+
+        self._medir('compute_capitulos_agrupados', calcular, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_compute_capitulos_agrupados_compacto(self):
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.payload_format', '2')
+        order = self._crear_pedido_con_capitulos()
+
+        def calcular(resultado):
+            order._compute_capitulos_agrupados()
+            resultado['json_bytes'] = len(order.capitulos_agrupados.encode())
+
+        self._medir('compute_capitulos_agrupados_v2', calcular, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_payload_tras_editar_linea(self):
+        """Editar una línea solo debe recalcular el fragmento de su capítulo"""
+        order = self._crear_pedido_con_capitulos()
+        order.capitulos_agrupados
+        linea = order.order_line.filtered(lambda l: not l.display_type)[:1]
+
+        def editar(resultado):
+            order.update_section_line(order.id, linea.id, {'product_uom_qty': 3.0})
+            resultado['json_bytes'] = len(order.capitulos_agrupados.encode())
+
+        self._medir('payload_tras_editar_linea', editar, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_get_accordion_lines(self):
+        order = self._crear_pedido_con_capitulos()
+        datos = json.loads(order.capitulos_agrupados)
+        capitulo_key = next(iter(datos.values()))['capitulo_key']
+
+        def cargar(resultado):
+            respuesta = order.get_accordion_lines(order.id, capitulo_key=capitulo_key)
+            resultado['json_bytes'] = len(json.dumps(respuesta).encode())
+
+        self._medir('get_accordion_lines', cargar, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_add_product_to_section(self):
+        order = self._crear_pedido_con_capitulos()
+        capitulo_name, seccion_name = self._primera_seccion(order)
+
+        def anadir(resultado):
+            respuesta = order.add_product_to_section(
+                order.id, capitulo_name, seccion_name, self.productos[0].id, 1.0
+            )
+            resultado['json_bytes'] = len(json.dumps(respuesta).encode())
+
+        self._medir('add_product_to_section', anadir, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_save_condiciones_particulares(self):
+        order = self._crear_pedido_con_capitulos()
+        capitulo_name = next(iter(json.loads(order.capitulos_agrupados)))
+
+        def guardar(resultado):
+            order.save_condiciones_particulares(
+                order.id, capitulo_name, '=== CONDICIONES PARTICULARES ===', 'Texto de prueba'
+            )
+
+        self._medir('save_condiciones_particulares', guardar, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_clonar_plantilla(self):
+        def clonar(resultado):
+            capitulo = self.env['capitulo.contrato'].create({
+                'name': 'Copia benchmark',
+                'plantilla_id': self.plantillas[0].id,
+                'modo_precio_copia': 'congelado',
+            })
+            resultado['lineas_copiadas'] = len(capitulo.seccion_ids.product_line_ids)
+
+        self._medir('clonar_plantilla', clonar)
+
+    def test_benchmark_aplicar_en_lote(self):
+        orders = self.env['sale.order'].create([
+            {'partner_id': self.partner.id} for _i in range(self.num_pedidos)
+        ])
+        wizard = self.env['capitulo.mass.apply.wizard'].create({
+            'capitulo_id': self.plantillas[0].id,
+            'order_ids': [(6, 0, orders.ids)],
+        })
+
+        def aplicar(resultado):
+            wizard.action_aplicar()
+            resultado['lineas_creadas'] = sum(wizard.resultado_ids.mapped('lineas_creadas'))
+            resultado['pedidos_error'] = wizard.pedidos_error
+
+        resultado = self._medir('aplicar_capitulo_en_lote', aplicar, pedidos=len(orders))
+        self.assertFalse(resultado['pedidos_error'])
+
+    def test_benchmark_tarifar_capitulo(self):
+        order = self.env['sale.order'].create({'partner_id': self.partner.id})
+        secciones = self.plantillas[0]._secciones_para_pedido()
+
+        def tarifar(resultado):
+            secciones_tarifadas = order._capitulos_tarifar_secciones(secciones)
+            resultado['lineas_tarifadas'] = sum(len(seccion['lineas']) for seccion in secciones_tarifadas)
+
+        self._medir('tarifar_capitulo', tarifar)
+
+    def test_benchmark_exportar_capitulos(self):
+        order = self._crear_pedido_con_capitulos()
+
+        def filas(resultado):
+            resultado['filas'] = sum(1 for _fila in order._capitulos_filas_exportacion())
+
+        self._medir('filas_exportacion', filas, lineas_pedido=len(order.order_line))
+
+        self.authenticate('admin', 'admin')
+        for formato in ('csv', 'xlsx'):
+            def exportar(resultado, formato=formato):
+                respuesta = self.url_open(f'/capitulos/export/{formato}?order_ids={order.id}')
+                self.assertEqual(respuesta.status_code, 200)
+                resultado['bytes'] = len(respuesta.content)
+
+            self._medir(f'ruta_exportar_{formato}', exportar, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_informe_capitulos(self):
+        order = self._crear_pedido_con_capitulos()
+
+        def renderizar(resultado):
+            html, _tipo = self.env['ir.actions.report']._render_qweb_html(
+                'capitulos.report_saleorder_capitulos', order.ids,
+            )
+            resultado['html_bytes'] = len(html)
+
+        self._medir('informe_capitulos_html', renderizar, lineas_pedido=len(order.order_line))
+
+    def test_benchmark_rutas_controlador(self):
+        order = self._crear_pedido_con_capitulos()
+        capitulo_name, seccion_name = self._primera_seccion(order)
+        self.authenticate('admin', 'admin')
+
+        def buscar(resultado):
+            respuesta = self.make_jsonrpc_request('/capitulos/search_products', {
+                'query': 'benchmark',
+                'limit': 100,
+            })
+            resultado['json_bytes'] = len(json.dumps(respuesta).encode())
+
+        self._medir('ruta_search_products', buscar)
+
+        def anadir(resultado):
+            respuesta = self.make_jsonrpc_request('/capitulos/add_product_to_section', {
+                'order_id': order.id,
+                'capitulo_name': capitulo_name,
+                'seccion_name': seccion_name,
+                'product_id': self.productos[0].id,
+            })
+            self.assertTrue(respuesta.get('success'), respuesta)
+            resultado['json_bytes'] = len(json.dumps(respuesta).encode())
+
+        self._medir('ruta_add_product_to_section', anadir, lineas_pedido=len(order.order_line))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosAplicar(CapitulosCase):
+
+    def test_aplicar_con_una_creacion(self):
+        order = self._crear_pedido()
+        self._activar_perf()
+
+        self._aplicar_plantilla(order)
+
+        # Capítulo, dos secciones, tres productos y las condiciones particulares
+        self.assertEqual(len(order.order_line), 7)
+        metrica = self._metrica('create_lineas')
+        self.assertEqual(metrica['llamadas'], 1)
+        self.assertEqual(metrica['lineas'], 7)
+
+    def test_orden_y_secuencias(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+
+        lineas = self._lineas_ordenadas(order)
+        secuencias = lineas.mapped('sequence')
+        self.assertEqual(secuencias, sorted(set(secuencias)))
+        self.assertEqual(
+            [l.product_id if not l.display_type else l.name for l in lineas],
+            [
+                '📋 ═══ INSTALACIÓN ═══',
+                '🔒 === MATERIALES === (SECCIÓN FIJA)',
+                self.productos[0],
+                self.productos[1],
+                '🔒 === MANO DE OBRA === (SECCIÓN FIJA)',
+                self.productos[2],
+                '=== CONDICIONES PARTICULARES ===',
+            ],
+        )
+        self.assertEqual(lineas[-1].condiciones_particulares, 'Condiciones de la plantilla')
+        self.assertEqual(self._lineas_producto(order).mapped('product_uom_qty'), [2.0, 1.0, 3.0])
+
+    def test_aplicar_tras_lineas_existentes(self):
+        order = self._crear_pedido(order_line=[(0, 0, {'product_id': self.productos[0].id, 'sequence': 50})])
+        self._aplicar_plantilla(order)
+
+        primera = self._lineas_ordenadas(order)[0]
+        self.assertFalse(primera.capitulo_key)
+        self.assertTrue(all(l.sequence > 50 for l in order.order_line - primera))
+
+    def test_modo_nuevo(self):
+        order = self._crear_pedido()
+        wizard = self.env['capitulo.wizard'].create({
+            'order_id': order.id,
+            'modo_creacion': 'nuevo',
+            'nuevo_capitulo_nombre': 'Reforma',
+            'seccion_ids': [(0, 0, {
+                'name': 'Propia',
+                'incluir': True,
+                'product_category_id': self.categoria.id,
+                'line_ids': [(0, 0, {'product_id': self.productos[1].id, 'cantidad': 4.0, 'precio_unitario': 5.0})],
+            })],
+        })
+
+        wizard.add_to_order()
+
+        capitulo = self.env['capitulo.contrato'].search([('name', '=', 'Reforma')])
+        self.assertEqual(len(capitulo), 1)
+        self.assertFalse(capitulo.es_plantilla)
+        linea = self._lineas_producto(order)
+        self.assertEqual(linea.product_id, self.productos[1])
+        self.assertEqual(linea.product_uom_qty, 4.0)
+        self.assertEqual(linea.price_unit, 5.0)
+        self.assertEqual(linea.capitulo_id, capitulo)
+        # Las líneas y la instancia de la sección guardan la sección de origen del capítulo nuevo
+        seccion = capitulo.seccion_ids
+        self.assertEqual(seccion.name, 'Propia')
+        self.assertEqual(linea.capitulo_seccion_id, seccion)
+        self.assertEqual(self._encabezados_seccion(order).capitulo_seccion_id, seccion)
+        self.assertEqual(linea.order_seccion_id.capitulo_seccion_id, seccion)
+
+    def test_modo_nuevo_sin_productos(self):
+        order = self._crear_pedido()
+        wizard = self.env['capitulo.wizard'].create({
+            'order_id': order.id,
+            'modo_creacion': 'nuevo',
+            'nuevo_capitulo_nombre': 'Vacío',
+        })
+        with self.assertRaises(UserError):
+            wizard.add_to_order()
+        self.assertFalse(order.order_line)
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosAplicarDirecto(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self.materiales, self.mano_de_obra = self.plantilla.seccion_ids.sorted('sequence')
+
+    def _wizard(self, **vals):
+        return self.env['capitulo.wizard'].create(dict({
+            'order_id': self.order.id,
+            'modo_creacion': 'existente',
+            'capitulo_id': self.plantilla.id,
+        }, **vals))
+
+    def test_sin_filas_del_wizard(self):
+        wizard = self._wizard()
+        wizard._aplicar_al_pedido()
+
+        self.assertFalse(wizard.seccion_ids)
+        self.assertFalse(self.env['capitulo.wizard.line'].search([('wizard_id', '=', wizard.id)]))
+        self.assertEqual(self._lineas_producto(self.order).product_id, self.productos)
+        self.assertEqual(self._encabezados_seccion(self.order)[:2].capitulo_seccion_id, self.materiales | self.mano_de_obra)
+
+    def test_personalizar_solo_copia_la_seccion_elegida(self):
+        wizard = self.env['capitulo.wizard'].new({
+            'order_id': self.order.id,
+            'modo_creacion': 'existente',
+            'capitulo_id': self.plantilla.id,
+        })
+        wizard.secciones_personalizadas_ids = self.mano_de_obra
+        wizard._onchange_secciones_personalizadas_ids()
+        self.assertEqual(wizard.seccion_ids.origen_seccion_id._origin, self.mano_de_obra)
+        self.assertEqual(wizard.seccion_ids.line_ids.product_id._origin, self.productos[2])
+
+        wizard.secciones_personalizadas_ids = False
+        wizard._onchange_secciones_personalizadas_ids()
+        self.assertFalse(wizard.seccion_ids)
+
+    def test_seccion_personalizada_sustituye_a_su_origen(self):
+        wizard = self._wizard()
+        wizard._cargar_secciones_existentes({self.materiales.id})
+        personalizada = wizard.seccion_ids
+        self.assertEqual(personalizada.origen_seccion_id, self.materiales)
+        personalizada.line_ids.filtered(lambda l: l.product_id == self.productos[1]).unlink()
+        personalizada.line_ids.write({'cantidad': 5.0, 'precio_unitario': 12.0})
+
+        wizard._aplicar_al_pedido()
+
+        productos = self._lineas_producto(self.order)
+        self.assertEqual(productos.product_id, self.productos[0] | self.productos[2])
+        self.assertEqual(productos.mapped('product_uom_qty'), [5.0, 3.0])
+        self.assertEqual(productos[0].price_unit, 12.0)
+        self.assertEqual(productos[0].capitulo_seccion_id, self.materiales)
+        self.assertEqual(productos[1].capitulo_seccion_id, self.mano_de_obra)
+
+    def test_seccion_manual_al_final(self):
+        wizard = self._wizard(seccion_ids=[(0, 0, {
+            'name': 'Extra',
+            'product_category_id': self.categoria.id,
+            'line_ids': [(0, 0, {'product_id': self.productos[1].id, 'cantidad': 2.0, 'precio_unitario': 7.0})],
+        })])
+
+        wizard._aplicar_al_pedido()
+
+        encabezados = self._encabezados_seccion(self.order)
+        self.assertEqual(encabezados[0].capitulo_seccion_id, self.materiales)
+        self.assertEqual(encabezados[1].capitulo_seccion_id, self.mano_de_obra)
+        self.assertFalse(encabezados[2].capitulo_seccion_id)
+        self.assertIn('EXTRA', encabezados[2].name)
+        extra = self._lineas_producto(self.order)[-1]
+        self.assertEqual((extra.product_id, extra.price_unit), (self.productos[1], 7.0))
+
+    def test_plantilla_sin_productos(self):
+        vacia = self.env['capitulo.contrato'].create({
+            'name': 'Vacía', 'es_plantilla': True, 'seccion_ids': [(0, 0, {'name': 'Sin productos'})],
+        })
+        with self.assertRaises(UserError):
+            self._wizard(capitulo_id=vacia.id)._aplicar_al_pedido()
+        self.assertFalse(self.order.order_line)
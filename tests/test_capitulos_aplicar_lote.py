@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosAplicarLote(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.orders = self.env['sale.order'].create([{'partner_id': self.partner.id} for _i in range(5)])
+
+    def _aplicar_en_lote(self, orders, **kwargs):
+        return orders._capitulos_aplicar_en_lote(
+            self.plantilla, self.plantilla.name, self.plantilla._secciones_para_pedido(),
+            condiciones='Condiciones del lote', **kwargs,
+        )
+
+    def _confirmar(self, order):
+        self.env['sale.order.line'].create({'order_id': order.id, 'product_id': self.productos[0].id})
+        order.action_confirm()
+
+    def test_aplica_en_todos_los_pedidos_por_lotes(self):
+        self._activar_perf()
+        resultados = self._aplicar_en_lote(self.orders, tamano_lote=2)
+
+        self.assertEqual(set(resultados), set(self.orders.ids))
+        self.assertTrue(all(r['success'] and r['lineas'] == 7 for r in resultados.values()))
+        self.assertEqual(self._metrica('aplicar_capitulo_en_lote')['lotes_fallidos'], 0)
+        for order in self.orders:
+            self.assertEqual(len(order.order_line), 7)
+            self.assertEqual(len(order.order_capitulo_ids), 1)
+            self.assertEqual(self._lineas_ordenadas(order).order_capitulo_id, order.order_capitulo_ids)
+            self.assertAlmostEqual(order.order_capitulo_ids.amount_untaxed, 2 * 10.0 + 20.0 + 3 * 30.0)
+            condiciones = self._encabezados_seccion(order)[-1]
+            self.assertEqual(condiciones.condiciones_particulares, 'Condiciones del lote')
+
+    def test_continua_tras_las_lineas_existentes(self):
+        order = self.orders[0]
+        self.env['sale.order.line'].create({'order_id': order.id, 'product_id': self.productos[0].id, 'sequence': 35})
+        self._aplicar_en_lote(order)
+
+        lineas = self._lineas_ordenadas(order)
+        self.assertEqual(lineas[0].sequence, 35)
+        self.assertTrue(lineas[1].es_encabezado_capitulo)
+        self.assertEqual(lineas[1].sequence, 45)
+
+    def test_pedido_confirmado_se_informa_sin_aplicar(self):
+        confirmado = self.orders[0]
+        self._confirmar(confirmado)
+        resultados = self._aplicar_en_lote(self.orders)
+
+        self.assertFalse(resultados[confirmado.id]['success'])
+        self.assertIn('borrador', resultados[confirmado.id]['message'])
+        self.assertFalse(confirmado.order_capitulo_ids)
+        self.assertTrue(all(resultados[order.id]['success'] for order in self.orders[1:]))
+
+    def test_error_en_un_pedido_no_afecta_al_resto(self):
+        fallido = self.orders[2]
+        SaleOrder = type(self.env['sale.order'])
+        crear_lineas = SaleOrder._capitulos_crear_lineas
+
+        def crear_lineas_con_error(this, vals_list):
+            if any(vals['order_id'] == fallido.id for vals in vals_list):
+                raise UserError("Pedido bloqueado")
+            return crear_lineas(this, vals_list)
+
+        self._activar_perf()
+        with patch.object(SaleOrder, '_capitulos_crear_lineas', crear_lineas_con_error):
+            resultados = self._aplicar_en_lote(self.orders, tamano_lote=2)
+
+        self.assertEqual(resultados[fallido.id], {'success': False, 'message': 'Pedido bloqueado', 'lineas': 0})
+        self.assertFalse(fallido.order_line)
+        for order in self.orders - fallido:
+            self.assertTrue(resultados[order.id]['success'])
+            self.assertEqual(len(order.order_line), 7)
+        self.assertEqual(self._metrica('aplicar_capitulo_en_lote')['lotes_fallidos'], 1)
+
+    def test_wizard_muestra_resultado_por_pedido(self):
+        self._confirmar(self.orders[0])
+        wizard = self.env['capitulo.mass.apply.wizard'].with_context(
+            active_model='sale.order', active_ids=self.orders.ids,
+        ).create({'capitulo_id': self.plantilla.id, 'modo_precio_pedido': 'plantilla'})
+        self.assertEqual(wizard.order_ids, self.orders)
+
+        wizard.action_aplicar()
+
+        self.assertEqual(wizard.state, 'hecho')
+        self.assertEqual((wizard.pedidos_ok, wizard.pedidos_error), (4, 1))
+        self.assertEqual(wizard.resultado_ids.filtered(lambda r: not r.success).order_id, self.orders[0])
+
+    def test_cada_lote_se_confirma_con_su_resultado(self):
+        CapituloApplyJob = type(self.env['capitulo.apply.job'])
+        self._confirmar(self.orders[0])
+        informes = []
+
+        def guardar(resultados_lote):
+            # Las líneas del lote ya existen cuando se guarda su resultado
+            for order_id in resultados_lote:
+                order = self.env['sale.order'].browse(order_id)
+                informes.append((order_id, resultados_lote[order_id]['success'], bool(order.order_capitulo_ids)))
+
+        with patch.object(CapituloApplyJob, '_confirmar', autospec=True) as confirmar:
+            self._aplicar_en_lote(self.orders, tamano_lote=2, al_terminar_lote=guardar)
+
+        # Un informe para el pedido confirmado y uno por cada lote de 2 de los 4 restantes
+        self.assertEqual(confirmar.call_count, 3)
+        self.assertEqual([i[0] for i in informes], self.orders.ids)
+        self.assertEqual(informes[0], (self.orders[0].id, False, False))
+        self.assertTrue(all(success and aplicado for _id, success, aplicado in informes[1:]))
+
+    def test_wizard_relanzado_no_repite_pedidos(self):
+        fallido = self.orders[1]
+        SaleOrder = type(self.env['sale.order'])
+        crear_lineas = SaleOrder._capitulos_crear_lineas
+
+        def crear_lineas_con_error(this, vals_list):
+            if any(vals['order_id'] == fallido.id for vals in vals_list):
+                raise UserError("Pedido bloqueado")
+            return crear_lineas(this, vals_list)
+
+        wizard = self.env['capitulo.mass.apply.wizard'].create({
+            'capitulo_id': self.plantilla.id,
+            'order_ids': [(6, 0, self.orders.ids)],
+            'tamano_lote': 2,
+        })
+        with patch.object(SaleOrder, '_capitulos_crear_lineas', crear_lineas_con_error):
+            wizard.action_aplicar()
+        self.assertEqual((wizard.pedidos_ok, wizard.pedidos_error), (4, 1))
+
+        wizard.action_aplicar()
+
+        self.assertEqual((wizard.pedidos_ok, wizard.pedidos_error), (5, 0))
+        self.assertEqual(len(wizard.resultado_ids), 5)
+        for order in self.orders:
+            self.assertEqual(len(order.order_line), 7)
+
+    def test_wizard_sin_pedidos(self):
+        wizard = self.env['capitulo.mass.apply.wizard'].create({'capitulo_id': self.plantilla.id})
+        with self.assertRaises(UserError):
+            wizard.action_aplicar()
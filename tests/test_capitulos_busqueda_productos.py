@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import new_test_user, tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosBusquedaProductos(CapitulosCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.categoria_busqueda = cls.env['product.category'].create({'name': 'Búsqueda Capítulos'})
+        cls.env['product.product'].create([{
+            'name': nombre,
+            'categ_id': cls.categoria_busqueda.id,
+            'sale_ok': True,
+        } for nombre in ('Tubo 50%', 'Tubo 500', 'Codo A_B', 'Codo AXB')])
+        cls.Lookup = cls.env['capitulos.product.lookup']
+
+    def _buscar(self, query, lookup=None):
+        resultado = (lookup or self.Lookup).search_products(categ_id=self.categoria_busqueda.id, query=query)
+        return sorted(fila[1] for fila in resultado['rows'])
+
+    def test_comodines_literales(self):
+        self.Lookup._invalidar()
+        self.assertEqual(self._buscar('50%'), ['Tubo 50%'])
+        self.assertEqual(self._buscar('a_b'), ['Codo A_B'])
+
+    def test_filtrado_en_memoria_equivale_a_la_base_de_datos(self):
+        consultas = ('tubo 50%', 'tubo 50', 'tubo  500', 'codo a_b', 'codo axb', 'CODO A')
+        self.Lookup._invalidar()
+        en_base_de_datos = {}
+        for query in consultas:
+            self.Lookup._invalidar()
+            en_base_de_datos[query] = self._buscar(query)
+
+        self.Lookup._invalidar()
+        # Con los prefijos en caché, las búsquedas más largas se filtran en memoria
+        self._buscar('tubo')
+        self._buscar('codo')
+        for query in consultas:
+            with self.subTest(query=query):
+                self.assertEqual(self._buscar(query), en_base_de_datos[query])
+
+    def test_cache_por_grupos_y_companias(self):
+        otra_compania = self.env['res.company'].create({'name': 'Otra Compañía Capítulos'})
+        self.env['product.product'].create({
+            'name': 'Tubo 50 de otra compañía',
+            'categ_id': self.categoria_busqueda.id,
+            'company_id': otra_compania.id,
+            'sale_ok': True,
+        })
+        usuario = new_test_user(self.env, login='capitulos_busqueda', groups='base.group_user,sales_team.group_sale_salesman')
+        lookup_usuario = self.Lookup.with_user(usuario)
+        self.assertNotEqual(self.Lookup._clave(1, None, 'x'), lookup_usuario._clave(1, None, 'x'))
+        # Un comercial con los mismos grupos, compañías e idioma reutiliza la caché del otro
+        companero = new_test_user(self.env, login='capitulos_busqueda_2', groups='base.group_user,sales_team.group_sale_salesman')
+        self.assertEqual(lookup_usuario._clave(1, None, 'x'), self.Lookup.with_user(companero)._clave(1, None, 'x'))
+
+        todas = self.Lookup.with_context(allowed_company_ids=[self.env.company.id, otra_compania.id])
+        self.assertIn('Tubo 50 de otra compañía', self._buscar('tubo 50', todas))
+        self.assertNotIn('Tubo 50 de otra compañía', self._buscar('tubo 50', lookup_usuario))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosCargaDiferida(CapitulosCase):
+
+    def _capitulo_payload(self, order):
+        order.invalidate_recordset(['capitulos_agrupados'])
+        return next(iter(json.loads(order.capitulos_agrupados).values()))
+
+    def test_pedido_pequeno_envia_lineas(self):
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.lazy_line_threshold', '0')
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+
+        capitulo = self._capitulo_payload(order)
+        self.assertFalse(capitulo['lazy'])
+        self.assertEqual(sum(len(s['lines']) for s in capitulo['sections'].values()), 3)
+
+    def test_pedido_grande_solo_estructura(self):
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.lazy_line_threshold', '2')
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+
+        capitulo = self._capitulo_payload(order)
+        self.assertTrue(capitulo['lazy'])
+        self.assertTrue(all(s['lazy'] and not s['lines'] for s in capitulo['sections'].values()))
+        self.assertAlmostEqual(capitulo['amount_untaxed'], 2 * 10.0 + 20.0 + 3 * 30.0)
+
+    def test_lineas_al_desplegar_coinciden_con_la_estructura(self):
+        """Recuentos de la estructura y contenido cargado siguen la misma pertenencia"""
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.lazy_line_threshold', '2')
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        p0 = self._lineas_producto(order)[0]
+        # Línea añadida con el editor estándar dentro de la primera sección
+        self.env['sale.order.line'].create({
+            'order_id': order.id,
+            'product_id': self.productos[1].id,
+            'sequence': p0.sequence + 1,
+        })
+
+        capitulo = self._capitulo_payload(order)
+        respuesta = order.get_accordion_lines(order.id, capitulo_key=capitulo['capitulo_key'])
+
+        self.assertTrue(respuesta['success'])
+        cargadas = {s['seccion_key']: s for s in respuesta['delta']['sections']}
+        self.assertEqual(set(cargadas), {s['seccion_key'] for s in capitulo['sections'].values()})
+        for seccion in capitulo['sections'].values():
+            cargada = cargadas[seccion['seccion_key']]
+            self.assertEqual(len(cargada['lines']), seccion['line_count'])
+            self.assertEqual(cargada['product_count'], seccion['product_count'])
+            self.assertAlmostEqual(cargada['amount_untaxed'], seccion['amount_untaxed'])
+        self.assertEqual(respuesta['delta']['chapters'][0]['product_count'], 4)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+class CategoriasCase(CapitulosCase):
+    """Añade una jerarquía hija/nieta bajo la categoría común y otra categoría raíz"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Category = cls.env['product.category']
+        cls.Lookup = cls.env['capitulos.product.lookup']
+        cls.hija = cls.Category.create({'name': 'Hija Capítulos', 'parent_id': cls.categoria.id})
+        cls.nieta = cls.Category.create({'name': 'Nieta Capítulos', 'parent_id': cls.hija.id})
+        cls.otra = cls.Category.create({'name': 'Otra Capítulos'})
+        cls.env['product.product'].create({'name': 'Producto Nieta', 'categ_id': cls.nieta.id, 'sale_ok': True})
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosCategorias(CategoriasCase):
+
+    def _filas_arbol(self):
+        arbol = self.Lookup.get_category_tree()
+        return arbol['version'], {fila[0]: fila for fila in arbol['rows']}
+
+    def test_arbol_versionado_con_totales(self):
+        version, filas = self._filas_arbol()
+        self.assertEqual(self.Lookup.get_category_tree(version), {'version': version, 'unchanged': True})
+        # Tres productos propios y uno de la nieta
+        self.assertEqual(filas[self.categoria.id][4:], [3, 4])
+        self.assertEqual(filas[self.hija.id][4:], [0, 1])
+
+        self.nieta.parent_id = self.otra
+        nueva_version, filas = self._filas_arbol()
+        self.assertNotEqual(nueva_version, version)
+        self.assertEqual(filas[self.categoria.id][4:], [3, 3])
+        self.assertEqual(filas[self.otra.id][4:], [0, 1])
+
+    def test_descendientes_tras_cambiar_jerarquia(self):
+        self.assertEqual(
+            self.Category._capitulos_ids_descendientes(self.categoria.id),
+            {self.categoria.id, self.hija.id, self.nieta.id},
+        )
+        self.nieta.parent_id = self.otra
+        self.assertEqual(self.Category._capitulos_ids_descendientes(self.categoria.id), {self.categoria.id, self.hija.id})
+        self.assertEqual(self.Category._capitulos_ids_descendientes(self.otra.id), {self.otra.id, self.nieta.id})
+
+        nueva = self.Category.create({'name': 'Nueva Capítulos', 'parent_id': self.hija.id})
+        self.assertIn(nueva.id, self.Category._capitulos_ids_descendientes(self.categoria.id))
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosCategoriaSeccion(CategoriasCase):
+
+    def _seccion_wizard(self):
+        wizard = self.env['capitulo.wizard'].create({
+            'order_id': self._crear_pedido().id,
+            'modo_creacion': 'nuevo',
+            'nuevo_capitulo_nombre': 'Capítulo Categorías',
+        })
+        return self.env['capitulo.wizard.seccion'].create({
+            'wizard_id': wizard.id,
+            'name': 'Sección Categorías',
+            'product_category_id': self.categoria.id,
+        })
+
+    def test_wizard_acepta_subcategorias_a_cualquier_profundidad(self):
+        seccion = self._seccion_wizard()
+        producto_nieta = self.env['product.product'].search([('categ_id', '=', self.nieta.id)])
+        linea = self.env['capitulo.wizard.line'].create({'seccion_id': seccion.id, 'product_id': producto_nieta.id})
+        self.assertEqual(linea.wizard_id, seccion.wizard_id)
+
+        producto_otra = self.env['product.product'].create({'name': 'Producto Otra', 'categ_id': self.otra.id})
+        with self.assertRaises(UserError):
+            self.env['capitulo.wizard.line'].create({'seccion_id': seccion.id, 'product_id': producto_otra.id})
+
+    def test_plantillas_con_productos_fuera_de_categoria(self):
+        self.assertFalse(self.plantilla._lineas_fuera_de_categoria())
+
+        # Un cambio de jerarquía posterior deja el producto fuera de la categoría de la sección
+        self.productos[1].categ_id = self.hija
+        self.hija.parent_id = self.otra
+        with self.assertLogs('odoo.addons.capitulos.models.capitulo', 'WARNING') as registro:
+            lineas = self.plantilla._lineas_fuera_de_categoria()
+        self.assertEqual(lineas.product_id, self.productos[1])
+        self.assertEqual(lineas.seccion_id.name, 'Materiales')
+        self.assertIn('Instalación', registro.output[0])
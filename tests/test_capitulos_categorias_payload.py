@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosCategoriasPayload(CapitulosCase):
+
+    def _secciones_payload(self, order):
+        capitulos = json.loads(order.capitulos_agrupados)
+        self.assertEqual(len(capitulos), 1)
+        return next(iter(capitulos.values()))['sections']
+
+    def test_categoria_de_la_seccion_de_origen(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+
+        secciones = self._secciones_payload(order)
+        materiales = secciones['🔒 === MATERIALES === (SECCIÓN FIJA)']
+        self.assertEqual(materiales['category_id'], self.categoria.id)
+        self.assertEqual(materiales['category_name'], self.categoria.name)
+        self.assertIsNone(secciones['=== CONDICIONES PARTICULARES ===']['category_id'])
+
+    def test_categoria_por_nombre_sin_seccion_de_origen(self):
+        """Los encabezados sin sección de origen toman la de igual nombre en el capítulo"""
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        otra = self.env['product.category'].create({'name': 'Otra Categoría'})
+        self.plantilla.seccion_ids.filtered(lambda s: s.name == 'Mano de Obra').product_category_id = otra
+        self._encabezados_seccion(order).with_context(from_capitulo_wizard=True).write({'capitulo_seccion_id': False})
+
+        secciones = self._secciones_payload(order)
+        self.assertEqual(secciones['🔒 === MATERIALES === (SECCIÓN FIJA)']['category_id'], self.categoria.id)
+        mano_de_obra = secciones['🔒 === MANO DE OBRA === (SECCIÓN FIJA)']
+        self.assertEqual(mano_de_obra['category_id'], otra.id)
+        self.assertEqual(mano_de_obra['category_name'], 'Otra Categoría')
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosNombresPayload(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self._aplicar_plantilla(self.order)
+
+    def _payload(self, lang=None):
+        order = self.order.with_context(lang=lang) if lang else self.order
+        order.invalidate_recordset(['capitulos_agrupados'])
+        return next(iter(json.loads(order.capitulos_agrupados).values()))['sections']
+
+    def test_fragmento_guarda_ids(self):
+        fragmento = json.loads(self.order.order_capitulo_ids.payload_fragmento)
+        materiales = fragmento['sections']['🔒 === MATERIALES === (SECCIÓN FIJA)']
+        self.assertNotIn('category_name', materiales)
+        linea = materiales['lines'][0]
+        self.assertEqual(linea['product_id'], self.productos[0].id)
+        self.assertEqual(linea['product_uom_id'], self.productos[0].uom_id.id)
+        self.assertNotIn('product_name', linea)
+
+    def test_nombres_en_el_idioma_de_lectura(self):
+        self.env['res.lang']._activate_lang('fr_FR')
+        self.productos[0].with_context(lang='fr_FR').name = 'Produit Chapitres 0'
+
+        linea = self._payload()['🔒 === MATERIALES === (SECCIÓN FIJA)']['lines'][0]
+        self.assertEqual(linea['product_name'], 'Producto Capítulos 0')
+        self.assertEqual(linea['product_uom'], self.productos[0].uom_id.name)
+        linea = self._payload('fr_FR')['🔒 === MATERIALES === (SECCIÓN FIJA)']['lines'][0]
+        self.assertEqual(linea['product_name'], 'Produit Chapitres 0')
+        self.assertEqual(linea['product_uom'], self.productos[0].uom_id.with_context(lang='fr_FR').name)
+
+    def test_renombrar_categoria_no_recalcula_fragmentos(self):
+        fragmento = self.order.order_capitulo_ids.payload_fragmento
+        self.categoria.name = 'Categoría Renombrada'
+        self.env.flush_all()
+
+        self.assertEqual(self.order.order_capitulo_ids.payload_fragmento, fragmento)
+        materiales = self._payload()['🔒 === MATERIALES === (SECCIÓN FIJA)']
+        self.assertEqual(materiales['category_name'], 'Categoría Renombrada')
+
+    def test_delta_con_nombres(self):
+        seccion_key = self._encabezados_seccion(self.order)[0].seccion_key
+        delta = self.order._capitulos_delta(seccion_keys=[seccion_key])
+        self.assertEqual([l['product_name'] for l in delta['sections'][0]['lines']],
+                         self.productos[:2].mapped('name'))
+
+    def test_linea_con_producto_inexistente_muestra_su_descripcion(self):
+        secciones = [{'category_id': False, 'lines': [
+            {'product_id': -1, 'name': 'Descripción libre', 'product_uom_id': False},
+            {'product_id': False, 'name': 'Nota', 'product_uom_id': False},
+        ]}]
+        self.env['sale.order']._capitulos_resolver_nombres(secciones)
+        self.assertEqual([l['product_name'] for l in secciones[0]['lines']], ['Descripción libre', ''])
+        self.assertEqual(secciones[0]['lines'][0]['product_uom'], '')
+        self.assertIsNone(secciones[0]['category_name'])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosClaves(CapitulosCase):
+
+    def test_aplicar_asigna_claves(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+
+        lineas = self._lineas_ordenadas(order)
+        capitulo = lineas.filtered('es_encabezado_capitulo')
+        self.assertEqual(len(capitulo), 1)
+        self.assertTrue(capitulo.capitulo_key)
+        self.assertEqual(set(lineas.mapped('capitulo_key')), {capitulo.capitulo_key})
+
+        secciones = self._encabezados_seccion(order)
+        self.assertEqual(secciones.mapped('seccion_key'), [
+            f"{capitulo.capitulo_key}:1", f"{capitulo.capitulo_key}:2", f"{capitulo.capitulo_key}:condiciones",
+        ])
+        productos = self._lineas_producto(order)
+        self.assertEqual(productos.mapped('seccion_key'), [
+            f"{capitulo.capitulo_key}:1", f"{capitulo.capitulo_key}:1", f"{capitulo.capitulo_key}:2",
+        ])
+
+    def test_capitulos_duplicados_con_claves_distintas(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        self._aplicar_plantilla(order)
+
+        capitulos = self._lineas_ordenadas(order).filtered('es_encabezado_capitulo')
+        self.assertEqual(len(capitulos), 2)
+        self.assertEqual(len(set(capitulos.mapped('capitulo_key'))), 2)
+
+    def test_asegurar_claves_pedido_anterior(self):
+        """Los pedidos sin claves se completan a partir de la posición de los encabezados"""
+        order = self._crear_pedido()
+        SaleOrderLine = self.env['sale.order.line'].with_context(from_capitulo_wizard=True)
+        lineas = SaleOrderLine.create([
+            {'order_id': order.id, 'sequence': 10, 'name': '📋 ═══ ANTIGUO ═══',
+             'display_type': 'line_section', 'es_encabezado_capitulo': True},
+            {'order_id': order.id, 'sequence': 20, 'name': '=== PRIMERA ===',
+             'display_type': 'line_section', 'es_encabezado_seccion': True},
+            {'order_id': order.id, 'sequence': 30, 'product_id': self.productos[0].id},
+            {'order_id': order.id, 'sequence': 40, 'name': '=== SEGUNDA ===',
+             'display_type': 'line_section', 'es_encabezado_seccion': True},
+            {'order_id': order.id, 'sequence': 50, 'product_id': self.productos[1].id},
+        ])
+
+        order._capitulos_asegurar_claves()
+
+        capitulo_key = lineas[0].capitulo_key
+        self.assertTrue(capitulo_key)
+        self.assertEqual(set(lineas.mapped('capitulo_key')), {capitulo_key})
+        self.assertEqual(lineas.mapped('seccion_key'), [
+            False, f"{capitulo_key}:1", f"{capitulo_key}:1", f"{capitulo_key}:2", f"{capitulo_key}:2",
+        ])
+
+    def test_buscar_encabezado_seccion(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        capitulo = self._lineas_ordenadas(order).filtered('es_encabezado_capitulo')
+        segunda = self._encabezados_seccion(order)[1]
+
+        self.assertEqual(order._capitulos_buscar_encabezado_seccion(capitulo.name, 'ignorado', segunda.seccion_key), segunda)
+        self.assertEqual(order._capitulos_buscar_encabezado_seccion(capitulo.name, segunda.name), segunda)
+        self.assertEqual(order._capitulos_buscar_encabezado_seccion('INSTALACIÓN', 'Mano de Obra'), segunda)
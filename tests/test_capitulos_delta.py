@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosDelta(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self._aplicar_plantilla(self.order)
+        self.capitulo = self._lineas_ordenadas(self.order).filtered('es_encabezado_capitulo')
+        self.materiales, self.mano_de_obra = self._encabezados_seccion(self.order)[:2]
+        self.p0, self.p1, self.p2 = self._lineas_producto(self.order)
+
+    def test_editar_devuelve_delta(self):
+        resultado = self.order.update_section_lines(self.order.id, [{'id': self.p0.id, 'product_uom_qty': 5.0}])
+
+        delta = resultado['delta']
+        self.assertEqual(len(delta['sections']), 1)
+        seccion = delta['sections'][0]
+        self.assertEqual(seccion['seccion_key'], self.materiales.seccion_key)
+        self.assertEqual(seccion['capitulo_key'], self.capitulo.capitulo_key)
+        self.assertEqual([l['id'] for l in seccion['lines']], [self.p0.id, self.p1.id])
+        self.assertEqual(seccion['lines'][0]['product_uom_qty'], 5.0)
+        self.assertAlmostEqual(seccion['amount_untaxed'], 5 * 10.0 + 20.0)
+        self.assertEqual(seccion['product_count'], 2)
+
+        self.assertEqual(len(delta['chapters']), 1)
+        capitulo = delta['chapters'][0]
+        self.assertEqual(capitulo['capitulo_key'], self.capitulo.capitulo_key)
+        self.assertAlmostEqual(capitulo['amount_untaxed'], 5 * 10.0 + 20.0 + 3 * 30.0)
+        self.assertEqual(capitulo['total'], capitulo['amount_untaxed'])
+
+    def test_eliminar_devuelve_delta(self):
+        resultado = self.order.delete_section_lines(self.order.id, [self.p1.id])
+
+        self.assertFalse(self.p1.exists())
+        seccion = resultado['delta']['sections'][0]
+        self.assertEqual([l['id'] for l in seccion['lines']], [self.p0.id])
+        self.assertAlmostEqual(seccion['amount_untaxed'], 2 * 10.0)
+
+    def test_linea_manual_en_seccion(self):
+        """Las líneas del editor estándar pertenecen a la sección que tienen delante"""
+        linea = self.env['sale.order.line'].create({
+            'order_id': self.order.id,
+            'product_id': self.productos[2].id,
+            'sequence': self.p0.sequence + 1,
+        })
+
+        self.assertEqual(linea.seccion_key, self.materiales.seccion_key)
+        self.assertEqual(linea.capitulo_key, self.capitulo.capitulo_key)
+        self.assertEqual(linea.order_seccion_id, self.materiales.order_seccion_id)
+        self.assertEqual(linea.order_capitulo_id, self.capitulo.order_capitulo_id)
+        self.assertEqual(self.materiales.order_seccion_id.line_count, 3)
+
+        seccion = self.order._capitulos_delta(seccion_keys=[self.materiales.seccion_key])['sections'][0]
+        self.assertEqual([l['id'] for l in seccion['lines']], [self.p0.id, linea.id, self.p1.id])
+
+    def test_mover_linea_a_otra_seccion(self):
+        self.p0.sequence = self.p2.sequence + 1
+
+        self.assertEqual(self.p0.seccion_key, self.mano_de_obra.seccion_key)
+        self.assertEqual(self.p0.order_seccion_id, self.mano_de_obra.order_seccion_id)
+        self.assertEqual(self.materiales.order_seccion_id.line_count, 1)
+        self.assertEqual(self.mano_de_obra.order_seccion_id.line_count, 2)
+
+    def test_linea_fuera_de_secciones(self):
+        linea = self.env['sale.order.line'].create({
+            'order_id': self.order.id,
+            'product_id': self.productos[0].id,
+            'sequence': self.capitulo.sequence + 1,
+        })
+
+        self.assertFalse(linea.capitulo_key)
+        self.assertFalse(linea.order_seccion_id)
+
+        # Al moverla a una sección pasa a formar parte de ella, y al sacarla la deja
+        linea.sequence = self.p2.sequence + 1
+        self.assertEqual(linea.order_seccion_id, self.mano_de_obra.order_seccion_id)
+        linea.sequence = self.capitulo.sequence - 1
+        self.assertFalse(linea.seccion_key)
+        self.assertFalse(linea.order_capitulo_id)
+
+    def test_sincronizar_enlaza_lineas_sin_clave(self):
+        linea = self.env['sale.order.line'].with_context(from_capitulo_wizard=True).create({
+            'order_id': self.order.id,
+            'product_id': self.productos[1].id,
+            'sequence': self.p2.sequence + 1,
+        })
+        self.assertFalse(linea.order_seccion_id)
+
+        self.order._capitulos_sincronizar_instancias()
+
+        self.assertEqual(linea.seccion_key, self.mano_de_obra.seccion_key)
+        self.assertEqual(linea.order_seccion_id, self.mano_de_obra.order_seccion_id)
+
+    def test_importes_de_seccion_iguales_en_fragmento_y_delta(self):
+        """El fragmento y el delta agregan las secciones por la misma instancia"""
+        self.p0.sequence = self.p2.sequence + 1
+        self.env['sale.order.line'].create({
+            'order_id': self.order.id,
+            'product_id': self.productos[1].id,
+            'product_uom_qty': 4.0,
+            'sequence': self.p1.sequence + 1,
+        })
+
+        fragmento = json.loads(self.order.order_capitulo_ids.payload_fragmento)
+        delta = self.order._capitulos_delta(seccion_keys=[self.materiales.seccion_key, self.mano_de_obra.seccion_key])
+        for encabezado, seccion_delta in zip((self.materiales, self.mano_de_obra), delta['sections']):
+            seccion_fragmento = fragmento['sections'][encabezado.name]
+            for campo in ('amount_untaxed', 'amount_tax', 'amount_total', 'product_count'):
+                self.assertAlmostEqual(seccion_fragmento[campo], seccion_delta[campo])
+            self.assertEqual([l['id'] for l in seccion_fragmento['lines']], [l['id'] for l in seccion_delta['lines']])
+        self.assertAlmostEqual(delta['sections'][0]['amount_untaxed'], 20.0 + 4 * 20.0)
+        self.assertAlmostEqual(delta['sections'][1]['amount_untaxed'], 3 * 30.0 + 2 * 10.0)
+        self.assertAlmostEqual(delta['chapters'][0]['amount_untaxed'], fragmento['amount_untaxed'])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosEdicionLote(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self._aplicar_plantilla(self.order)
+        self.p0, self.p1, self.p2 = self._lineas_producto(self.order)
+
+    def test_editar_varias_lineas(self):
+        self._activar_perf()
+
+        resultado = self.order.update_section_lines(self.order.id, [
+            {'id': self.p0.id, 'product_uom_qty': 4.0},
+            {'id': self.p1.id, 'product_uom_qty': 4.0},
+            {'id': self.p2.id, 'price_unit': 7.5, 'name': 'Mano de obra especial'},
+        ])
+
+        self.assertTrue(resultado['success'])
+        self.assertEqual((self.p0 | self.p1).mapped('product_uom_qty'), [4.0, 4.0])
+        self.assertEqual(self.p2.price_unit, 7.5)
+        self.assertEqual(self.p2.name, 'Mano de obra especial')
+        # Las líneas con los mismos cambios se escriben juntas
+        self.assertEqual(self._metrica('update_section_lines')['escrituras'], 2)
+        self.assertEqual(len(resultado['delta']['sections']), 2)
+        self.assertEqual(len(resultado['delta']['chapters']), 1)
+
+    def test_valores_numericos_como_texto(self):
+        self.order.update_section_lines(self.order.id, [{'id': self.p0.id, 'product_uom_qty': '2.5'}])
+        self.assertEqual(self.p0.product_uom_qty, 2.5)
+
+    def test_valores_no_validos(self):
+        for valor in ('abc', None, [1], -1, float('nan')):
+            with self.subTest(valor=valor), self.assertRaises(UserError):
+                self.order.update_section_lines(self.order.id, [
+                    {'id': self.p0.id, 'product_uom_qty': 9.0},
+                    {'id': self.p1.id, 'price_unit': valor},
+                ])
+        # La validación es previa a cualquier escritura
+        self.assertEqual(self.p0.product_uom_qty, 2.0)
+
+    def test_no_edita_encabezados_ni_lineas_ajenas(self):
+        encabezado = self._encabezados_seccion(self.order)[0]
+        with self.assertRaises(UserError):
+            self.order.update_section_lines(self.order.id, [{'id': encabezado.id, 'name': 'Otro'}])
+
+        otro = self._crear_pedido(order_line=[(0, 0, {'product_id': self.productos[0].id})])
+        with self.assertRaises(UserError):
+            self.order.update_section_lines(self.order.id, [{'id': otro.order_line.id, 'product_uom_qty': 1.0}])
+
+    def test_eliminar_varias_lineas(self):
+        self._activar_perf()
+
+        resultado = self.order.delete_section_lines(self.order.id, [self.p0.id, self.p2.id])
+
+        self.assertTrue(resultado['success'])
+        self.assertFalse((self.p0 | self.p2).exists())
+        self.assertTrue(self.p1.exists())
+        metrica = self._metrica('unlink_lineas')
+        self.assertEqual(metrica['llamadas'], 1)
+        self.assertEqual(metrica['lineas'], 2)
+        self.assertEqual(len(resultado['delta']['sections']), 2)
+
+    def test_no_elimina_encabezados(self):
+        encabezado = self._encabezados_seccion(self.order)[0]
+        with self.assertRaises(UserError):
+            self.order.delete_section_lines(self.order.id, [self.p0.id, encabezado.id])
+        self.assertTrue(self.p0.exists())
+        with self.assertRaises(UserError):
+            (self.p1 | encabezado).unlink()
+        self.assertTrue(self.p1.exists())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+# Posiciones de ``COLUMNAS_EXPORTACION`` que se comprueban
+CAPITULO, SECCION, PRODUCTO, DESCRIPCION, BASE = 1, 2, 3, 4, 9
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosExportacion(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self._aplicar_plantilla(self.order)
+        self.p0, self.p1, self.p2 = self._lineas_producto(self.order)
+
+    def _filas(self, order=None, **kwargs):
+        return list((order or self.order)._capitulos_filas_exportacion(**kwargs))
+
+    def _assertSubtotalesCuadran(self, filas):
+        """Los subtotales de cada sección suman las líneas que la exportación pone en ella"""
+        sumas = defaultdict(float)
+        for tipo, fila in filas:
+            if tipo == 'linea':
+                sumas[(fila[CAPITULO], fila[SECCION])] += fila[BASE]
+        secciones = [fila for tipo, fila in filas if tipo == 'seccion']
+        self.assertTrue(secciones)
+        for fila in secciones:
+            self.assertAlmostEqual(fila[BASE], sumas[(fila[CAPITULO], fila[SECCION])])
+
+    def test_filas_en_el_orden_del_pedido(self):
+        filas = self._filas()
+
+        self.assertEqual([tipo for tipo, _fila in filas], [
+            'pedido', 'capitulo', 'seccion', 'linea', 'linea', 'seccion', 'linea', 'seccion', 'condiciones',
+        ])
+        lineas = [fila for tipo, fila in filas if tipo == 'linea']
+        self.assertEqual(lineas[0][PRODUCTO], self.productos[0].name)
+        self.assertEqual((lineas[2][CAPITULO], lineas[2][SECCION]), ('INSTALACIÓN', 'MANO DE OBRA'))
+        self.assertEqual(filas[-1][1][DESCRIPCION], 'Condiciones de la plantilla')
+        self._assertSubtotalesCuadran(filas)
+
+    def test_lineas_en_la_seccion_a_la_que_pertenecen(self):
+        """Una línea sin enlazar no se atribuye a la sección que tiene delante"""
+        suelta = self.env['sale.order.line'].with_context(from_capitulo_wizard=True).create({
+            'order_id': self.order.id,
+            'product_id': self.productos[1].id,
+            'name': 'Línea sin enlazar',
+            'sequence': self.p2.sequence + 1,
+        })
+        self.assertFalse(suelta.order_seccion_id)
+
+        filas = self._filas()
+
+        fila = next(fila for tipo, fila in filas if tipo == 'linea' and fila[DESCRIPCION] == suelta.name)
+        self.assertEqual((fila[CAPITULO], fila[SECCION]), ('', ''))
+        self._assertSubtotalesCuadran(filas)
+
+    def test_bloques_no_cambian_las_filas(self):
+        self.assertEqual(self._filas(tamano_bloque=2), self._filas(tamano_bloque=None))
+
+    def test_notas_se_exportan(self):
+        order = self._crear_pedido()
+        self.env['sale.order.line'].create({
+            'order_id': order.id,
+            'display_type': 'line_note',
+            'name': 'Nota previa',
+        })
+        order._capitulos_insertar_capitulo(self.plantilla, 'Obra', [
+            {'name': 'Vacía', 'es_fija': False, 'origen_seccion_id': False, 'lineas': []},
+        ])
+
+        notas = [fila for tipo, fila in self._filas(order) if tipo == 'nota']
+
+        self.assertEqual(len(notas), 2)
+        self.assertEqual((notas[0][CAPITULO], notas[0][SECCION], notas[0][DESCRIPCION]), ('', '', 'Nota previa'))
+        self.assertEqual((notas[1][CAPITULO], notas[1][SECCION]), ('OBRA', 'VACÍA'))
+        self.assertEqual(notas[1][DESCRIPCION], '(Sin productos añadidos en esta sección)')
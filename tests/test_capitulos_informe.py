@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+import json
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+# Posiciones de ``COLUMNAS_EXPORTACION`` que se comprueban
+CAPITULO, SECCION, DESCRIPCION = 1, 2, 4
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosInforme(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self._aplicar_plantilla(self.order)
+        self.p0, self.p1, self.p2 = self._lineas_producto(self.order)
+
+    def _estructura(self, order=None):
+        order = order or self.order
+        return order._capitulos_estructura()[order.id]
+
+    def test_secciones_con_sus_lineas_e_importes(self):
+        estructura = self._estructura()
+
+        self.assertFalse(estructura['lineas'])
+        capitulo, = estructura['capitulos']
+        self.assertEqual(capitulo['name'], 'INSTALACIÓN')
+        self.assertEqual([s['name'] for s in capitulo['secciones']], ['MATERIALES', 'MANO DE OBRA', 'CONDICIONES PARTICULARES'])
+        for seccion in capitulo['secciones']:
+            self.assertAlmostEqual(seccion['amount_untaxed'], sum(l['price_subtotal'] for l in seccion['lineas']))
+        self.assertEqual([l['id'] for l in capitulo['secciones'][0]['lineas']], [self.p0.id, self.p1.id])
+        self.assertAlmostEqual(capitulo['amount_untaxed'], 2 * 10.0 + 20.0 + 3 * 30.0)
+
+    def test_lineas_en_la_seccion_a_la_que_pertenecen(self):
+        """Los subtotales impresos suman exactamente las líneas impresas debajo"""
+        suelta = self.env['sale.order.line'].with_context(from_capitulo_wizard=True).create({
+            'order_id': self.order.id,
+            'product_id': self.productos[1].id,
+            'sequence': self.p2.sequence + 1,
+        })
+        self.assertFalse(suelta.order_capitulo_id)
+
+        estructura = self._estructura()
+
+        self.assertEqual([l['id'] for l in estructura['lineas']], [suelta.id])
+        mano_de_obra = estructura['capitulos'][0]['secciones'][1]
+        self.assertEqual([l['id'] for l in mano_de_obra['lineas']], [self.p2.id])
+        self.assertAlmostEqual(mano_de_obra['amount_untaxed'], 3 * 30.0)
+
+    def test_notas_y_secciones_estandar(self):
+        order = self._crear_pedido()
+        self.env['sale.order.line'].create([
+            {'order_id': order.id, 'display_type': 'line_section', 'name': 'Sección estándar', 'sequence': 1},
+            {'order_id': order.id, 'display_type': 'line_note', 'name': 'Nota previa', 'sequence': 2},
+        ])
+        order._capitulos_insertar_capitulo(self.plantilla, 'Obra', [
+            {'name': 'Vacía', 'es_fija': False, 'origen_seccion_id': False, 'lineas': []},
+        ])
+
+        estructura = self._estructura(order)
+
+        self.assertEqual([(l['display_type'], l['name']) for l in estructura['lineas']], [
+            ('line_section', 'Sección estándar'), ('line_note', 'Nota previa'),
+        ])
+        vacia = estructura['capitulos'][0]['secciones'][0]
+        self.assertEqual([l['display_type'] for l in vacia['lineas']], ['line_note'])
+
+        html = self.env['ir.actions.report']._render_qweb_html(
+            'capitulos.report_saleorder_capitulos', order.ids,
+        )[0].decode()
+        self.assertIn('Sección estándar', html)
+        self.assertIn('Nota previa', html)
+        self.assertIn('(Sin productos añadidos en esta sección)', html)
+
+    def test_nombres_en_el_idioma_del_cliente(self):
+        self.env['res.lang']._activate_lang('es_ES')
+        self.partner.lang = 'es_ES'
+        self.productos[0].with_context(lang='es_ES').name = 'Tornillo'
+        self.p0.product_uom.with_context(lang='es_ES').name = 'Unidades ES'
+
+        linea = self._estructura()['capitulos'][0]['secciones'][0]['lineas'][0]
+
+        self.assertEqual(linea['product_name'], 'Tornillo')
+        self.assertEqual(linea['product_uom'], 'Unidades ES')
+        html = self.env['ir.actions.report']._render_qweb_html(
+            'capitulos.report_saleorder_capitulos', self.order.ids,
+        )[0].decode()
+        self.assertIn('Unidades ES', html)
+
+    def test_acordeon_informe_y_exportacion_coinciden(self):
+        """Las tres vistas del pedido salen del mismo recorrido y ponen cada línea en la misma sección"""
+        self.env['sale.order.line'].with_context(from_capitulo_wizard=True).create({
+            'order_id': self.order.id,
+            'product_id': self.productos[1].id,
+            'name': 'Línea sin enlazar',
+            'sequence': self.p2.sequence + 1,
+        })
+
+        capitulo, = self._estructura()['capitulos']
+        en_informe = [[l['name'] for l in s['lineas'] if l['product_id']] for s in capitulo['secciones']]
+        fragmento = json.loads(self.order.order_capitulo_ids.payload_fragmento)
+        en_acordeon = [[l['name'] for l in s['lines'] if l['product_id']] for s in fragmento['sections'].values()]
+        en_exportacion = defaultdict(list)
+        for tipo, fila in self.order._capitulos_filas_exportacion():
+            if tipo == 'linea' and fila[CAPITULO]:
+                en_exportacion[fila[SECCION]].append(fila[DESCRIPCION])
+
+        self.assertEqual(en_acordeon, en_informe)
+        self.assertEqual(en_informe[1], [self.p2.name])
+        self.assertEqual(
+            [en_exportacion[s['name']] for s in capitulo['secciones']], en_informe,
+        )
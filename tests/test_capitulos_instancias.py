@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosInstancias(CapitulosCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = self._crear_pedido()
+        self._aplicar_plantilla(self.order)
+
+    def test_copia_enlaza_instancias_del_pedido_nuevo(self):
+        copia = self.order.copy()
+
+        self.assertEqual(len(copia.order_line), len(self.order.order_line))
+        self.assertEqual(len(copia.order_capitulo_ids), 1)
+        self.assertNotEqual(copia.order_capitulo_ids, self.order.order_capitulo_ids)
+        lineas = self._lineas_ordenadas(copia)
+        self.assertEqual(lineas.order_capitulo_id, copia.order_capitulo_ids)
+        self.assertEqual(lineas.order_seccion_id, copia.order_capitulo_ids.seccion_ids)
+        for line in self._lineas_producto(copia):
+            self.assertEqual(line.order_seccion_id.order_id, copia)
+        self.assertAlmostEqual(copia.order_capitulo_ids.amount_untaxed, self.order.order_capitulo_ids.amount_untaxed)
+
+        # El pedido original conserva sus instancias y enlaces
+        self.assertEqual(self._lineas_ordenadas(self.order).order_capitulo_id, self.order.order_capitulo_ids)
+
+    def test_condiciones_solo_en_el_encabezado(self):
+        self.assertNotIn('condiciones_particulares', self.env['sale.order.seccion']._fields)
+        capitulo = self._lineas_ordenadas(self.order).filtered('es_encabezado_capitulo')
+        encabezado = self._encabezados_seccion(self.order)[0]
+
+        resultado = self.env['sale.order'].save_condiciones_particulares(
+            self.order.id, capitulo.name, encabezado.name, 'Montaje en altura', seccion_key=encabezado.seccion_key,
+        )
+
+        self.assertEqual(encabezado.condiciones_particulares, 'Montaje en altura')
+        self.assertEqual(resultado['delta']['sections'][0]['condiciones_particulares'], 'Montaje en altura')
+        secciones = [datos for tipo, datos in self.order._capitulos_recorrer() if tipo == 'seccion']
+        self.assertEqual(secciones[0]['condiciones_particulares'], 'Montaje en altura')
+
+    def test_renumerar_actualiza_secuencia_de_instancias(self):
+        self._aplicar_plantilla(self.order)
+        primera = self._lineas_producto(self.order)[0]
+
+        self.assertTrue(self.order._capitulos_renumerar_capitulo(primera))
+
+        encabezados = self._lineas_ordenadas(self.order).filtered(
+            lambda l: l.es_encabezado_capitulo or l.es_encabezado_seccion
+        )
+        for encabezado in encabezados:
+            instancia = encabezado.order_capitulo_id if encabezado.es_encabezado_capitulo else encabezado.order_seccion_id
+            self.assertEqual(instancia.sequence, encabezado.sequence)
+        self.assertEqual(self.order.order_capitulo_ids.sorted('sequence').mapped('capitulo_key'),
+                         encabezados.filtered('es_encabezado_capitulo').mapped('capitulo_key'))
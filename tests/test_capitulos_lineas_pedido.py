@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import AccessError, UserError
+from odoo.tests import new_test_user, tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosLineasPedido(CapitulosCase):
+
+    def test_crear_linea_de_producto(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+
+        linea = self.env['sale.order.line'].create({
+            'order_id': order.id,
+            'product_id': self.productos[0].id,
+            'product_uom_qty': 5.0,
+        })
+
+        self.assertTrue(linea.exists())
+        self.assertIn(linea, order.order_line)
+        self.assertEqual(linea.product_uom_qty, 5.0)
+
+    def test_crear_encabezado_manual(self):
+        order = self._crear_pedido()
+        with self.assertRaises(UserError):
+            self.env['sale.order.line'].create({
+                'order_id': order.id,
+                'name': 'Capítulo manual',
+                'display_type': 'line_section',
+                'es_encabezado_capitulo': True,
+            })
+
+    def test_crear_nota_con_capitulos(self):
+        order = self._crear_pedido()
+        vals = {'order_id': order.id, 'name': 'Nota', 'display_type': 'line_note'}
+        # Sin capítulos, las notas y secciones estándar se siguen permitiendo
+        self.assertTrue(self.env['sale.order.line'].create(vals))
+
+        self._aplicar_plantilla(order)
+        with self.assertRaises(UserError):
+            self.env['sale.order.line'].create(vals)
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosPerf(CapitulosCase):
+
+    def test_instrumentacion_desactivada(self):
+        self._activar_perf()
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.perf_enabled', 'False')
+
+        self._aplicar_plantilla(self._crear_pedido())
+
+        self.assertEqual(self.env['capitulos.perf'].get_stats(), {'activo': False, 'metricas': {}})
+
+    def test_instrumentacion_activada(self):
+        self._activar_perf()
+
+        self._aplicar_plantilla(self._crear_pedido())
+
+        metrica = self._metrica('wizard_add_to_order')
+        self.assertEqual(metrica['llamadas'], 1)
+        self.assertEqual(metrica['lineas_creadas'], 7)
+        self.assertGreater(metrica['consultas_sql'], 0)
+        self.assertGreaterEqual(metrica['max_ms'], 0.0)
+
+        self.env['capitulos.perf'].reset_stats()
+        self.assertFalse(self.env['capitulos.perf'].get_stats()['metricas'])
+
+    def test_metricas_solo_administradores(self):
+        usuario = new_test_user(self.env, login='capitulos_perf', groups='base.group_user')
+        with self.assertRaises(AccessError):
+            self.env['capitulos.perf'].with_user(usuario).get_stats()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+CAMPOS_COMPACTOS = ('id', 'product_name', 'name', 'product_uom_qty', 'product_uom', 'price_unit', 'price_subtotal')
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosPayloadCompacto(CapitulosCase):
+
+    def _payload(self, order, formato):
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.payload_format', formato)
+        order.invalidate_recordset(['capitulos_agrupados'])
+        return json.loads(order.capitulos_agrupados)
+
+    def _decodificar(self, payload):
+        """Misma reconstrucción que ``decodeCapitulosPayload`` en el widget"""
+        datos = {}
+        for capitulo in payload['chapters']:
+            capitulo = dict(capitulo)
+            secciones = {}
+            for seccion in capitulo.pop('sections'):
+                seccion = dict(seccion)
+                columnas = seccion.pop('cols')
+                seccion['lines'] = [{
+                    'id': line_id,
+                    'product_name': payload['products'][columnas['product'][i]],
+                    'name': columnas['name'][i] if columnas['name'][i] is not None else payload['products'][columnas['product'][i]],
+                    'product_uom_qty': columnas['qty'][i],
+                    'product_uom': payload['uoms'][columnas['uom'][i]],
+                    'price_unit': columnas['price_unit'][i],
+                    'price_subtotal': columnas['price_subtotal'][i],
+                } for i, line_id in enumerate(columnas['id'])]
+                secciones[seccion.pop('name')] = seccion
+            capitulo['sections'] = secciones
+            datos[capitulo.pop('name')] = capitulo
+        return datos
+
+    def test_formato_compacto_equivale_al_completo(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        self._aplicar_plantilla(order)
+        self._lineas_producto(order)[0].with_context(from_capitulo_wizard=True).name = 'Descripción propia'
+
+        completo = self._payload(order, '1')
+        compacto = self._payload(order, '2')
+
+        self.assertEqual(compacto['v'], 2)
+        # Cada producto y unidad de medida aparece una sola vez en sus tablas
+        self.assertEqual(len(compacto['products']), len(set(compacto['products'])))
+        self.assertEqual(len(compacto['products']), 3)
+        self.assertEqual(len(compacto['uoms']), 1)
+        decodificado = self._decodificar(compacto)
+        self.assertEqual(list(decodificado), list(completo))
+        for nombre, capitulo in completo.items():
+            self.assertEqual(decodificado[nombre]['capitulo_key'], capitulo['capitulo_key'])
+            self.assertEqual(list(decodificado[nombre]['sections']), list(capitulo['sections']))
+            for nombre_seccion, seccion in capitulo['sections'].items():
+                seccion_decodificada = decodificado[nombre]['sections'][nombre_seccion]
+                self.assertEqual(seccion_decodificada['seccion_key'], seccion['seccion_key'])
+                self.assertEqual(seccion_decodificada['amount_untaxed'], seccion['amount_untaxed'])
+                self.assertEqual(
+                    [{campo: line[campo] for campo in CAMPOS_COMPACTOS} for line in seccion_decodificada['lines']],
+                    [{campo: line[campo] for campo in CAMPOS_COMPACTOS} for line in seccion['lines']],
+                )
+
+    def test_descripcion_solo_si_difiere(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        self._lineas_producto(order)[0].with_context(from_capitulo_wizard=True).name = 'Descripción propia'
+
+        compacto = self._payload(order, '2')
+
+        nombres = [n for seccion in compacto['chapters'][0]['sections'] for n in seccion['cols']['name']]
+        self.assertEqual(nombres, ['Descripción propia', None, None])
+
+    def test_formato_no_valido(self):
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.payload_format', '7')
+        self.assertEqual(self.env['sale.order']._capitulos_formato_payload(), '1')
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import UserError
+from odoo.tests import Form, tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosPlantillas(CapitulosCase):
+
+    def _crear_desde_plantilla(self, clonar=True, **vals):
+        Capitulo = self.env['capitulo.contrato']
+        if not clonar:
+            Capitulo = Capitulo.with_context(capitulos_clonar_plantilla=False)
+        return Capitulo.create(dict({'name': 'Copia', 'plantilla_id': self.plantilla.id}, **vals))
+
+    def test_marca_desactivada_no_clona(self):
+        capitulo = self._crear_desde_plantilla(clonar=False)
+        self.assertFalse(capitulo.seccion_ids)
+        self.assertFalse(capitulo.condiciones_legales)
+
+    def test_clonar_conserva_estructura_y_precio_vivo(self):
+        capitulo = self._crear_desde_plantilla()
+        self.assertEqual(capitulo.seccion_ids.mapped('name'), ['Materiales', 'Mano de Obra'])
+        self.assertEqual(capitulo.seccion_ids.product_category_id, self.categoria)
+        self.assertEqual(capitulo.condiciones_legales, 'Condiciones de la plantilla')
+        lineas = capitulo.seccion_ids.product_line_ids
+        self.assertEqual(lineas.product_id, self.productos)
+        self.assertEqual(lineas.mapped('cantidad'), [2.0, 1.0, 3.0])
+        self.assertEqual(set(lineas.mapped('modo_precio')), {'vivo'})
+
+        self.productos[0].list_price = 15.0
+        self.assertEqual(lineas[0].precio_unitario, 15.0)
+
+    def test_clonar_congelando_precios(self):
+        capitulo = self._crear_desde_plantilla(modo_precio_copia='congelado')
+        lineas = capitulo.seccion_ids.product_line_ids
+        self.assertEqual(set(lineas.mapped('modo_precio')), {'congelado'})
+        self.assertEqual(lineas.mapped('precio_unitario'), [10.0, 20.0, 30.0])
+
+        # Cambiar el producto no afecta a la copia, y editar la copia no toca el producto
+        self.productos[0].list_price = 15.0
+        lineas[1].precio_unitario = 25.0
+        self.assertEqual(lineas[0].precio_unitario, 10.0)
+        self.assertEqual(self.productos[1].list_price, 20.0)
+
+    def test_formulario_clona_al_guardar(self):
+        """El formulario no copia secciones con el onchange: las copia la creación en bloque"""
+        with Form(self.env['capitulo.contrato']) as formulario:
+            formulario.name = 'Copia desde formulario'
+            formulario.plantilla_id = self.plantilla
+            formulario.modo_precio_copia = 'congelado'
+            self.assertFalse(formulario.seccion_ids)
+            self.assertEqual(formulario.condiciones_legales, 'Condiciones de la plantilla')
+        capitulo = formulario.record
+
+        self.assertEqual(capitulo.seccion_ids.mapped('name'), ['Materiales', 'Mano de Obra'])
+        lineas = capitulo.seccion_ids.product_line_ids
+        self.assertEqual(len(lineas), 3)
+        self.assertEqual(set(lineas.mapped('modo_precio')), {'congelado'})
+        self.assertEqual(capitulo.condiciones_legales, 'Condiciones de la plantilla')
+
+    def test_clonar_respeta_condiciones_propias(self):
+        capitulo = self._crear_desde_plantilla(condiciones_legales='Condiciones propias')
+        self.assertEqual(capitulo.condiciones_legales, 'Condiciones propias')
+        self.assertEqual(len(capitulo.seccion_ids.product_line_ids), 3)
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosDependencias(CapitulosCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Capitulo = cls.env['capitulo.contrato']
+        cls.otra_plantilla = Capitulo.create({'name': 'Otra Plantilla', 'es_plantilla': True})
+        cls.dependientes = Capitulo.create([
+            {'name': f'Dependiente {i}', 'plantilla_id': cls.plantilla.id} for i in range(3)
+        ])
+        cls.dependiente_otra = Capitulo.create({'name': 'Dependiente Otra', 'plantilla_id': cls.otra_plantilla.id})
+
+    def test_recuento_agrupado(self):
+        capitulos = self.plantilla | self.otra_plantilla | self.dependientes[0]
+        capitulos.invalidate_recordset(['capitulos_dependientes_count'])
+        self.assertEqual(capitulos.mapped('capitulos_dependientes_count'), [3, 1, 0])
+
+    def test_eliminar_varias_plantillas_desvincula_dependientes(self):
+        # El dependiente que se elimina en la misma llamada no se desvincula
+        (self.plantilla | self.otra_plantilla | self.dependientes[0]).unlink()
+        restantes = self.dependientes[1:] | self.dependiente_otra
+        self.assertEqual(restantes.exists(), restantes)
+        self.assertFalse(restantes.plantilla_id)
+        self.assertFalse(self.dependientes[0].exists())
+
+    def test_eliminar_forzado(self):
+        accion = self.plantilla.action_eliminar_plantilla_forzado()
+        self.assertFalse(self.plantilla.exists())
+        self.assertFalse(self.dependientes.plantilla_id)
+        self.assertIn('3 capítulos', accion['params']['message'])
+        self.assertEqual(self.dependiente_otra.plantilla_id, self.otra_plantilla)
+
+        with self.assertRaises(UserError):
+            self.dependientes[0].action_eliminar_plantilla_forzado()
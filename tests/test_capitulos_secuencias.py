@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosSecuencias(CapitulosCase):
+
+    def _numerar(self, lineas, secuencias):
+        for linea, secuencia in zip(lineas, secuencias):
+            linea.with_context(from_capitulo_wizard=True).sequence = secuencia
+
+    def _anadir_producto(self, order, seccion):
+        capitulo = self._lineas_ordenadas(order).filtered('es_encabezado_capitulo')[:1]
+        respuesta = order.add_product_to_section(
+            order.id, capitulo.name, seccion.name, self.productos[2].id, 1.0, seccion_key=seccion.seccion_key,
+        )
+        return self.env['sale.order.line'].browse(respuesta['line_id'])
+
+    def test_insertar_en_hueco_sin_desplazar(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        secuencias = {line.id: line.sequence for line in order.order_line}
+        seccion = self._encabezados_seccion(order)[0]
+
+        nueva = self._anadir_producto(order, seccion)
+
+        self.assertEqual({line.id: line.sequence for line in order.order_line - nueva}, secuencias)
+        lineas = self._lineas_ordenadas(order)
+        self.assertEqual(lineas[list(lineas).index(seccion) + 1], nueva)
+
+    def test_renumerar_sin_hueco(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        orden = self._lineas_ordenadas(order)
+        self._numerar(orden, range(1, len(orden) + 1))
+        seccion = self._encabezados_seccion(order)[0]
+
+        nueva = self._anadir_producto(order, seccion)
+
+        lineas = self._lineas_ordenadas(order)
+        esperado = list(orden)
+        esperado.insert(esperado.index(seccion) + 1, nueva)
+        self.assertEqual(list(lineas), esperado)
+        self.assertEqual(len(set(lineas.mapped('sequence'))), len(lineas))
+
+    def test_renumerar_conserva_lineas_sin_clave(self):
+        """Las líneas sin clave dentro del capítulo conservan su posición"""
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        productos = self._lineas_producto(order)
+        nota = self.env['sale.order.line'].with_context(from_capitulo_wizard=True).create({
+            'order_id': order.id,
+            'display_type': 'line_note',
+            'name': 'Nota suelta',
+            'sequence': productos[0].sequence + 1,
+        })
+        self.assertFalse(nota.capitulo_key)
+        orden = self._lineas_ordenadas(order).ids
+
+        actualizadas = order._capitulos_renumerar_capitulo(productos[0])
+
+        self.assertTrue(actualizadas)
+        self.assertEqual(self._lineas_ordenadas(order).ids, orden)
+        secuencias = self._lineas_ordenadas(order).mapped('sequence')
+        self.assertTrue(all(b - a >= 2 for a, b in zip(secuencias, secuencias[1:])))
+
+    def test_renumerar_linea_sin_capitulo(self):
+        order = self._crear_pedido(order_line=[
+            (0, 0, {'product_id': self.productos[0].id, 'sequence': 1}),
+            (0, 0, {'product_id': self.productos[1].id, 'sequence': 2}),
+        ])
+        self._aplicar_plantilla(order)
+        orden = self._lineas_ordenadas(order)
+        self._numerar(orden, range(1, len(orden) + 1))
+
+        order._capitulos_renumerar_capitulo(orden[0])
+
+        self.assertEqual(self._lineas_ordenadas(order), orden)
+        self.assertEqual(orden[:3].mapped('sequence'), [1, 11, 21])
+
+    def test_renumerar_desplaza_capitulos_siguientes(self):
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        self._aplicar_plantilla(order)
+        orden = self._lineas_ordenadas(order)
+        self._numerar(orden, range(1, len(orden) + 1))
+
+        order._capitulos_renumerar_capitulo(orden[1])
+
+        self.assertEqual(self._lineas_ordenadas(order), orden)
+        self.assertEqual(orden.mapped('sequence'), list(range(1, 10 * len(orden), 10)))
+
+    def test_renumerar_dentro_del_capitulo(self):
+        """Si el capítulo cabe antes del siguiente, las líneas posteriores no se tocan"""
+        order = self._crear_pedido()
+        self._aplicar_plantilla(order)
+        self._aplicar_plantilla(order)
+        orden = self._lineas_ordenadas(order)
+        segundo = orden.filtered('es_encabezado_capitulo')[1]
+        self._numerar(orden, [i if line.sequence < segundo.sequence else 1000 + i for i, line in enumerate(orden, 1)])
+        posteriores = {line.id: line.sequence for line in orden if line.sequence >= 1000}
+
+        order._capitulos_renumerar_capitulo(orden[1])
+
+        self.assertEqual(self._lineas_ordenadas(order), orden)
+        self.assertEqual({line.id: line.sequence for line in orden if line.id in posteriores}, posteriores)
+        self.assertEqual(orden[:7].mapped('sequence'), list(range(1, 70, 10)))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosTarifa(CapitulosCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tarifa = cls.env['product.pricelist'].create({
+            'name': 'Tarifa Capítulos -10%',
+            'item_ids': [(0, 0, {
+                'applied_on': '2_product_category',
+                'categ_id': cls.categoria.id,
+                'compute_price': 'percentage',
+                'percent_price': 10.0,
+            })],
+        })
+
+    def _linea_estandar(self, order, producto, cantidad=1.0):
+        """Línea añadida como en el formulario del pedido: precio y descuento los calcula Odoo"""
+        return self.env['sale.order.line'].create({
+            'order_id': order.id,
+            'product_id': producto.id,
+            'product_uom_qty': cantidad,
+            'sequence': 1000,
+        })
+
+    def _assertPrecioEstandar(self, linea):
+        estandar = self._linea_estandar(linea.order_id, linea.product_id, linea.product_uom_qty)
+        self.assertAlmostEqual(linea.price_unit, estandar.price_unit)
+        self.assertAlmostEqual(linea.discount, estandar.discount)
+        self.assertAlmostEqual(linea.price_subtotal, estandar.price_subtotal)
+        self.assertEqual(linea.tax_id, estandar.tax_id)
+
+    def test_wizard_en_modo_tarifa_usa_el_precio_del_pedido(self):
+        order = self._crear_pedido(pricelist_id=self.tarifa.id)
+        self._aplicar_plantilla(order, modo_precio_pedido='tarifa')
+
+        p0, p1, p2 = self._lineas_producto(order)
+        self.assertAlmostEqual(p0.price_subtotal, 2 * 9.0)
+        self.assertAlmostEqual(p2.price_subtotal, 3 * 27.0)
+        for linea in (p0, p1, p2):
+            self._assertPrecioEstandar(linea)
+
+    def test_modo_plantilla_conserva_el_precio_del_capitulo(self):
+        order = self._crear_pedido(pricelist_id=self.tarifa.id)
+        self._aplicar_plantilla(order, modo_precio_pedido='plantilla')
+
+        p0 = self._lineas_producto(order)[0]
+        self.assertAlmostEqual(p0.price_unit, 10.0)
+        self.assertFalse(p0.discount)
+
+    def test_tarifar_secciones_no_modifica_las_recibidas(self):
+        order = self._crear_pedido(pricelist_id=self.tarifa.id)
+        secciones = self.plantilla._secciones_para_pedido()
+        tarifadas = order._capitulos_tarifar_secciones(secciones)
+
+        lineas = [linea for seccion in tarifadas for linea in seccion['lineas']]
+        self.assertEqual(len(lineas), 3)
+        self.assertEqual({linea['pricelist_item_id'] for linea in lineas}, {self.tarifa.item_ids.id})
+        self.assertAlmostEqual(lineas[0]['price_unit'] * (1 - lineas[0]['discount'] / 100), 9.0)
+        self.assertEqual(secciones[0]['lineas'][0]['price_unit'], 10.0)
+
+    def test_reglas_evaluadas_en_bloque_y_compartidas(self):
+        """Una evaluación de la tarifa por cantidad y unidad, compartida entre pedidos del mismo día"""
+        Pricelist = type(self.env['product.pricelist'])
+        orders = self._crear_pedido(pricelist_id=self.tarifa.id) | self._crear_pedido(pricelist_id=self.tarifa.id)
+        orders.date_order = orders[0].date_order
+
+        with patch.object(Pricelist, '_compute_price_rule', autospec=True,
+                          side_effect=Pricelist._compute_price_rule) as evaluar:
+            orders._capitulos_aplicar_en_lote(
+                self.plantilla, self.plantilla.name, self.plantilla._secciones_para_pedido(), modo_precio='tarifa',
+            )
+
+        # Cantidades 2, 1 y 3: tres evaluaciones para los dos pedidos
+        self.assertEqual(evaluar.call_count, 3)
+        for order in orders:
+            for linea in self._lineas_producto(order):
+                self._assertPrecioEstandar(linea)
+
+    def test_anadir_producto_en_modo_tarifa(self):
+        self.env['ir.config_parameter'].sudo().set_param('capitulos.pricing_mode', 'tarifa')
+        order = self._crear_pedido(pricelist_id=self.tarifa.id)
+        self._aplicar_plantilla(order)
+        capitulo = self._lineas_ordenadas(order).filtered('es_encabezado_capitulo')
+        seccion = self._encabezados_seccion(order)[0]
+
+        respuesta = order.add_product_to_section(
+            order.id, capitulo.name, seccion.name, self.productos[2].id, 2.0, seccion_key=seccion.seccion_key,
+        )
+
+        linea = self.env['sale.order.line'].browse(respuesta['line_id'])
+        self.assertAlmostEqual(linea.price_subtotal, 2 * 27.0)
+        self._assertPrecioEstandar(linea)
+
+    def test_lote_en_modo_tarifa_usa_la_tarifa_de_cada_pedido(self):
+        con_tarifa = self._crear_pedido(pricelist_id=self.tarifa.id)
+        sin_tarifa = self._crear_pedido()
+        orders = con_tarifa | sin_tarifa
+        orders._capitulos_aplicar_en_lote(
+            self.plantilla, self.plantilla.name, self.plantilla._secciones_para_pedido(), modo_precio='tarifa',
+        )
+
+        self.assertAlmostEqual(self._lineas_producto(con_tarifa)[0].price_subtotal, 2 * 9.0)
+        for order in orders:
+            for linea in self._lineas_producto(order):
+                self._assertPrecioEstandar(linea)
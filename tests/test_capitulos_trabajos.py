@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import AccessError
+from odoo.tests import new_test_user, tagged
+
+from .common import CapitulosCase
+
+
+@tagged('post_install', '-at_install')
+class TestCapitulosTrabajos(CapitulosCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.vendedor = new_test_user(cls.env, login='capitulos_vendedor', groups='sales_team.group_sale_salesman')
+        cls.otro_vendedor = new_test_user(cls.env, login='capitulos_otro_vendedor', groups='sales_team.group_sale_salesman')
+        cls.responsable = new_test_user(cls.env, login='capitulos_responsable', groups='sales_team.group_sale_manager')
+        cls.order = cls.env['sale.order'].create({'partner_id': cls.partner.id, 'user_id': cls.vendedor.id})
+
+    def _encolar(self, usuario):
+        wizard = self.env['capitulo.wizard'].with_user(usuario).create({
+            'order_id': self.order.id,
+            'modo_creacion': 'existente',
+            'capitulo_id': self.plantilla.id,
+            'condiciones_particulares': self.plantilla.condiciones_legales,
+            'en_segundo_plano': True,
+        })
+        return wizard._aplicar_al_pedido()
+
+    def test_encolar_y_procesar(self):
+        job = self._encolar(self.vendedor)
+
+        self.assertEqual(job._name, 'capitulo.apply.job')
+        self.assertEqual(job.user_id, self.vendedor)
+        self.assertEqual(job.state, 'pendiente')
+        self.assertFalse(self.order.order_line)
+
+        self.env['capitulo.apply.job']._cron_procesar()
+
+        self.assertEqual(job.state, 'hecho')
+        self.assertEqual(job.lineas_insertadas, job.lineas_total)
+        self.assertEqual(len(self.order.order_line), 7)
+        self.assertEqual(self.order.order_line.create_uid, self.vendedor)
+
+    def test_usuarios_solo_leen_sus_trabajos(self):
+        job = self._encolar(self.vendedor)
+        Job = self.env['capitulo.apply.job']
+
+        self.assertEqual(Job.with_user(self.vendedor).search([]), job)
+        with self.assertRaises(AccessError):
+            job.with_user(self.vendedor).write({'state': 'hecho'})
+        with self.assertRaises(AccessError):
+            job.with_user(self.vendedor).unlink()
+        self.assertFalse(Job.with_user(self.otro_vendedor).search([]))
+        self.assertEqual(Job.with_user(self.responsable).search([]), job)
+
+    def test_progreso_y_acciones_comprueban_el_pedido(self):
+        job = self._encolar(self.vendedor)
+        job.write({'state': 'error', 'mensaje_error': 'Fallo de prueba'})
+        Job = self.env['capitulo.apply.job']
+
+        progreso = Job.with_user(self.vendedor).get_order_progress(self.order.id)
+        self.assertEqual([(p['id'], p['state']) for p in progreso], [(job.id, 'error')])
+        for metodo, argumento in (
+            ('get_order_progress', self.order.id), ('retry_job', job.id), ('dismiss_job', job.id),
+        ):
+            with self.subTest(metodo=metodo), self.assertRaises(AccessError):
+                getattr(Job.with_user(self.otro_vendedor), metodo)(argumento)
+        with self.assertRaises(AccessError):
+            self._encolar(self.otro_vendedor)
+
+        Job.with_user(self.vendedor).retry_job(job.id)
+        self.assertEqual(job.state, 'pendiente')
+        job.state = 'error'
+        Job.with_user(self.vendedor).dismiss_job(job.id)
+        self.assertFalse(job.exists())
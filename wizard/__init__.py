@@ -1 +1,2 @@
 from . import capitulo_wizard
+from . import capitulo_mass_apply_wizard
@@ -0,0 +1,114 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+import logging
+
+from ..models.sale_order import MODOS_PRECIO, TAMANO_LOTE_DEFECTO
+
+_logger = logging.getLogger(__name__)
+
+class CapituloMassApplyWizardLine(models.TransientModel):
+    _name = 'capitulo.mass.apply.wizard.line'
+    _description = 'Resultado por Pedido de la Aplicación en Lote'
+    _order = 'success, id'
+
+    wizard_id = fields.Many2one('capitulo.mass.apply.wizard', ondelete='cascade')
+    order_id = fields.Many2one('sale.order', string='Pedido', readonly=True)
+    success = fields.Boolean(string='Aplicado', readonly=True)
+    lineas_creadas = fields.Integer(string='Líneas Creadas', readonly=True)
+    mensaje = fields.Text(string='Mensaje', readonly=True)
+
+class CapituloMassApplyWizard(models.TransientModel):
+    _name = 'capitulo.mass.apply.wizard'
+    _description = 'Aplicar Capítulo a Varios Pedidos'
+
+    capitulo_id = fields.Many2one('capitulo.contrato', string='Capítulo', required=True)
+    order_ids = fields.Many2many('sale.order', string='Pedidos de Venta')
+    condiciones_particulares = fields.Text(string='Condiciones Particulares')
+    modo_precio_pedido = fields.Selection(
+        MODOS_PRECIO,
+        string='Precios',
+        required=True,
+        default=lambda self: self.env['sale.order']._capitulos_modo_precio(),
+        help="Precio del Capítulo: el mismo precio en todos los pedidos.\n"
+             "Tarifa del Pedido: cada pedido recibe el precio de su propia tarifa."
+    )
+    tamano_lote = fields.Integer(
+        string='Pedidos por Lote',
+        default=TAMANO_LOTE_DEFECTO,
+        help="Número de pedidos que se insertan con una única creación y se guardan juntos. "
+             "Si un lote falla, sus pedidos se aplican uno a uno para aislar los que dan error."
+    )
+    state = fields.Selection([
+        ('borrador', 'Borrador'),
+        ('hecho', 'Aplicado'),
+    ], default='borrador')
+    resultado_ids = fields.One2many('capitulo.mass.apply.wizard.line', 'wizard_id', string='Resultado')
+    pedidos_ok = fields.Integer(string='Pedidos Actualizados', compute='_compute_resumen')
+    pedidos_error = fields.Integer(string='Pedidos con Error', compute='_compute_resumen')
+
+    @api.model
+    def default_get(self, fields):
+        res = super().default_get(fields)
+        # Pedidos seleccionados en la vista de lista
+        if self.env.context.get('active_model') == 'sale.order' and 'order_ids' in fields:
+            res['order_ids'] = [(6, 0, self.env.context.get('active_ids') or [])]
+        return res
+
+    @api.depends('resultado_ids.success')
+    def _compute_resumen(self):
+        for wizard in self:
+            wizard.pedidos_ok = len(wizard.resultado_ids.filtered('success'))
+            wizard.pedidos_error = len(wizard.resultado_ids) - wizard.pedidos_ok
+
+    @api.onchange('capitulo_id')
+    def _onchange_capitulo_id(self):
+        """Propone las condiciones legales del capítulo como condiciones particulares"""
+        self.condiciones_particulares = self.capitulo_id.condiciones_legales or False
+
+    def _guardar_resultados(self, resultados):
+        self.write({
+            'resultado_ids': [(0, 0, {
+                'order_id': order_id,
+                'success': resultado['success'],
+                'lineas_creadas': resultado['lineas'],
+                'mensaje': resultado['message'],
+            }) for order_id, resultado in resultados.items()],
+        })
+
+    def action_aplicar(self):
+        """Aplica el capítulo a todos los pedidos seleccionados y muestra el resultado por pedido.
+
+        Cada lote se guarda con su resultado en cuanto termina. Si la
+        aplicación se interrumpe, volver a lanzarla solo procesa los pedidos
+        que aún no tienen el capítulo aplicado.
+        """
+        self.ensure_one()
+        if not self.order_ids:
+            raise UserError("Debe seleccionar al menos un pedido de venta.")
+
+        # Los valores de las secciones se preparan una sola vez para todos los pedidos
+        secciones = self.capitulo_id._secciones_para_pedido()
+        if not secciones:
+            raise UserError(f"El capítulo {self.capitulo_id.name} no tiene productos para añadir a los presupuestos.")
+
+        aplicados = self.resultado_ids.filtered('success')
+        (self.resultado_ids - aplicados).unlink()
+        resultados = (self.order_ids - aplicados.order_id)._capitulos_aplicar_en_lote(
+            self.capitulo_id,
+            self.capitulo_id.name,
+            secciones,
+            condiciones=self.condiciones_particulares,
+            tamano_lote=self.tamano_lote,
+            modo_precio=self.modo_precio_pedido,
+            al_terminar_lote=self._guardar_resultados,
+        )
+        _logger.info(f"Capítulo {self.capitulo_id.id} aplicado en lote a {len(resultados)} pedidos")
+        self.state = 'hecho'
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Aplicar Capítulo a Varios Pedidos',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -1,7 +1,9 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, Command
 from odoo.exceptions import UserError
 import logging
 
+from ..models.sale_order import MODOS_PRECIO
+
 _logger = logging.getLogger(__name__)
 
 class CapituloWizardSeccion(models.TransientModel):
@@ -15,6 +17,7 @@ class CapituloWizardSeccion(models.TransientModel):
     es_fija = fields.Boolean(string='Sección Fija', default=False)
     incluir = fields.Boolean(string='Incluir en Presupuesto', default=False)
     line_ids = fields.One2many('capitulo.wizard.line', 'seccion_id', string='Productos')
+    origen_seccion_id = fields.Many2one('capitulo.seccion', string='Sección de Origen', ondelete='set null')
     
     # Campo para filtrar productos por categoría
     product_category_id = fields.Many2one(
@@ -30,8 +33,8 @@ class CapituloWizardSeccion(models.TransientModel):
         if self.product_category_id:
             # Si hay productos existentes de una categoría diferente, avisar al usuario
             if self.line_ids:
-                productos_diferentes = self.line_ids.filtered(
-                    lambda l: l.product_id and l.product_id.categ_id.id not in self.product_category_id.child_ids.ids + [self.product_category_id.id]
+                productos_diferentes = self.env['product.category']._capitulos_productos_fuera_de_categoria(
+                    self.line_ids.product_id, self.product_category_id.id
                 )
                 if productos_diferentes:
                     # Limpiar productos que no pertenecen a la nueva categoría
@@ -55,30 +58,10 @@ class CapituloWizardSeccion(models.TransientModel):
                     "2. Luego podrá añadir productos de esa categoría"
                 )
     
-    @api.constrains('product_id', 'seccion_id')
+    @api.constrains('product_category_id')
     def _check_product_category(self):
-        """Valida que el producto pertenezca a la categoría seleccionada en la sección"""
-        for record in self:
-            if record.product_id and record.seccion_id and record.seccion_id.product_category_id:
-                categoria_seccion = record.seccion_id.product_category_id
-                categoria_producto = record.product_id.categ_id
-                
-                # Verificar si el producto pertenece a la categoría o a una subcategoría
-                if categoria_producto.id not in categoria_seccion.child_ids.ids + [categoria_seccion.id]:
-                    raise UserError(
-                        f"El producto '{record.product_id.name}' no pertenece a la categoría '{categoria_seccion.name}' "
-                        f"seleccionada para esta sección.\n\n"
-                        f"Categoría del producto: {categoria_producto.name}\n"
-                        f"Categoría requerida: {categoria_seccion.name}"
-                    )
-    
-    @api.model
-    def create(self, vals):
-        """Asegurar que siempre se cree con un nombre válido"""
-        if not vals.get('name') or not vals.get('name').strip():
-            vals['name'] = 'Nueva Sección'
-        _logger.info(f"Creando sección: {vals.get('name')}")
-        return super().create(vals)
+        """Valida que los productos de las secciones pertenezcan a su categoría"""
+        self.line_ids._check_product_category()
     
     def unlink(self):
         """Permite la eliminación de secciones en el wizard"""
@@ -95,26 +78,25 @@ class CapituloWizardSeccion(models.TransientModel):
             if not record.name or not record.name.strip():
                 raise UserError("El nombre de la sección es obligatorio y no puede estar vacío.")
     
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Asegura que se establezcan valores por defecto apropiados"""
-        original_name = vals.get('name')
-        _logger.info(f"Creando sección con nombre original: '{original_name}'")
-        
-        # Solo establecer 'Nueva Sección' si realmente no hay nombre
-        if not vals.get('name') or vals.get('name').strip() == '':
-            vals['name'] = 'Nueva Sección'
-            _logger.warning(f"Nombre vacío detectado, estableciendo 'Nueva Sección'. Nombre original: '{original_name}'")
-        
-        if not vals.get('sequence'):
-            vals['sequence'] = 10
-        if 'incluir' not in vals:
-            vals['incluir'] = True
-        if 'es_fija' not in vals:
-            vals['es_fija'] = False
+        for vals in vals_list:
+            original_name = vals.get('name')
             
-        _logger.info(f"Creando sección final con nombre: '{vals['name']}', es_fija: {vals['es_fija']}")
-        return super().create(vals)
+            # Solo establecer 'Nueva Sección' si realmente no hay nombre
+            if not vals.get('name') or vals.get('name').strip() == '':
+                vals['name'] = 'Nueva Sección'
+                _logger.warning(f"Nombre vacío detectado, estableciendo 'Nueva Sección'. Nombre original: '{original_name}'")
+            
+            if not vals.get('sequence'):
+                vals['sequence'] = 10
+            if 'incluir' not in vals:
+                vals['incluir'] = True
+            if 'es_fija' not in vals:
+                vals['es_fija'] = False
+        
+        return super().create(vals_list)
     
     def unlink_seccion(self):
         """Elimina la sección"""
@@ -134,19 +116,36 @@ class CapituloWizardLine(models.TransientModel):
     es_opcional = fields.Boolean(string='Opcional', default=False)
     sequence = fields.Integer(string='Secuencia', default=10)
     
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Asegurar que siempre se establezca la relación wizard_id correctamente"""
-        # Si no se proporciona wizard_id pero sí seccion_id, obtenerlo de la sección
-        if not vals.get('wizard_id') and vals.get('seccion_id'):
-            seccion = self.env['capitulo.wizard.seccion'].browse(vals['seccion_id'])
-            if seccion.wizard_id:
-                vals['wizard_id'] = seccion.wizard_id.id
-                _logger.info(f"Estableciendo wizard_id={vals['wizard_id']} para nueva línea de producto")
+        for vals in vals_list:
+            # Si no se proporciona wizard_id pero sí seccion_id, obtenerlo de la sección
+            if not vals.get('wizard_id') and vals.get('seccion_id'):
+                seccion = self.env['capitulo.wizard.seccion'].browse(vals['seccion_id'])
+                if seccion.wizard_id:
+                    vals['wizard_id'] = seccion.wizard_id.id
         
-        line = super().create(vals)
-        _logger.info(f"Línea de producto creada: ID={line.id}, Producto={line.product_id.name if line.product_id else 'Sin producto'}, Sección={line.seccion_id.name if line.seccion_id else 'Sin sección'}")
-        return line
+        return super().create(vals_list)
+    
+    @api.constrains('product_id', 'seccion_id')
+    def _check_product_category(self):
+        """Valida que el producto pertenezca a la categoría seleccionada en la sección"""
+        Category = self.env['product.category']
+        for record in self:
+            categoria_seccion = record.seccion_id.product_category_id
+            if not record.product_id or not categoria_seccion:
+                continue
+            
+            # Verificar si el producto pertenece a la categoría o a una subcategoría de
+            # cualquier nivel (conjunto de descendientes en caché por categoría)
+            if record.product_id.categ_id.id not in Category._capitulos_ids_descendientes(categoria_seccion.id):
+                raise UserError(
+                    f"El producto '{record.product_id.name}' no pertenece a la categoría '{categoria_seccion.name}' "
+                    f"seleccionada para esta sección.\n\n"
+                    f"Categoría del producto: {record.product_id.categ_id.name}\n"
+                    f"Categoría requerida: {categoria_seccion.name}"
+                )
     
     @api.onchange('product_id')
     def _onchange_product_id(self):
@@ -155,7 +154,6 @@ class CapituloWizardLine(models.TransientModel):
             self.precio_unitario = self.product_id.list_price
             # Automáticamente marcar como incluido (aunque no sea visible en la interfaz)
             self.incluir = True
-            _logger.info(f"Producto seleccionado: {self.product_id.name}, Precio: {self.precio_unitario}, Auto-incluido: True")
         else:
             self.precio_unitario = 0.0
             self.incluir = False
@@ -180,6 +178,32 @@ class CapituloWizard(models.TransientModel):
     order_id = fields.Many2one('sale.order', string='Pedido de Venta', required=True)
     seccion_ids = fields.One2many('capitulo.wizard.seccion', 'wizard_id', string='Secciones')
     condiciones_particulares = fields.Text(string='Condiciones Particulares')
+    # Modo existente: las secciones se leen directamente de la plantilla y solo
+    # las que el usuario elige personalizar se copian al wizard
+    plantilla_seccion_ids = fields.One2many(related='capitulo_id.seccion_ids', string='Secciones del Capítulo')
+    secciones_personalizadas_ids = fields.Many2many(
+        'capitulo.seccion',
+        'capitulo_wizard_seccion_personalizada_rel',
+        'wizard_id',
+        'seccion_id',
+        string='Secciones a Personalizar',
+        domain="[('capitulo_id', '=', capitulo_id)]",
+        help="Secciones del capítulo cuyos productos quiere modificar antes de añadirlas. "
+             "El resto se añade tal como está en el capítulo."
+    )
+    modo_precio_pedido = fields.Selection(
+        MODOS_PRECIO,
+        string='Precios',
+        required=True,
+        default=lambda self: self.env['sale.order']._capitulos_modo_precio(),
+        help="Precio del Capítulo: el precio de cada línea del capítulo.\n"
+             "Tarifa del Pedido: el precio que da la tarifa del pedido para su cliente, cantidad y fecha."
+    )
+    en_segundo_plano = fields.Boolean(
+        string='Aplicar en Segundo Plano',
+        help="Inserta las líneas mediante un proceso en segundo plano que muestra su progreso en el "
+             "presupuesto. Los capítulos muy grandes se aplican siempre así."
+    )
 
     @api.model
     def default_get(self, fields):
@@ -245,6 +269,7 @@ class CapituloWizard(models.TransientModel):
             
         # Limpiar secciones usando contexto para evitar recursión
         self.with_context(skip_integrity_check=True, from_onchange=True).write({'seccion_ids': [(5, 0, 0)]})
+        self.secciones_personalizadas_ids = False
         self.condiciones_particulares = ''
         
         if not self.capitulo_id:
@@ -253,11 +278,25 @@ class CapituloWizard(models.TransientModel):
         # Cargar condiciones legales
         if self.capitulo_id.condiciones_legales:
             self.condiciones_particulares = self.capitulo_id.condiciones_legales
-            
-        # Cargar secciones del capítulo
-        if self.capitulo_id.seccion_ids:
-            self._cargar_secciones_existentes()
-        # Si no hay secciones, dejar el wizard vacío para que el usuario añada secciones manualmente
+        # Las secciones no se copian al wizard: se leen de la plantilla al añadir el capítulo
+    
+    @api.onchange('secciones_personalizadas_ids')
+    def _onchange_secciones_personalizadas_ids(self):
+        """Copia al wizard solo las secciones elegidas para personalizar"""
+        if self.modo_creacion != 'existente' or not self.capitulo_id:
+            return
+        seleccion = set(self.secciones_personalizadas_ids._origin.ids)
+        copiadas = set(self.seccion_ids.origen_seccion_id._origin.ids)
+        
+        # Las secciones que dejan de personalizarse vuelven a leerse de la plantilla
+        quitar = self.seccion_ids.filtered(
+            lambda s: s.origen_seccion_id and s.origen_seccion_id._origin.id not in seleccion
+        )
+        if quitar:
+            self.seccion_ids -= quitar
+        nuevas = seleccion - copiadas
+        if nuevas:
+            self._cargar_secciones_existentes(nuevas)
     
 
     
@@ -288,33 +327,56 @@ class CapituloWizard(models.TransientModel):
         except Exception as e:
             _logger.error(f"Error en limpieza de secciones: {e}")
     
-    def _cargar_secciones_existentes(self):
-        """Carga las secciones existentes del capítulo"""
-        secciones_vals = []
-        for seccion in self.capitulo_id.seccion_ids:
-            lineas_vals = []
-            for linea in seccion.product_line_ids:
-                lineas_vals.append((0, 0, {
-                    'product_id': linea.product_id.id,
-                    'descripcion_personalizada': linea.descripcion_personalizada,
-                    'cantidad': linea.cantidad,
-                    'precio_unitario': linea.precio_unitario,
-                    'sequence': linea.sequence,
-                    'incluir': True,  # En modo existente, incluir automáticamente todos los productos
-                    'es_opcional': linea.es_opcional,
-                }))
-            
-            secciones_vals.append((0, 0, {
-                'name': seccion.name,
-                'sequence': seccion.sequence,
+    def _cargar_secciones_existentes(self, seccion_ids=None):
+        """Carga en el wizard las secciones del capítulo (todas o solo ``seccion_ids``)"""
+        # Secciones, líneas y precios de la plantilla se leen en bloque
+        estructura = self.capitulo_id._origin._plantilla_estructura()
+        if seccion_ids is not None:
+            estructura = [seccion for seccion in estructura if seccion['id'] in seccion_ids]
+        
+        def valores_seccion(seccion):
+            return {
+                'name': seccion['name'],
+                'sequence': seccion['sequence'],
+                'origen_seccion_id': seccion['id'],
                 'es_fija': True,  # Todas las secciones de capítulos existentes son fijas
                 'incluir': True,  # En modo existente, incluir automáticamente todas las secciones
-                'product_category_id': seccion.product_category_id.id if seccion.product_category_id else False,
-                'line_ids': lineas_vals,
-            }))
+                'product_category_id': seccion['product_category_id'],
+            }
+        
+        def valores_linea(linea):
+            return {
+                'product_id': linea['product_id'],
+                'descripcion_personalizada': linea['descripcion_personalizada'],
+                'cantidad': linea['cantidad'],
+                'precio_unitario': linea['precio'],
+                'sequence': linea['sequence'],
+                'incluir': True,  # En modo existente, incluir automáticamente todos los productos
+                'es_opcional': linea['es_opcional'],
+            }
+        
+        if isinstance(self.id, models.NewId):
+            # Desde un onchange el wizard aún no existe: cargar mediante comandos
+            secciones_vals = [
+                Command.create(dict(
+                    valores_seccion(seccion),
+                    line_ids=[Command.create(valores_linea(linea)) for linea in seccion['lineas']],
+                ))
+                for seccion in estructura
+            ]
+            # Cargar secciones usando contexto para evitar recursión
+            self.with_context(skip_integrity_check=True).write({'seccion_ids': secciones_vals})
+            return
         
-        # Cargar secciones usando contexto para evitar recursión
-        self.with_context(skip_integrity_check=True).write({'seccion_ids': secciones_vals})
+        # Wizard guardado: una creación en bloque para las secciones y otra para las líneas
+        secciones = self.env['capitulo.wizard.seccion'].create([
+            dict(valores_seccion(seccion), wizard_id=self.id) for seccion in estructura
+        ])
+        self.env['capitulo.wizard.line'].create([
+            dict(valores_linea(linea), wizard_id=self.id, seccion_id=seccion.id)
+            for seccion, datos in zip(secciones, estructura)
+            for linea in datos['lineas']
+        ])
     
     def _obtener_o_crear_capitulo(self):
         """Obtiene un capítulo existente o crea uno nuevo según el modo"""
@@ -335,7 +397,10 @@ class CapituloWizard(models.TransientModel):
                 'es_plantilla': False,
             }
             
+            capitulo = self.env['capitulo.contrato'].create(capitulo_vals)
+            
             # Crear secciones del capítulo (solo las marcadas como incluir y que tienen productos)
+            secciones_wizard = self.env['capitulo.wizard.seccion']
             secciones_vals = []
             for seccion_wizard in self.seccion_ids.filtered(lambda s: s.incluir):
                 # Solo incluir secciones marcadas como incluir y que tienen productos
@@ -343,82 +408,52 @@ class CapituloWizard(models.TransientModel):
                 if productos_con_producto:
                     lineas_vals = []
                     for linea_wizard in productos_con_producto:
+                        # El precio del wizard se guarda en la línea: escribir el precio
+                        # unitario con precio vivo cambiaría el precio del producto
+                        precio_propio = linea_wizard.precio_unitario != linea_wizard.product_id.list_price
                         lineas_vals.append((0, 0, {
                             'product_id': linea_wizard.product_id.id,
                             'cantidad': linea_wizard.cantidad,
-                            'precio_unitario': linea_wizard.precio_unitario,
+                            'modo_precio': 'congelado' if precio_propio else 'vivo',
+                            'precio_congelado': linea_wizard.precio_unitario,
                             'sequence': linea_wizard.sequence,
                             'descripcion_personalizada': linea_wizard.descripcion_personalizada,
                             'es_opcional': linea_wizard.es_opcional,
                         }))
                     
                     # Crear sección con productos
-                    secciones_vals.append((0, 0, {
+                    secciones_wizard |= seccion_wizard
+                    secciones_vals.append({
+                        'capitulo_id': capitulo.id,
                         'name': seccion_wizard.name,
                         'sequence': seccion_wizard.sequence,
                         'es_fija': seccion_wizard.es_fija,
                         'product_category_id': seccion_wizard.product_category_id.id if seccion_wizard.product_category_id else False,
                         'product_line_ids': lineas_vals,
-                    }))
+                    })
             
-            capitulo_vals['seccion_ids'] = secciones_vals
-            return self.env['capitulo.contrato'].create(capitulo_vals)
+            # Las secciones se crean en el mismo orden que las del wizard, lo que
+            # permite enlazar cada sección del wizard con su sección de origen
+            secciones = self.env['capitulo.seccion'].create(secciones_vals)
+            for seccion_wizard, seccion in zip(secciones_wizard, secciones):
+                seccion_wizard.origen_seccion_id = seccion
+            return capitulo
         
         else:
             raise UserError("Modo de creación no válido")
 
-    def add_to_order(self):
-        """Añade las secciones y productos seleccionados al pedido de venta"""
-        self.ensure_one()
-        
-        if not self.order_id:
-            raise UserError("No se encontró el pedido de venta")
-        
-        # Debug: Verificar estado de las secciones antes de proceder
-        _logger.info(f"=== DEBUG add_to_order ===")
-        _logger.info(f"Wizard ID: {self.id}")
-        _logger.info(f"Número de secciones: {len(self.seccion_ids)}")
-        
-        for seccion in self.seccion_ids:
-            productos_con_producto = seccion.line_ids.filtered(lambda l: l.product_id)
-            _logger.info(f"Sección: {seccion.name} (ID: {seccion.id}), Productos: {len(seccion.line_ids)}")
-            _logger.info(f"  - Productos con producto seleccionado: {len(productos_con_producto)}")
-            
-            for line in seccion.line_ids:
-                producto_nombre = line.product_id.name if line.product_id else 'Sin producto'
-                _logger.info(f"    * ID: {line.id} | {producto_nombre}, Wizard ID: {line.wizard_id.id if line.wizard_id else 'NO ESTABLECIDO'}")
-        
+    def _obtener_secciones_con_productos(self):
+        """Devuelve las secciones del wizard que deben añadirse al pedido.
 
+        En modo existente se incluyen todas las secciones que tengan productos;
+        en modo nuevo, solo las marcadas como incluir.
+        """
+        secciones = self.seccion_ids
+        if self.modo_creacion != 'existente':
+            secciones = secciones.filtered(lambda s: s.incluir)
+        secciones_con_productos = secciones.filtered(lambda s: s.line_ids.filtered(lambda l: l.product_id))
         
-        # Validar datos del wizard antes de proceder
-        self._validate_wizard_data()
-        
-        # Verificar si hay productos para añadir
-        # En modo existente, incluir todas las secciones que tengan productos
-        # En modo nuevo, solo las secciones marcadas como incluir
-        total_productos_a_añadir = 0
-        secciones_con_productos = []
-        
-        if self.modo_creacion == 'existente':
-            # En modo existente, incluir todas las secciones que tengan productos
-            for seccion in self.seccion_ids:
-                productos_con_producto = seccion.line_ids.filtered(lambda l: l.product_id)
-                if productos_con_producto:
-                    total_productos_a_añadir += len(productos_con_producto)
-                    secciones_con_productos.append(seccion)
-        else:
-            # En modo nuevo, solo secciones marcadas como incluir
-            for seccion in self.seccion_ids.filtered(lambda s: s.incluir):
-                productos_con_producto = seccion.line_ids.filtered(lambda l: l.product_id)
-                if productos_con_producto:
-                    total_productos_a_añadir += len(productos_con_producto)
-                    secciones_con_productos.append(seccion)
-        
-        _logger.info(f"Secciones con productos: {len(secciones_con_productos)}")
-        
-        _logger.info(f"Total de productos que se van a añadir: {total_productos_a_añadir}")
-        
-        if total_productos_a_añadir == 0:
+        if not secciones_con_productos:
             if self.modo_creacion == 'existente':
                 raise UserError(
                     "No hay productos en el capítulo seleccionado para añadir al presupuesto.\n\n"
@@ -437,109 +472,123 @@ class CapituloWizard(models.TransientModel):
                     "3. Seleccione el producto, cantidad y precio\n"
                     "4. Haga clic en 'Añadir al Presupuesto'"
                 )
+        return secciones_con_productos
+    
+    def _secciones_directas(self):
+        """Secciones de un capítulo existente leídas directamente de la plantilla.
 
-        # Crear o obtener el capítulo según el modo
-        capitulo = self._obtener_o_crear_capitulo()
+        Las secciones personalizadas en el wizard sustituyen a su sección de
+        origen y las añadidas a mano van al final. Se omiten las secciones
+        sin productos.
+        """
+        personalizadas = {
+            seccion.origen_seccion_id.id: seccion
+            for seccion in self.seccion_ids if seccion.origen_seccion_id
+        }
+        secciones = []
+        for seccion in self.capitulo_id._secciones_para_pedido(incluir_vacias=True):
+            personalizada = personalizadas.get(seccion['origen_seccion_id'])
+            if personalizada:
+                secciones.extend(self._preparar_secciones(personalizada))
+            else:
+                # Todas las secciones de capítulos existentes son fijas
+                secciones.append(dict(seccion, es_fija=True))
+        secciones.extend(self._preparar_secciones(self.seccion_ids.filtered(lambda s: not s.origen_seccion_id)))
+        return [seccion for seccion in secciones if seccion['lineas']]
+    
+    def _preparar_secciones(self, secciones_wizard):
+        """Convierte las secciones del wizard en la estructura que inserta el pedido"""
+        secciones = []
+        for seccion in secciones_wizard:
+            lineas = []
+            for line in seccion.line_ids.filtered(lambda l: l.product_id):
+                lineas.append({
+                    'product_id': line.product_id.id,
+                    'name': line.descripcion_personalizada or line.product_id.name,
+                    'price_unit': line.precio_unitario,
+                    'product_uom_qty': line.cantidad,
+                    'product_uom': line.product_id.uom_id.id,
+                })
+            secciones.append({
+                'name': seccion.name,
+                'es_fija': seccion.es_fija,
+                'origen_seccion_id': seccion.origen_seccion_id.id,
+                'lineas': lineas,
+            })
+        return secciones
+    
+    def _aplicar_al_pedido(self):
+        """Valida el wizard y añade el capítulo al pedido con una única creación en bloque"""
+        self.ensure_one()
         
-        order = self.order_id
-        SaleOrderLine = self.env['sale.order.line']
+        if not self.order_id:
+            raise UserError("No se encontró el pedido de venta")
         
-        # Marcar todas las secciones como fijas después de añadir al pedido
-        for seccion in self.seccion_ids:
-            seccion.es_fija = True
-        
-        # Obtener la siguiente secuencia disponible
-        max_sequence = max(order.order_line.mapped('sequence')) if order.order_line else 0
-        current_sequence = max_sequence + 10
-        
-        # Añadir título del capítulo como encabezado principal
-        nombre_capitulo = capitulo.name if self.modo_creacion == 'existente' else self.nuevo_capitulo_nombre
-        SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-            'order_id': order.id,
-            'name': f"📋 ═══ {nombre_capitulo.upper()} ═══",
-            'product_uom_qty': 0,
-            'price_unit': 0,
-            'display_type': 'line_section',
-            'es_encabezado_capitulo': True,
-            'sequence': current_sequence,
-        })
-        current_sequence += 10
-        
-        # Crear líneas de pedido organizadas por secciones (solo secciones que tienen productos)
-        for seccion in secciones_con_productos:
-            # Añadir línea de sección como separador (siempre, incluso si no tiene productos)
-            section_line = SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-                'order_id': order.id,
-                'name': f"=== {seccion.name.upper()} ===",
-                'product_uom_qty': 0,
-                'price_unit': 0,
-                'display_type': 'line_section',
-                'es_encabezado_seccion': True,
-                'sequence': current_sequence,
-            })
-            current_sequence += 10
+        with self.env['capitulos.perf']._medir('wizard_add_to_order') as metricas:
+            # Validar datos del wizard antes de proceder
+            self._validate_wizard_data()
+            if self.modo_creacion == 'existente':
+                # Directamente desde la plantilla, sin copiar las secciones no personalizadas
+                secciones = self._secciones_directas()
+                if not secciones:
+                    # Sin productos: mismo aviso que cuando se copiaban todas las secciones
+                    self._obtener_secciones_con_productos()
+                capitulo = self._obtener_o_crear_capitulo()
+            else:
+                secciones_wizard = self._obtener_secciones_con_productos()
+                # El capítulo nuevo se crea antes de preparar las secciones: al
+                # crearlo se enlaza cada sección del wizard con su sección de origen
+                capitulo = self._obtener_o_crear_capitulo()
+                secciones = self._preparar_secciones(secciones_wizard)
+            if self.modo_precio_pedido == 'tarifa':
+                secciones = self.order_id._capitulos_tarifar_secciones(secciones)
             
-            # Si la sección es fija, marcar la línea como no editable
-            if seccion.es_fija:
-                section_line.write({'name': f"🔒 === {seccion.name.upper()} === (SECCIÓN FIJA)"})
+            # Marcar todas las secciones como fijas después de añadir al pedido
+            self.seccion_ids.write({'es_fija': True})
             
-            # Añadir productos de la sección que tengan producto seleccionado (automáticamente incluidos)
-            productos_incluidos = seccion.line_ids.filtered(lambda l: l.product_id)
+            nombre_capitulo = capitulo.name if self.modo_creacion == 'existente' else self.nuevo_capitulo_nombre
             
-            if productos_incluidos:
-                for line in productos_incluidos:
-                    descripcion = line.descripcion_personalizada or line.product_id.name
-                    
-                    vals = {
-                        'order_id': order.id,
-                        'product_id': line.product_id.id,
-                        'name': descripcion,
-                        'price_unit': line.precio_unitario,
-                        'product_uom_qty': line.cantidad,
-                        'product_uom': line.product_id.uom_id.id,
-                        'sequence': current_sequence,
-                    }
-                    
-                    product_line = SaleOrderLine.with_context(from_capitulo_wizard=True).create(vals)
-                    current_sequence += 10
-            else:
-                # Si no hay productos, añadir una línea informativa
-                SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-                    'order_id': order.id,
-                    'name': "(Sin productos añadidos en esta sección)",
-                    'product_uom_qty': 0,
-                    'price_unit': 0,
-                    'display_type': 'line_note',
-                    'sequence': current_sequence,
-                })
-                current_sequence += 10
-
-        # Nota: No añadimos el capítulo a capitulo_ids para permitir capítulos duplicados
-        # La información del capítulo se mantiene en las líneas del pedido
-        # order.write({'capitulo_ids': [(4, capitulo.id)]})
-
-        # Añadir condiciones particulares si existen
-        if self.condiciones_particulares:
-            # Añadir sección de condiciones particulares
-            condiciones_section = SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-                'order_id': order.id,
-                'name': "=== CONDICIONES PARTICULARES ===",
-                'product_uom_qty': 0,
-                'price_unit': 0,
-                'display_type': 'line_section',
-                'es_encabezado_seccion': True,
-                'condiciones_particulares': self.condiciones_particulares,  # Guardar en el campo correcto
-                'sequence': current_sequence,
-            })
-            current_sequence += 10
-
-        return {'type': 'ir.actions.act_window_close'}
-    
-
-    
-
+            if self._usar_segundo_plano(secciones):
+                job = self.order_id._capitulos_encolar_capitulo(
+                    capitulo, nombre_capitulo, secciones, condiciones=self.condiciones_particulares,
+                )
+                metricas['lineas_encoladas'] = job.lineas_total
+                return job
+            
+            # Nota: No añadimos el capítulo a capitulo_ids para permitir capítulos duplicados
+            # La información del capítulo se mantiene en las líneas del pedido
+            lines = self.order_id._capitulos_insertar_capitulo(
+                capitulo,
+                nombre_capitulo,
+                secciones,
+                condiciones=self.condiciones_particulares,
+            )
+            metricas['lineas_creadas'] = len(lines)
+        return lines
+    
+    def _usar_segundo_plano(self, secciones):
+        """Indica si el capítulo se aplica con un trabajo en segundo plano"""
+        if self.en_segundo_plano:
+            return True
+        umbral = self.env['capitulo.apply.job']._umbral_segundo_plano()
+        return umbral > 0 and sum(len(seccion['lineas']) for seccion in secciones) > umbral
     
-
+    def add_to_order(self):
+        """Añade las secciones y productos seleccionados al pedido de venta"""
+        resultado = self._aplicar_al_pedido()
+        if resultado._name == 'capitulo.apply.job':
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': "Capítulo en proceso",
+                    'message': f"Se están añadiendo {resultado.lineas_total} líneas en segundo plano. "
+                               "El presupuesto muestra el progreso.",
+                    'type': 'info',
+                    'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+                },
+            }
+        return {'type': 'ir.actions.act_window_close'}
     
     def _validate_wizard_data(self):
         """Valida que los datos del wizard sean correctos antes de proceder"""
@@ -554,17 +603,9 @@ class CapituloWizard(models.TransientModel):
             if not seccion.name or not seccion.name.strip():
                 raise UserError(f"La sección en la posición {seccion.sequence} no tiene un nombre válido.")
         
-        # Debug: Mostrar información de validación
-        secciones_con_productos = []
-        for seccion in self.seccion_ids:
-            if seccion.line_ids.filtered(lambda l: l.product_id):
-                secciones_con_productos.append(seccion)
-        
-        _logger.info(f"Validación: {len(secciones_con_productos)} secciones con productos de {len(self.seccion_ids)} total")
-        
         # En modo existente, permitir continuar aunque no haya productos añadidos aún
         # ya que el capítulo existente puede tener productos predefinidos
-        if self.modo_creacion == 'nuevo' and not secciones_con_productos:
+        if self.modo_creacion == 'nuevo' and not self.seccion_ids.line_ids.filtered(lambda l: l.product_id):
             raise UserError("Debe añadir al menos un producto en alguna sección para crear el presupuesto.")
     
     def add_seccion(self):
@@ -602,134 +643,7 @@ class CapituloWizard(models.TransientModel):
         """Añade el capítulo actual y abre el wizard para añadir otro"""
         self.ensure_one()
         
-        # Validar datos antes de proceder
-        self._validate_wizard_data()
-        
-        # Ejecutar la lógica de add_to_order sin retornar su resultado
-        # Verificar si hay productos para añadir
-        # En modo existente, incluir todas las secciones que tengan productos
-        # En modo nuevo, solo las secciones marcadas como incluir
-        total_productos_a_añadir = 0
-        secciones_con_productos = []
-        
-        if self.modo_creacion == 'existente':
-            # En modo existente, incluir todas las secciones que tengan productos
-            for seccion in self.seccion_ids:
-                productos_con_producto = seccion.line_ids.filtered(lambda l: l.product_id)
-                if productos_con_producto:
-                    total_productos_a_añadir += len(productos_con_producto)
-                    secciones_con_productos.append(seccion)
-        else:
-            # En modo nuevo, solo secciones marcadas como incluir
-            for seccion in self.seccion_ids.filtered(lambda s: s.incluir):
-                productos_con_producto = seccion.line_ids.filtered(lambda l: l.product_id)
-                if productos_con_producto:
-                    total_productos_a_añadir += len(productos_con_producto)
-                    secciones_con_productos.append(seccion)
-        
-        if total_productos_a_añadir == 0:
-            if self.modo_creacion == 'existente':
-                raise UserError(
-                    "No hay productos en el capítulo seleccionado para añadir al presupuesto.\n\n"
-                    "Para añadir productos:\n"
-                    "1. Abra las secciones del capítulo\n"
-                    "2. Añada productos usando 'Añadir una línea'\n"
-                    "3. Seleccione el producto, cantidad y precio\n"
-                    "4. Haga clic en 'Añadir al Presupuesto'"
-                )
-            else:
-                raise UserError(
-                    "No hay productos seleccionados para añadir al presupuesto.\n\n"
-                    "Para añadir productos:\n"
-                    "1. Marque las secciones que desea incluir usando el toggle 'Incluir'\n"
-                    "2. Abra cada sección y añada productos usando 'Añadir una línea'\n"
-                    "3. Seleccione el producto, cantidad y precio\n"
-                    "4. Haga clic en 'Añadir al Presupuesto'"
-                )
-
-        # Crear o obtener el capítulo según el modo
-        capitulo = self._obtener_o_crear_capitulo()
-        
-        order = self.order_id
-        SaleOrderLine = self.env['sale.order.line']
-        
-        # Marcar todas las secciones como fijas después de añadir al pedido
-        for seccion in self.seccion_ids:
-            seccion.es_fija = True
-        
-        # Obtener la siguiente secuencia disponible
-        max_sequence = max(order.order_line.mapped('sequence')) if order.order_line else 0
-        current_sequence = max_sequence + 10
-        
-        # Añadir título del capítulo como encabezado principal
-        nombre_capitulo = capitulo.name if self.modo_creacion == 'existente' else self.nuevo_capitulo_nombre
-        SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-            'order_id': order.id,
-            'name': f"📋 ═══ {nombre_capitulo.upper()} ═══",
-            'product_uom_qty': 0,
-            'price_unit': 0,
-            'display_type': 'line_section',
-            'es_encabezado_capitulo': True,
-            'sequence': current_sequence,
-        })
-        current_sequence += 10
-        
-        # Crear líneas de pedido organizadas por secciones (solo secciones que tienen productos)
-        for seccion in secciones_con_productos:
-            # Añadir línea de sección como separador
-            section_line = SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-                'order_id': order.id,
-                'name': f"=== {seccion.name.upper()} ===",
-                'product_uom_qty': 0,
-                'price_unit': 0,
-                'display_type': 'line_section',
-                'es_encabezado_seccion': True,
-                'sequence': current_sequence,
-            })
-            current_sequence += 10
-            
-            # Si la sección es fija, marcar la línea como no editable
-            if seccion.es_fija:
-                section_line.write({'name': f"🔒 === {seccion.name.upper()} === (SECCIÓN FIJA)"})
-            
-            # Añadir productos de la sección que tengan producto seleccionado
-            productos_incluidos = seccion.line_ids.filtered(lambda l: l.product_id)
-            
-            if productos_incluidos:
-                for line in productos_incluidos:
-                    descripcion = line.descripcion_personalizada or line.product_id.name
-                    
-                    vals = {
-                        'order_id': order.id,
-                        'product_id': line.product_id.id,
-                        'name': descripcion,
-                        'price_unit': line.precio_unitario,
-                        'product_uom_qty': line.cantidad,
-                        'product_uom': line.product_id.uom_id.id,
-                        'sequence': current_sequence,
-                    }
-                    
-                    product_line = SaleOrderLine.with_context(from_capitulo_wizard=True).create(vals)
-                    current_sequence += 10
-
-        # Nota: No añadimos el capítulo a capitulo_ids para permitir capítulos duplicados
-        # La información del capítulo se mantiene en las líneas del pedido
-        # order.write({'capitulo_ids': [(4, capitulo.id)]})
-
-        # Añadir condiciones particulares si existen
-        if self.condiciones_particulares:
-            # Añadir sección de condiciones particulares
-            condiciones_section = SaleOrderLine.with_context(from_capitulo_wizard=True).create({
-                'order_id': order.id,
-                'name': "=== CONDICIONES PARTICULARES ===",
-                'product_uom_qty': 0,
-                'price_unit': 0,
-                'display_type': 'line_section',
-                'es_encabezado_seccion': True,
-                'condiciones_particulares': self.condiciones_particulares,  # Guardar en el campo correcto
-                'sequence': current_sequence,
-            })
-            current_sequence += 10
+        self._aplicar_al_pedido()
         
         # Crear un nuevo wizard para añadir otro capítulo
         # Mantener el capítulo seleccionado para facilitar la adición de duplicados